@@ -0,0 +1,3 @@
+"""
+  Benchmarks of the estimators on synthetic data. See benchmarks/run.py.
+"""
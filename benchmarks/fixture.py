@@ -0,0 +1,197 @@
+"""
+  Synthetic Data Fixture
+
+  Generates every dataset in Estimator.database_tag_map at any scale, without
+  a database. Tables keyed by municipality are built from the sample files in
+  results/data by repeating the sample municipalities, with their counts
+  scaled, until there are as many as requested. The national survey tables
+  are used as they are. ES-202 has no sample file, so it is generated from the
+  NAICS codes the sectors use. MECS end use and first use consumption share
+  the layout of the mecs_ami sample.
+"""
+
+import numpy as np
+import pandas as pd
+from os import makedirs, path
+
+
+SAMPLE_DIR = path.join(path.dirname(path.dirname(path.abspath(__file__))), 'results', 'data')
+
+sample_files = {
+  'cbecs_elec': 'cbecs_elec.csv',
+  'cbecs_foil': 'cbecs_foil.csv',
+  'cbecs_ng': 'cbecs_ng.csv',
+  'cbecs_sources': 'cbecs_sources.csv',
+  'mecs_euc': 'mecs_ami.csv',
+  'mecs_fuc': 'mecs_ami.csv',
+  'mecs_fce': 'mecs_fce.csv',
+  'recs_hfc': 'recs_hfc.csv',
+  'recs_hfe': 'recs_hfe.csv',
+  'recs_sc': 'recs_sc.csv',
+  'acs_uis': 'acs_uis.csv',
+  'acs_hf': 'acs_hf.csv',
+  'masssave_ci': 'masssave_ci.csv',
+  'masssave_res': 'masssave_res.csv',
+}
+
+# Columns of the municipal tables that are identifiers rather than counts
+id_columns = ['seq_id', 'muni_id', 'logrecno', 'cal_year']
+
+# NAICS codes of the commercial Principal Building Activities, the industrial
+# subsectors and a few that no sector uses
+eowld_naics_codes = [
+  611, 445, 722, 621, 623, 721, 441, 442, 443, 444, 451, 452, 453, 532, 446, 448,
+  454, 486, 511, 516, 517, 518, 519, 521, 522, 523, 524, 525, 531, 533, 541, 551,
+  561, 624, 921, 923, 924, 925, 926, 928, 481, 482, 485, 487, 512, 515, 711, 712,
+  713, 813, 447, 483, 484, 488, 491, 492, 811, 812, 423, 424, 493,
+  311, 312, 313, 314, 315, 316, 321, 322, 323, 324, 325, 326, 327, 331, 332, 333,
+  334, 335, 336, 337, 339,
+  221, 999,
+]
+
+
+def read_sample(tag):
+  """
+    @param String tag
+
+    @return DataFrame
+  """
+
+  return pd.read_csv(path.join(SAMPLE_DIR, sample_files[tag]))
+
+
+def scale_municipalities(df, templates, municipalities, rng):
+  """
+    Repeat the sample municipalities until there are as many as requested.
+    Each copy has its counts scaled by a random factor.
+
+    @param DataFrame df             Sample table with muni_id and municipal columns
+    @param DataFrame templates      muni_id and municipal of the sample municipalities
+    @param Number municipalities
+    @param RandomState rng
+
+    @return DataFrame
+  """
+
+  muni_ids = np.arange(1, municipalities + 1)
+  copies = (muni_ids - 1) // len(templates)
+  template_rows = templates.iloc[(muni_ids - 1) % len(templates)]
+
+  names = template_rows['municipal'].values.astype(str)
+  names = np.where(copies == 0, names, np.char.add(np.char.add(names, ' '), (copies + 1).astype(str)))
+
+  mapping = pd.DataFrame({
+    'muni_id': muni_ids,
+    'municipal': names,
+    'template': template_rows['muni_id'].values,
+    'factor': np.where(copies == 0, 1.0, rng.uniform(0.5, 1.5, municipalities)),
+  })
+
+  scaled = pd.merge(mapping, df.rename(columns={'muni_id': 'template'}).drop('municipal', axis=1), on='template')
+
+  counts = [column for column in scaled.columns if scaled[column].dtype == float and not column in id_columns + ['factor']]
+  scaled[counts] = scaled[counts].multiply(scaled['factor'], axis=0).round(1)
+  scaled['seq_id'] = np.arange(1, len(scaled) + 1)
+
+  return scaled[df.columns].reset_index(drop=True)
+
+
+def masssave_years(df, years):
+  """
+    Repeat the MassSave sample years to cover the given number of years,
+    ending with the latest sample year.
+
+    @param DataFrame df
+    @param Number years
+
+    @return DataFrame
+  """
+
+  sample_years = sorted(df['cal_year'].unique())
+  last_year = sample_years[-1]
+
+  return pd.concat([
+    df[df['cal_year'] == sample_years[(year - last_year - 1) % len(sample_years)]].assign(cal_year=year)
+    for year in range(last_year - years + 1, last_year + 1)
+  ], ignore_index=True)
+
+
+def synthetic_eowld(municipalities, year, rng):
+  """
+    @param Number municipalities
+    @param Number year
+    @param RandomState rng
+
+    @return DataFrame
+  """
+
+  muni_ids = np.repeat(np.arange(1, municipalities + 1), len(eowld_naics_codes))
+  naics_codes = np.tile(eowld_naics_codes, municipalities)
+
+  # Roughly one in five industries is missing from a municipality
+  present = rng.rand(len(muni_ids)) >= 0.2
+  muni_ids = muni_ids[present]
+  naics_codes = naics_codes[present]
+
+  avgemp = rng.randint(0, 500, len(muni_ids)).astype(float)
+  estab = np.where(avgemp > 0, rng.randint(1, 50, len(muni_ids)), 0).astype(float)
+
+  return pd.DataFrame({
+    'muni_id': muni_ids,
+    'naicscode': naics_codes,
+    'naicstitle': ['NAICS {}'.format(code) for code in naics_codes],
+    'avgemp': avgemp,
+    'estab': estab,
+    'cal_year': year,
+  })
+
+
+def generate(municipalities=351, years=3, seed=0):
+  """
+    Generate every dataset at the given scale.
+
+    @param Number municipalities      Number of municipalities
+    @param Number years               Number of MassSave years, ending with the latest sample year
+    @param Number seed
+
+    @return Dict<DataFrame>
+  """
+
+  rng = np.random.RandomState(seed)
+  tables = {tag: read_sample(tag) for tag in sample_files}
+
+  # The sample municipalities are those MassSave reports on
+  templates = tables['masssave_ci'][['muni_id', 'municipal']].drop_duplicates('muni_id').sort_values('muni_id')
+
+  for tag in ['masssave_ci', 'masssave_res']:
+    tables[tag] = masssave_years(tables[tag], years)
+
+  for tag in ['acs_uis', 'acs_hf', 'masssave_ci', 'masssave_res']:
+    sample = tables[tag][tables[tag]['muni_id'].isin(templates['muni_id'])]
+    tables[tag] = scale_municipalities(sample, templates, municipalities, rng)
+
+  eowld = synthetic_eowld(municipalities, tables['masssave_ci']['cal_year'].max(), rng)
+  tables['eowld'] = pd.merge(eowld, tables['acs_uis'][['muni_id', 'municipal']].drop_duplicates('muni_id'), on='muni_id')
+
+  return tables
+
+
+def write(tables, directory):
+  """
+    Write the datasets as CSV files that can be passed as data sources.
+
+    @param Dict<DataFrame> tables
+    @param String directory
+
+    @return List<Dict<String>>    Data sources, tagged as with --file and --tag
+  """
+
+  makedirs(directory, exist_ok=True)
+  data_sources = []
+
+  for tag, df in tables.items():
+    file_path = path.join(directory, tag + '.csv')
+    df.to_csv(file_path, index=False)
+    data_sources.append({'file_path': file_path, 'tag': tag})
+
+  return data_sources
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+
+"""
+  benchmarks/run.py
+
+  Times the estimators on synthetic data at several scales, without a
+  database. Every scale is generated with benchmarks/fixture.py, and each
+  stage of the run is timed while the resident memory of the process is
+  sampled. The results are written as JSON so that runs on different commits
+  can be compared.
+
+  Memory is sampled from /proc rather than traced with tracemalloc, which
+  slows pandas down several times over. It is not reported on systems
+  without /proc.
+
+  Usage:
+
+    python -m benchmarks.run --municipalities 351,3000,30000 --years 3
+
+  Arguments:
+
+    --municipalities, -m:
+                    Comma separated numbers of municipalities to benchmark. Defaults to 351,3000,30000.
+
+    --years, -y:    Number of MassSave years. Defaults to 3.
+
+    --repeat, -r:   Runs of each scale. The fastest run is kept. Defaults to 1.
+
+    --output, -o:   File the results are written to. Defaults to benchmark-results.json.
+
+    --compare, -c:  Results of an earlier benchmark to compare every stage against.
+"""
+
+import sys
+import json
+import platform
+import subprocess
+from os import path, sysconf
+from threading import Event, Thread
+from getopt import getopt
+from time import perf_counter, process_time
+from datetime import datetime
+from tempfile import TemporaryDirectory
+import numpy as np
+import pandas as pd
+import estimators
+from estimators.estimator import Estimator, resolve_queries
+from estimators.vintage import default_vintage
+from . import fixture
+
+
+sectors = {
+  'commercial': estimators.commercial,
+  'industrial': estimators.industrial,
+  'residential': estimators.residential,
+}
+
+
+def resident_mb():
+  """
+    @return Number|None     Resident memory of the process
+  """
+
+  try:
+    with open('/proc/self/statm') as statm:
+      return int(statm.read().split()[1]) * sysconf('SC_PAGE_SIZE') / 2**20
+  except (OSError, ValueError):
+    return None
+
+
+class MemorySampler(Thread):
+  """
+    Samples the resident memory of the process until it is stopped.
+  """
+
+  def __init__(self, interval=0.005):
+    Thread.__init__(self, daemon=True)
+    self.interval = interval
+    self.stopped = Event()
+    self.start_mb = resident_mb()
+    self.peak_mb = self.start_mb
+
+
+  def run(self):
+    while not self.stopped.wait(self.interval):
+      self.peak_mb = max(self.peak_mb, resident_mb())
+
+
+  def stop(self):
+    self.stopped.set()
+    self.join()
+
+    if self.start_mb is not None:
+      self.peak_mb = max(self.peak_mb, resident_mb())
+
+
+def measure(stage, fn):
+  """
+    Run a stage while measuring its wall time, CPU time and peak memory.
+
+    @param String stage
+    @param Function fn
+
+    @return Tuple<Any,Dict>
+  """
+
+  sampler = MemorySampler()
+  if sampler.start_mb is not None:
+    sampler.start()
+
+  wall_start = perf_counter()
+  cpu_start = process_time()
+
+  result = fn()
+
+  timing = {
+    'seconds': perf_counter() - wall_start,
+    'cpu_seconds': process_time() - cpu_start,
+    'peak_mb': None,
+    'growth_mb': None,
+  }
+
+  if sampler.start_mb is not None:
+    sampler.stop()
+    timing['peak_mb'] = sampler.peak_mb
+    timing['growth_mb'] = sampler.peak_mb - sampler.start_mb
+
+  print('  {:<12} {:>8.2f}s {:>10} MB peak'.format(stage, timing['seconds'], '{:.1f}'.format(timing['peak_mb']) if timing['peak_mb'] else '-'))
+
+  return result, timing
+
+
+def run(data_sources):
+  """
+    Run every stage once on the given data sources.
+
+    @param List<Dict<String>> data_sources
+
+    @return Dict
+  """
+
+  Estimator.loaded_data.clear()
+  Estimator.load_report.clear()
+  Estimator.artifact_store = estimators.ArtifactStore()
+
+  vintages = [default_vintage]
+  stages = {}
+
+  required_datasets = [
+    (tag, resolve_queries(processor.dataset_queries, vintages).get(tag))
+    for processor in list(sectors.values()) + [estimators.ci_munger]
+    for tag in processor.dataset_tags
+  ]
+
+  _, stages['load'] = measure('load', lambda: Estimator.prefetch(required_datasets, data_sources))
+
+  sector_data = {}
+  for sector, processor in sectors.items():
+    sector_data[sector], stages[sector] = measure(sector, lambda: processor(data_sources, vintages))
+    stages[sector]['rows'] = len(sector_data[sector])
+
+  sector_data, stages['ci_munger'] = measure('ci_munger', lambda: estimators.ci_munger(data_sources, sector_data, vintages))
+  stages['ci_munger']['rows'] = len(sector_data['commercial']) + len(sector_data['industrial'])
+
+  with TemporaryDirectory() as directory:
+    _, stages['publish'] = measure('publish', lambda: [
+      estimators.write_csv(df, path.join(directory, sector+'-data.csv'))
+      for sector, df in sector_data.items()
+    ])
+
+  stages['load']['datasets'] = dict(Estimator.load_report)
+
+  return stages
+
+
+def benchmark(municipalities, years, repeat=1):
+  """
+    @param Number municipalities
+    @param Number years
+    @param Number repeat
+
+    @return Dict
+  """
+
+  print('Benchmarking {} municipalities over {} MassSave years...'.format(municipalities, years))
+
+  tables = fixture.generate(municipalities, years)
+
+  with TemporaryDirectory() as directory:
+    data_sources = fixture.write(tables, directory)
+    runs = [run(data_sources) for i in range(repeat)]
+
+  # Keep the fastest run of every stage
+  stages = {stage: min((run[stage] for run in runs), key=lambda timing: timing['seconds']) for stage in runs[0]}
+
+  return {
+    'municipalities': municipalities,
+    'years': years,
+    'rows': {tag: len(df) for tag, df in tables.items()},
+    'stages': stages,
+    'seconds': sum(timing['seconds'] for timing in stages.values()),
+  }
+
+
+def compare(results, previous):
+  """
+    Print the time of every stage relative to an earlier benchmark.
+
+    @param Dict results
+    @param Dict previous
+  """
+
+  earlier = {(scale['municipalities'], scale['years']): scale for scale in previous['scales']}
+
+  for scale in results['scales']:
+    before = earlier.get((scale['municipalities'], scale['years']))
+    if before is None:
+      continue
+
+    print('{} municipalities over {} years, against {}:'.format(scale['municipalities'], scale['years'], previous['commit']))
+
+    for stage, timing in scale['stages'].items():
+      if stage in before['stages']:
+        ratio = timing['seconds'] / before['stages'][stage]['seconds']
+        print('  {:<12} {:>8.2f}s -> {:>8.2f}s ({:+.0%})'.format(stage, before['stages'][stage]['seconds'], timing['seconds'], ratio - 1))
+
+
+def current_commit():
+  """
+    @return String|None
+  """
+
+  try:
+    repository = path.dirname(path.dirname(path.abspath(__file__)))
+    return subprocess.check_output(['git', '-C', repository, 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+if __name__ == '__main__':
+  short_options = 'm:y:r:o:c:'
+  long_options = ['municipalities=', 'years=', 'repeat=', 'output=', 'compare=']
+
+  options = getopt(sys.argv[1:], short_options, long_options)[0]
+
+  scales = [351, 3000, 30000]
+  years = 3
+  repeat = 1
+  output_path = 'benchmark-results.json'
+  compare_path = None
+
+  for opt, arg in options:
+    if opt in ['-m', '--municipalities']:
+      scales = [int(municipalities) for municipalities in arg.split(',')]
+    elif opt in ['-y', '--years']:
+      years = int(arg)
+    elif opt in ['-r', '--repeat']:
+      repeat = int(arg)
+    elif opt in ['-o', '--output']:
+      output_path = arg
+    elif opt in ['-c', '--compare']:
+      compare_path = arg
+
+  results = {
+    'commit': current_commit(),
+    'created_at': datetime.now().isoformat(),
+    'python': platform.python_version(),
+    'pandas': pd.__version__,
+    'numpy': np.__version__,
+    'scales': [benchmark(municipalities, years, repeat) for municipalities in scales],
+  }
+
+  with open(output_path, 'w') as output_file:
+    json.dump(results, output_file, indent=2, sort_keys=True)
+
+  print('Results written to {}'.format(output_path))
+
+  if compare_path:
+    with open(compare_path) as previous_file:
+      compare(results, json.load(previous_file))
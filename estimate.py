@@ -14,28 +14,101 @@
 
     --tag, -t:      This argument must follow a --file argument. If this argument does not follow a 
                     --file argument, the file will not be used. Possible file tags are eowld, 
-                    cbecs_el, cbecs_fo, cbecs_ng, cbecs_sources, mecs_fuc, mecs_euc, mecs_fce, recs_hfc,
+                    cbecs_el, cbecs_fo, cbecs_ng, mecs_fuc, mecs_euc, mecs_fce, recs_hfc,
                     recs_hfe, recs_sc, acs_uis, acs_hf, masssave_ci, masssave_res. See --file argument.
 
     --push, -p:     Pushes the generated dataset right to the receiving database instead of only writing
                     to csv files.
+
+    --refresh:      Discards every cached database table so that all tables are pulled from the database
+                    again. Tables are cached under FILES_PATH/cache after they are first pulled.
+
+    --refresh-tag:  Discards the cached table of a single tag. May be given several times.
+
+    --refresh-stale:
+                    Discards the cached tables whose rows changed in the database since they were cached,
+                    as found by a checksum of the rows.
+
+    --refresh-artifacts:
+                    Rebuilds the RECS and CBECS intensity tables. These are kept under FILES_PATH/artifacts,
+                    keyed by the hash of the tables they are built from, and are otherwise reused by every run.
+
+    --jobs, -j:     Number of sectors to process at the same time in separate processes. Defaults to 1.
+
+    --incremental:  Only recomputes the municipalities whose input rows changed since the last run and
+                    splices them into the published sector files. A change to a dataset shared by all
+                    municipalities, such as CBECS or RECS, still rebuilds everything. The cached tables with
+                    a row per municipality (eowld, acs_uis, acs_hf, masssave_ci and masssave_res) are pulled
+                    from the database again, so that revisions to them are found. Use --refresh-stale to
+                    also find revisions to the shared tables.
+
+    --sector:       Comma separated sectors to estimate, e.g. commercial. May be given several times. Selecting
+                    commercial or industrial also estimates the other, since they are calibrated to MassSave
+                    together, but only the selected sectors are published. The other sector files are kept.
+
+    --muni:         Comma separated muni_id or names of the municipalities to estimate, e.g. 35,Newton. May be
+                    given several times. Only their rows are loaded, and they are spliced into the published
+                    sector files. Neither --sector nor --muni can be combined with --incremental or --uncertainty.
+
+    --vintages:     Comma separated years to estimate, e.g. 2013,2014,2015. Every vintage is estimated
+                    from a single load of the datasets. Defaults to 2015.
+
+    --format:       Also writes each sector as compressed 'parquet' or 'arrow' files partitioned by year,
+                    with rows sorted by muni_id, under FILES_PATH/output/partitions, listed in manifest.json.
+                    May be given several times.
+
+    --export-snapshot:
+                    Writes every table the sectors use, in full, from the source backend to the given
+                    directory and exits. The directory can then be used with SOURCE_BACKEND=snapshot.
+
+    --scenarios:    Recomputes the energy and emissions of the published sector files for every set of
+                    conversion and emissions factors in the given JSON file, without estimating again, and
+                    exits. The results are written to FILES_PATH/output/scenarios.csv. See
+                    estimators/scenarios.py for the file format.
+
+    --uncertainty:  Also writes percentile bands of the energy and emissions of every municipality, year, sector
+                    and fuel to FILES_PATH/output/uncertainty.csv, from the given number of draws of the CBECS,
+                    RECS and MECS coefficients. See estimators/uncertainty.py.
+
+    --profile:      Traces the memory of every stage and profiles every sector with cProfile. The
+                    statistics are written under FILES_PATH/output/profile. Slows the run down noticeably.
+
+  Every run also writes the totals of every municipality and region by year, sector and fuel next to the
+  sectors, as municipality-rollup.csv and region-rollup.csv. Regions are defined in estimators/regions.py
+  and in the JSON file given by ROLLUP_REGIONS.
+
+  Every run writes a report of the time, rows and memory of each stage to FILES_PATH/output/run-report.json.
 """
 
 import sys
 import estimators
+from estimators.settings import settings
 from getopt import getopt
 from os import environ, makedirs, path
+from datetime import datetime
+from time import perf_counter
 from functools import reduce
-from shutil import make_archive
+import pandas as pd
+from zipfile import ZipFile, ZIP_DEFLATED
 
 FILES_PATH = environ['FILES_PATH']
 OUTPUT_DIR = path.join(FILES_PATH, 'output')
 SECTOR_DIR = path.join(OUTPUT_DIR, 'sectors')
+PARTITION_DIR = path.join(OUTPUT_DIR, 'partitions')
+ARCHIVE_PATH = path.join(OUTPUT_DIR, 'mapc-lead-estimates-data.zip')
+FINGERPRINT_PATH = path.join(OUTPUT_DIR, 'fingerprint.json')
+REPORT_PATH = path.join(OUTPUT_DIR, 'run-report.json')
+PROFILE_DIR = path.join(OUTPUT_DIR, 'profile')
+SCENARIO_OUTPUT_PATH = path.join(OUTPUT_DIR, 'scenarios.csv')
+UNCERTAINTY_PATH = path.join(OUTPUT_DIR, 'uncertainty.csv')
+CACHE_DIR = path.join(FILES_PATH, 'cache')
+ARTIFACT_DIR = path.join(FILES_PATH, 'artifacts')
+CONVERSION_DIR = path.join(CACHE_DIR, 'spreadsheets')
 
 
 # Get command line arguments
-short_options = 'f:t:p'
-long_options  = ['file=', 'tag=', 'push']
+short_options = 'f:t:pj:'
+long_options  = ['file=', 'tag=', 'push', 'refresh', 'refresh-tag=', 'refresh-stale', 'refresh-artifacts', 'jobs=', 'incremental', 'vintages=', 'format=', 'profile', 'export-snapshot=', 'scenarios=', 'uncertainty=', 'sector=', 'muni=']
 
 options = getopt(sys.argv[1:], short_options, long_options)[0]
 
@@ -52,6 +125,20 @@ data_files = []
 
 check_for_tag = False
 push_to_db = False
+refresh_all = False
+refresh_stale = False
+refresh_tags = []
+refresh_artifacts = False
+jobs = 1
+incremental = False
+vintages = [estimators.default_vintage]
+output_formats = []
+profile = False
+export_directory = None
+scenario_path = None
+uncertainty_draws = 0
+selected_sectors = None
+muni_selection = []
 
 for opt, arg in options:
 
@@ -63,6 +150,34 @@ for opt, arg in options:
 
   if opt in ['-p', '--push']:
     push_to_db = True
+  elif opt == '--refresh':
+    refresh_all = True
+  elif opt == '--refresh-tag':
+    refresh_tags.append(arg.strip())
+  elif opt == '--refresh-stale':
+    refresh_stale = True
+  elif opt == '--refresh-artifacts':
+    refresh_artifacts = True
+  elif opt in ['-j', '--jobs']:
+    jobs = int(arg)
+  elif opt == '--incremental':
+    incremental = True
+  elif opt == '--vintages':
+    vintages = [estimators.Vintage(year) for year in arg.split(',')]
+  elif opt == '--format':
+    output_formats.append(arg.strip())
+  elif opt == '--profile':
+    profile = True
+  elif opt == '--export-snapshot':
+    export_directory = arg.strip()
+  elif opt == '--scenarios':
+    scenario_path = arg.strip()
+  elif opt == '--uncertainty':
+    uncertainty_draws = int(arg)
+  elif opt == '--sector':
+    selected_sectors = (selected_sectors or []) + [sector.strip() for sector in arg.split(',')]
+  elif opt == '--muni':
+    muni_selection += [municipality.strip() for municipality in arg.split(',')]
   elif opt in ['-f', '--file']:
     data_files.append({'file_path': path.join(FILES_PATH, 'data', arg.strip()), 'tag': ''})
 
@@ -70,17 +185,193 @@ for opt, arg in options:
     check_for_tag = True 
 
 
-# Process the data
+# Narrow the run down to the selected sectors
+
+ci_sectors = ['commercial', 'industrial']
+sectors = selected_sectors or list(data_processors)
+
+for sector in sectors:
+  if not sector in data_processors:
+    sys.exit("Unknown sector '{}', expected one of {}".format(sector, ', '.join(data_processors)))
+
+# The C&I calibration pools both sectors of each municipality, so either one needs the other
+computed_processors = {
+  sector: processor for sector, processor in data_processors.items()
+  if sector in sectors or (sector in ci_sectors and any(selected in ci_sectors for selected in sectors))
+}
+calibrate_ci = all(sector in computed_processors for sector in ci_sectors)
+
+partial_run = set(sectors) != set(data_processors) or len(muni_selection) > 0
+
+if partial_run and incremental:
+  sys.exit('--incremental cannot be combined with --sector or --muni')
+
+if partial_run and uncertainty_draws:
+  sys.exit('--uncertainty needs every sector and municipality')
+
+
+# Evaluate factor scenarios over the published estimates
+
+if scenario_path:
+  scenarios = estimators.read_scenarios(scenario_path)
+  published = {sector: pd.read_csv(path.join(SECTOR_DIR, sector+'-data.csv')) for sector in data_processors}
+
+  scenario_results = estimators.evaluate_scenarios(published, scenarios)
+  estimators.write_csv(scenario_results, SCENARIO_OUTPUT_PATH)
+
+  print('Evaluated {} scenarios over {} estimates into {}'.format(len(scenarios), sum(len(df) for df in published.values()), SCENARIO_OUTPUT_PATH))
+  sys.exit()
+
+
+started_at = datetime.now()
+run_start = perf_counter()
+profiler = estimators.profiler
+
+if profile:
+  profiler.enable(PROFILE_DIR)
+
+
+# Set up the local cache of database tables
+
+snapshot_cache = estimators.SnapshotCache(CACHE_DIR)
+estimators.Estimator.snapshot_cache = snapshot_cache
+
+if refresh_all:
+  snapshot_cache.invalidate()
+else:
+  if refresh_stale:
+    refresh_tags += snapshot_cache.stale(estimators.Estimator.checksum)
 
-sector_data = {}
+  # Revised rows are only found in the database itself
+  if incremental:
+    refresh_tags += estimators.municipal_tags
 
-for sector, processor in data_processors.items():
-  print('Processing {} sector...'.format(sector))
-  sector_data[sector] = processor(data_files)
-  print('Finished {} sector!'.format(sector))
+  snapshot_cache.invalidate(refresh_tags)
 
-print('Calibrating Commercial and Industrial sectors using MassSave data...')
-sector_data = estimators.ci_munger(data_files, sector_data)
+# Spreadsheets given as files are converted once
+estimators.Estimator.conversion_cache = estimators.ConversionCache(CONVERSION_DIR)
+
+
+# Set up the intermediate tables reused across runs
+
+artifact_store = estimators.ArtifactStore(ARTIFACT_DIR)
+estimators.Estimator.artifact_store = artifact_store
+
+if refresh_artifacts:
+  artifact_store.invalidate()
+
+
+# Export a snapshot of the source backend
+
+if export_directory:
+  export_tags = sorted(set(tag for processor in list(data_processors.values()) + [estimators.ci_munger] for tag in processor.dataset_tags))
+  estimators.export_snapshot(estimators.Estimator.data_source(), export_tags, export_directory)
+  sys.exit()
+
+
+# Only the rows of the selected municipalities are loaded
+
+selected_municipalities = None
+
+if muni_selection:
+  municipalities = estimators.Estimator.load('eowld', data_files, estimators.Query(['muni_id', 'municipal']))
+  selected_municipalities = estimators.select_municipalities(muni_selection, municipalities)
+
+  estimators.Estimator.loaded_municipalities = selected_municipalities
+  estimators.Estimator.selected_municipalities = selected_municipalities
+  print('Estimating {} selected municipalities...'.format(len(selected_municipalities)))
+
+
+# Load every dataset the sectors need up front so the tables are fetched concurrently
+
+consumers = list(computed_processors.items()) + ([('ci_munger', estimators.ci_munger)] if calibrate_ci else [])
+
+required_datasets = [
+  (tag, estimators.resolve_queries(processor.dataset_queries, vintages).get(tag))
+  for name, processor in consumers
+  for tag in processor.dataset_tags
+]
+
+with profiler.stage('load') as stage:
+  estimators.Estimator.prefetch(required_datasets, data_files)
+  stage.rows_out = sum(report['rows'] for report in estimators.Estimator.load_report.values())
+
+# Snapshots of the same tags taken with queries this run did not use, e.g.
+# of other vintages, are not kept
+snapshot_cache.prune()
+
+fingerprint = estimators.fingerprint([(tag, estimators.Estimator.load(tag, data_files, query)) for tag, query in required_datasets])
+fingerprint['shared']['vintages'] = ','.join(str(vintage.year) for vintage in vintages)
+
+
+# Every dataset is released once the last stage consuming it is done
+
+for name, processor in consumers:
+  estimators.Estimator.expect(name, processor.dataset_tags, estimators.resolve_queries(processor.dataset_queries, vintages))
+
+if uncertainty_draws:
+  estimators.Estimator.loaded_data.expect('uncertainty', [
+    estimators.Estimator.dataset_key(tag, query)
+    for tag, query in required_datasets if tag in estimators.uncertainty_tags
+  ])
+
+
+# Find the municipalities to recompute
+
+sector_files = {sector: path.join(SECTOR_DIR, sector+'-data.csv') for sector in data_processors}
+changed_municipalities = None
+
+if incremental and all(path.exists(file_path) for file_path in sector_files.values()):
+  changed_municipalities = estimators.changed_municipalities(estimators.read_fingerprint(FINGERPRINT_PATH), fingerprint)
+
+if changed_municipalities is None:
+  if incremental:
+    print('Shared datasets changed or no previous run found, recomputing every municipality...')
+else:
+  print('Recomputing {} changed municipalities...'.format(len(changed_municipalities)))
+  estimators.Estimator.selected_municipalities = changed_municipalities
+
+
+# Process the data
+
+if changed_municipalities == []:
+  sector_data = {}
+elif jobs > 1:
+  sector_data = estimators.run_sectors(computed_processors, data_files, jobs, vintages)
+else:
+  sector_data = {}
+
+  for sector, processor in computed_processors.items():
+    print('Processing {} sector...'.format(sector))
+    sector_data[sector] = processor(data_files, vintages)
+    print('Finished {} sector!'.format(sector))
+
+  if calibrate_ci:
+    print('Calibrating Commercial and Industrial sectors using MassSave data...')
+    sector_data = estimators.ci_munger(data_files, sector_data, vintages)
+
+if changed_municipalities is not None:
+  sector_data = {
+    sector: estimators.splice(pd.read_csv(file_path, float_precision='round_trip'), sector_data.get(sector), changed_municipalities)
+    for sector, file_path in sector_files.items()
+  }
+
+# Only the selected sectors of a partial run are published, and the selected
+# municipalities are spliced into their published files
+carried_over = {}
+
+if partial_run:
+  sector_data = {
+    sector: estimators.splice(pd.read_csv(sector_files[sector], float_precision='round_trip'), df, selected_municipalities)
+    if selected_municipalities is not None and path.exists(sector_files[sector]) else df
+    for sector, df in sector_data.items() if sector in sectors
+  }
+
+  # The other sectors are archived and rolled up as they were published
+  carried_over = {
+    sector: pd.read_csv(file_path, float_precision='round_trip')
+    for sector, file_path in sector_files.items() if not sector in sector_data and path.exists(file_path)
+  }
 
 
 # Publish the files
@@ -88,20 +379,103 @@ sector_data = estimators.ci_munger(data_files, sector_data)
 makedirs(OUTPUT_DIR, exist_ok=True)
 makedirs(SECTOR_DIR, exist_ok=True)
 
-for sector, df in sector_data.items():
-  if push_to_db:
-    table = "mapc_lead_{}".format(sector)
-    engine = estimators.Estimator.db_engine
-    schema = "tabular"
-    
-    df.to_sql(table, engine, schema, if_exists='replace')
-    print('{} sector has been pushed to the database'.format(sector.capitalize()))
-
-  file_path = path.join(SECTOR_DIR, sector+'-data.csv')
-  df.to_csv(file_path, index=False)
+# Sectors are pushed to the source database, or to the DB_ database when reading snapshots
+if push_to_db:
+  push_target = estimators.Estimator.data_source()
 
-  print('{} sector has been published'.format(sector.capitalize()))
+  if not isinstance(push_target, estimators.DatabaseSource):
+    push_target = estimators.DatabaseSource(settings.db, estimators.Estimator.database_tag_map)
 
+# The CSV files are streamed into the archive as they are written
+archive = ZipFile(ARCHIVE_PATH, 'w', ZIP_DEFLATED) if len(sector_data) + len(carried_over) > 1 else None
+partition_manifest = {}
 
-if len(sector_data) > 1:
-    make_archive(path.join(OUTPUT_DIR, 'mapc-lead-estimates-data'), 'zip', SECTOR_DIR)
+for sector, df in sector_data.items():
+  with profiler.stage('publish ' + sector, rows_in=len(df)):
+    if push_to_db:
+      table = "mapc_lead_{}".format(sector)
+      engine = push_target.connect()
+      schema = push_target.db.SCHEMA or None
+
+      estimators.publish(df, table, engine, schema)
+      print('{} sector has been pushed to the database'.format(sector.capitalize()))
+
+    estimators.write_csv(df, sector_files[sector], archive)
+
+    for output_format in output_formats:
+      partition_manifest.setdefault(output_format, {})[sector] = estimators.write_partitioned(
+        df,
+        path.join(PARTITION_DIR, output_format, sector),
+        output_format
+      )
+
+    print('{} sector has been published'.format(sector.capitalize()))
+
+if archive is not None:
+  for sector in carried_over:
+    archive.write(sector_files[sector], path.basename(sector_files[sector]))
+
+# Totals of every municipality and region, published next to the sectors
+if sector_data:
+  with profiler.stage('rollups', rows_in=sum(len(df) for df in sector_data.values())) as stage:
+    rollups = estimators.rollup(dict(carried_over, **sector_data))
+    stage.rows_out = sum(len(df) for df in rollups.values())
+
+  for name, df in rollups.items():
+    with profiler.stage('publish {} rollup'.format(name), rows_in=len(df)):
+      if push_to_db:
+        estimators.publish(df, "mapc_lead_{}_rollup".format(name), push_target.connect(), push_target.db.SCHEMA or None)
+
+      estimators.write_csv(df, path.join(SECTOR_DIR, name+'-rollup.csv'), archive)
+
+      print('{} rollup has been published'.format(name.capitalize()))
+
+if archive is not None:
+  archive.close()
+
+# Percentile bands from draws of the survey coefficients
+if uncertainty_draws and sector_data:
+  with profiler.stage('uncertainty', rows_in=sum(len(df) for df in sector_data.values())) as stage:
+    uncertainty_datasets = {
+      tag: estimators.Estimator.load(tag, data_files, query)
+      for tag, query in required_datasets if tag in estimators.uncertainty_tags
+    }
+
+    bands = estimators.propagate_uncertainty(sector_data, uncertainty_datasets, vintages, uncertainty_draws)
+    estimators.write_csv(bands, UNCERTAINTY_PATH)
+    stage.rows_out = len(bands)
+
+  estimators.Estimator.loaded_data.release('uncertainty')
+  print('Uncertainty bands from {} draws have been published'.format(uncertainty_draws))
+
+if partition_manifest:
+  manifest_path = path.join(PARTITION_DIR, 'manifest.json')
+
+  # The partitions of the sectors left out of a partial run are kept
+  if carried_over:
+    for output_format, manifest_sectors in (estimators.read_manifest(manifest_path) or {}).items():
+      for sector, entry in manifest_sectors.items():
+        if sector in carried_over and output_format in partition_manifest:
+          partition_manifest[output_format].setdefault(sector, entry)
+
+  estimators.write_manifest(manifest_path, partition_manifest)
+
+# Only the municipalities recomputed in every sector are up to date after a partial run
+if partial_run:
+  recomputed = selected_municipalities if selected_municipalities is not None and set(sectors) == set(data_processors) else []
+  fingerprint = estimators.partial_fingerprint(estimators.read_fingerprint(FINGERPRINT_PATH), fingerprint, recomputed)
+
+estimators.write_fingerprint(FINGERPRINT_PATH, fingerprint)
+
+profiler.write(REPORT_PATH, {
+  'started_at': started_at.isoformat(),
+  'seconds': perf_counter() - run_start,
+  'arguments': sys.argv[1:],
+  'vintages': [vintage.year for vintage in vintages],
+  'jobs': jobs,
+  'recomputed_municipalities': changed_municipalities,
+  'sectors': sectors,
+  'selected_municipalities': selected_municipalities,
+  'datasets': estimators.Estimator.load_report,
+  'data_store': estimators.Estimator.loaded_data.report(),
+})
@@ -1,5 +1,21 @@
 from .commercial import commercial
 from .industrial import industrial
 from .residential import residential
-from .estimator import Estimator
+from .estimator import Estimator, resolve_queries
 from .ci_munger import ci_munger
+from .snapshot_cache import SnapshotCache
+from .conversion_cache import ConversionCache
+from .artifacts import ArtifactStore
+from .sources import DatabaseSource, SnapshotSource, create_db_engine, export_snapshot
+from .publisher import publish
+from .output import write_csv, write_partitioned, write_manifest, read_manifest
+from .rollups import rollup, load_regions
+from .scenarios import read_scenarios, evaluate as evaluate_scenarios
+from .uncertainty import propagate as propagate_uncertainty, dataset_tags as uncertainty_tags
+from .api import PublishedEstimates, QueryApi, create_server
+from .query import Query
+from .profiler import profiler
+from .parallel import run_sectors
+from .vintage import Vintage, default_vintage
+from .incremental import municipal_tags, fingerprint, read_fingerprint, write_fingerprint, changed_municipalities, partial_fingerprint, splice
+from .municipalities import select_municipalities
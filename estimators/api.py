@@ -0,0 +1,386 @@
+"""
+  Query API
+
+  Serves the published sector datasets over HTTP as JSON, read-only, from
+  memory. Every sector is loaded once and indexed by muni_id, municipal,
+  vintage and year, so a request only touches the rows it selects.
+
+    GET /health
+    GET /sectors
+    GET /sectors/<sector>?muni_id=35,36&municipal=Boston&year=2015&vintage=2015
+                         &columns=elec_con_mmbtu,ng_con_mmbtu&group_by=muni_id,year
+
+  Filters take comma separated values. group_by sums the selected columns
+  within each group. Responses carry an ETag made of the published version
+  and the request, so unchanged data is answered with 304 Not Modified when
+  the client sends it back in If-None-Match. Rendered responses are kept in
+  an LRU cache.
+
+  A run is published once its fingerprint is written, after every sector
+  file. The datasets are reloaded whenever the fingerprint changes.
+"""
+
+import json
+import numpy as np
+import pandas as pd
+from hashlib import sha1
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from datetime import datetime
+from os import path, stat
+from urllib.parse import urlsplit, parse_qsl
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from munch import Munch
+from .dtypes import compact_results
+
+
+class QueryError(ValueError):
+  pass
+
+
+class SectorIndex(object):
+
+  # Columns requests can filter on
+  index_columns = ['muni_id', 'municipal', 'vintage', 'year']
+
+  def __init__(self, df):
+    """
+      @param DataFrame df
+    """
+
+    self.df = df.reset_index(drop=True)
+    self.positions = {}
+
+    for column in self.index_columns:
+      if column in self.df.columns:
+        keys = self.df[column].astype(str).str.lower()
+        self.positions[column] = {key: np.sort(rows) for key, rows in keys.groupby(keys.values).indices.items()}
+
+
+  def select(self, filters):
+    """
+      @param Dict<List<String>> filters     Accepted values of each index column
+
+      @return DataFrame
+    """
+
+    rows = None
+
+    for column, values in filters.items():
+      if not column in self.positions:
+        raise QueryError("Cannot filter on '{}'".format(column))
+
+      matches = [self.positions[column].get(value.strip().lower(), np.empty(0, dtype=np.int64)) for value in values]
+      matches = np.unique(np.concatenate(matches))
+      rows = matches if rows is None else np.intersect1d(rows, matches, assume_unique=True)
+
+    return self.df if rows is None else self.df.iloc[rows]
+
+
+class PublishedEstimates(object):
+  """
+    The sector datasets of the latest published run.
+  """
+
+  def __init__(self, directory, sectors, marker_path, reload_interval=5):
+    """
+      @param String directory           Directory of the <sector>-data.csv files
+      @param List<String> sectors
+      @param String marker_path         File written last when a run is published
+      @param Number reload_interval     Seconds between checks for a new run
+    """
+
+    self.directory = directory
+    self.sectors = sectors
+    self.marker_path = marker_path
+    self.reload_interval = reload_interval
+
+    self.lock = Lock()
+    self.checked_at = None
+    self.marker = None
+    self.current = None
+
+    self.reload()
+
+
+  def published_marker(self):
+    """
+      @return Tuple|None
+    """
+
+    try:
+      marker = stat(self.marker_path)
+    except OSError:
+      return None
+
+    return (marker.st_mtime_ns, marker.st_size)
+
+
+  def reload(self):
+    """
+      Load the sector datasets when a new run was published since they
+      were last loaded.
+
+      @return Boolean     Whether the datasets were reloaded
+    """
+
+    with self.lock:
+      self.checked_at = monotonic()
+      marker = self.published_marker()
+
+      if self.current is not None and marker == self.marker:
+        return False
+
+      indexes = {}
+      checksum = sha1()
+
+      for sector in self.sectors:
+        file_path = path.join(self.directory, sector + '-data.csv')
+
+        if not path.exists(file_path):
+          continue
+
+        df = compact_results(pd.read_csv(file_path))
+        indexes[sector] = SectorIndex(df)
+        checksum.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+
+      # Swapped in one piece, requests keep the run they started with
+      self.marker = marker
+      self.current = Munch({
+        'version': checksum.hexdigest()[:16],
+        'published_at': datetime.fromtimestamp(marker[0] / 1e9).isoformat() if marker else None,
+        'indexes': indexes,
+      })
+
+      print("Loaded published estimates {} ({})".format(self.current.version, ', '.join(
+        '{} {} rows'.format(sector, len(index.df)) for sector, index in indexes.items()
+      )))
+
+      return True
+
+
+  def refresh(self):
+    """
+      Reload the datasets if a new run was published, checking at most once
+      every reload_interval seconds.
+
+      @return Boolean     Whether the datasets were reloaded
+    """
+
+    if monotonic() - self.checked_at < self.reload_interval:
+      return False
+
+    return self.reload()
+
+
+class ResponseCache(object):
+  """
+    Least recently used cache of rendered responses.
+  """
+
+  def __init__(self, size=256):
+    """
+      @param Number size      Responses kept at most
+    """
+
+    self.size = size
+    self.responses = OrderedDict()
+    self.lock = Lock()
+
+
+  def get(self, key):
+    with self.lock:
+      if not key in self.responses:
+        return None
+
+      self.responses.move_to_end(key)
+      return self.responses[key]
+
+
+  def put(self, key, response):
+    with self.lock:
+      self.responses[key] = response
+      self.responses.move_to_end(key)
+
+      while len(self.responses) > self.size:
+        self.responses.popitem(last=False)
+
+
+  def clear(self):
+    with self.lock:
+      self.responses.clear()
+
+
+class QueryApi(object):
+
+  def __init__(self, estimates, cache_size=256):
+    """
+      @param PublishedEstimates estimates
+      @param Number cache_size
+    """
+
+    self.estimates = estimates
+    self.cache = ResponseCache(cache_size)
+
+
+  def handle(self, url, if_none_match=None):
+    """
+      @param String url                 Path and query string of the request
+      @param String if_none_match       ETag the client already holds
+
+      @return Tuple<Number,Dict<String>,Bytes>    Status, headers and body
+    """
+
+    if self.estimates.refresh():
+      self.cache.clear()
+
+    url = urlsplit(url)
+    params = parse_qsl(url.query, keep_blank_values=True)
+    request = url.path.rstrip('/') + '?' + '&'.join('{}={}'.format(name, value) for name, value in sorted(params))
+
+    # The ETag only depends on the published version and the request, so
+    # a matching client is answered before anything is rendered
+    published = self.estimates.current
+    version = published.version
+    etag = '"{}-{}"'.format(version, sha1(request.encode('utf-8')).hexdigest()[:16])
+
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(',')]:
+      return 304, {'ETag': etag}, b''
+
+    response = self.cache.get((version, request))
+
+    if response is None:
+      try:
+        status, body = 200, self.route(published, url.path.strip('/').split('/'), params)
+      except QueryError as error:
+        status, body = 400, {'error': str(error)}
+      except KeyError as error:
+        status, body = 404, {'error': 'Not found: {}'.format(error.args[0])}
+
+      response = (status, body if isinstance(body, bytes) else json.dumps(body).encode('utf-8'))
+
+      if status == 200:
+        self.cache.put((version, request), response)
+
+    status, body = response
+    headers = {'Content-Type': 'application/json', 'Content-Length': str(len(body))}
+
+    if status == 200:
+      headers['ETag'] = etag
+      headers['Cache-Control'] = 'no-cache'
+
+    return status, headers, body
+
+
+  def route(self, published, parts, params):
+    """
+      @param Munch published            Version, publication time and indexes of the run
+      @param List<String> parts
+      @param List<Tuple<String,String>> params
+
+      @return Dict|Bytes
+    """
+
+    indexes = published.indexes
+
+    if parts == ['health']:
+      return {'status': 'ok', 'version': published.version, 'published_at': published.published_at}
+
+    if parts == ['sectors']:
+      return {
+        sector: {'rows': len(index.df), 'columns': list(index.df.columns)}
+        for sector, index in indexes.items()
+      }
+
+    if len(parts) == 2 and parts[0] == 'sectors':
+      if not parts[1] in indexes:
+        raise KeyError(parts[1])
+
+      return self.query(parts[1], indexes[parts[1]], params)
+
+    raise KeyError('/' + '/'.join(parts))
+
+
+  def query(self, sector, index, params):
+    """
+      @param String sector
+      @param SectorIndex index
+      @param List<Tuple<String,String>> params
+
+      @return Bytes
+    """
+
+    filters = {}
+    columns = None
+    group_by = []
+
+    for name, value in params:
+      values = [item for item in value.split(',') if item]
+
+      if name == 'columns':
+        columns = values
+      elif name == 'group_by':
+        group_by = values
+      else:
+        filters.setdefault(name, []).extend(values)
+
+    df = index.select(filters)
+
+    unknown = [column for column in (columns or []) + group_by if not column in df.columns]
+    if unknown:
+      raise QueryError('Unknown columns: {}'.format(', '.join(unknown)))
+
+    if group_by:
+      metrics = [
+        column for column in (columns or df.columns)
+        if not column in group_by and not column in SectorIndex.index_columns and pd.api.types.is_numeric_dtype(df[column])
+      ]
+      df = df.groupby(group_by, observed=True, sort=True)[metrics].sum().reset_index()
+    elif columns:
+      df = df[columns]
+
+    return '{{"sector":{},"rows":{},"data":{}}}'.format(
+      json.dumps(sector),
+      len(df),
+      df.to_json(orient='records')
+    ).encode('utf-8')
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+
+def create_server(api, host='0.0.0.0', port=8000):
+  """
+    @param QueryApi api
+    @param String host
+    @param Number port
+
+    @return HTTPServer
+  """
+
+  class Handler(BaseHTTPRequestHandler):
+
+    def respond(self, send_body=True):
+      status, headers, body = api.handle(self.path, self.headers.get('If-None-Match'))
+
+      self.send_response(status)
+      for name, value in headers.items():
+        self.send_header(name, value)
+      self.end_headers()
+
+      if send_body:
+        self.wfile.write(body)
+
+
+    def do_GET(self):
+      self.respond()
+
+
+    def do_HEAD(self):
+      self.respond(send_body=False)
+
+
+  return ThreadingHTTPServer((host, port), Handler)
@@ -0,0 +1,195 @@
+"""
+  Class: ArtifactStore
+
+  Keeps the intermediate tables that only depend on national survey tables,
+  such as the MA adjusted RECS intensities or the CBECS intensities of each
+  Principal Building Activity. These change only when EIA publishes a new
+  survey, so they are built once and reused by every vintage and every run.
+
+  An artifact is keyed by its name, its version, its parameters and the hash
+  of every source table it is built from. Changing the way an artifact is
+  built calls for a new version. Each artifact is written as a Feather file
+  next to a JSON description of what it was built from, so that it can be
+  inspected on its own, e.g. with pandas.read_feather.
+"""
+
+import json
+import pandas as pd
+from hashlib import sha1
+from datetime import datetime
+from threading import Lock
+from os import listdir, makedirs, path, remove, replace, getpid
+from .incremental import table_hashes
+
+
+def source_hash(df):
+  """
+    Order independent hash of a source table.
+
+    @param DataFrame df
+
+    @return String
+  """
+
+  return sha1(table_hashes(df).sort_values().values.tobytes()).hexdigest()
+
+
+class ArtifactStore(object):
+
+  def __init__(self, directory=None):
+    """
+      @param String directory     Where artifacts are persisted, defaults to keeping them in memory only
+    """
+
+    self.directory = directory
+    self.artifacts = {}
+    self.lock = Lock()
+
+    if directory:
+      makedirs(directory, exist_ok=True)
+
+
+  def key(self, name, version, sources, params={}):
+    """
+      @param String name
+      @param Number version
+      @param Dict<String> sources     Hash of each source table
+      @param Dict params
+
+      @return String
+    """
+
+    description = json.dumps([name, version, sources, params], sort_keys=True, default=str)
+    return '{}-{}'.format(name, sha1(description.encode('utf-8')).hexdigest()[:16])
+
+
+  def path(self, key, extension='feather'):
+    """
+      @param String key
+      @param String extension
+
+      @return String
+    """
+
+    return path.join(self.directory, '{}.{}'.format(key, extension))
+
+
+  def fetch(self, name, version, sources, build, params={}):
+    """
+      Return an artifact, building it only if no artifact was built from
+      the same source tables yet.
+
+      @param String name
+      @param Number version             Version of the way the artifact is built
+      @param Dict<DataFrame> sources    Source tables of the artifact, by tag
+      @param Function<[],DataFrame> build
+      @param Dict params                Other values the artifact depends on, e.g. a survey year
+
+      @return DataFrame
+    """
+
+    hashes = {tag: source_hash(df) for tag, df in sources.items()}
+    key = self.key(name, version, hashes, params)
+
+    if key in self.artifacts:
+      return self.artifacts[key]
+
+    df = self.read(key)
+
+    if df is None:
+      df = build().reset_index(drop=True)
+      self.write(key, df, {
+        'name': name,
+        'version': version,
+        'params': params,
+        'sources': hashes,
+      })
+    else:
+      print("Reusing artifact {}".format(key))
+
+    with self.lock:
+      self.artifacts[key] = df
+
+    return df
+
+
+  def read(self, key):
+    """
+      @param String key
+
+      @return DataFrame|None
+    """
+
+    if not self.directory or not path.exists(self.path(key)):
+      return None
+
+    return pd.read_feather(self.path(key))
+
+
+  def write(self, key, df, description):
+    """
+      @param String key
+      @param DataFrame df
+      @param Dict description     What the artifact was built from
+    """
+
+    if not self.directory:
+      return
+
+    description = dict(description, key=key, rows=len(df), columns=list(df.columns), built_at=datetime.now().isoformat())
+
+    def write_description(file_path):
+      with open(file_path, 'w') as description_file:
+        json.dump(description, description_file, indent=2, sort_keys=True, default=str)
+
+    # Sectors processed in parallel write their artifacts at the same time,
+    # so every file is written under a temporary name and then moved in place
+    for extension, write in [('feather', df.to_feather), ('json', write_description)]:
+      file_path = self.path(key, extension)
+      temporary_path = '{}.{}.tmp'.format(file_path, getpid())
+
+      try:
+        write(temporary_path)
+      except Exception as error:
+        print("Could not persist artifact {}: {}".format(key, error))
+
+        if path.exists(temporary_path):
+          remove(temporary_path)
+        return
+
+      replace(temporary_path, file_path)
+
+
+  def list(self):
+    """
+      @return List<Dict>      Description of every persisted artifact
+    """
+
+    if not self.directory:
+      return []
+
+    descriptions = []
+
+    for file_name in sorted(listdir(self.directory)):
+      if file_name.endswith('.json'):
+        with open(path.join(self.directory, file_name)) as description:
+          descriptions.append(json.load(description))
+
+    return descriptions
+
+
+  def invalidate(self, names=None):
+    """
+      @param List<String> names     Defaults to every artifact
+    """
+
+    with self.lock:
+      for key in list(self.artifacts):
+        if names is None or key.rsplit('-', 1)[0] in names:
+          del self.artifacts[key]
+
+    for description in self.list():
+      if names is None or description['name'] in names:
+        for extension in ['feather', 'json']:
+          if path.exists(self.path(description['key'], extension)):
+            remove(self.path(description['key'], extension))
@@ -0,0 +1,79 @@
+"""
+  MassSave Calibration
+
+  Scales sector estimates to the consumption reported by MassSave. One
+  calibrator is computed per vintage, municipality, MassSave year and fuel,
+  and the estimates are repeated for every year MassSave provides.
+"""
+
+import pandas as pd
+from .factors import year_factors
+from .profiler import profiler
+
+
+def calibrate(sector_data, masssave, municipalities, fuel_types, fuel_conversion, emissions_factors):
+  """
+    @param Dict<DataFrame> sector_data          Estimates whose fuel totals are pooled per vintage and municipality
+    @param DataFrame masssave                   MassSave consumption by muni_id and cal_year
+    @param DataFrame municipalities             vintage and muni_id of every municipality to calibrate
+    @param List<String> fuel_types
+    @param Dict fuel_conversion
+    @param Dict emissions_factors
+
+    @return Dict<DataFrame>
+  """
+
+  with profiler.stage('calibrate', rows_in=sum(len(df) for df in sector_data.values())) as stage:
+    results = calibrate_sectors(sector_data, masssave, municipalities, fuel_types, fuel_conversion, emissions_factors)
+    stage.rows_out = sum(len(df) for df in results.values())
+
+  return results
+
+
+def calibrate_sectors(sector_data, masssave, municipalities, fuel_types, fuel_conversion, emissions_factors):
+  """
+    @see calibrate
+
+    @return Dict<DataFrame>
+  """
+
+  masssave = masssave[['muni_id', 'cal_year', 'mwh_use', 'therm_use']].rename(columns={'mwh_use': 'elec', 'therm_use': 'ng'})
+  masssave['elec'] = masssave['elec'] * 1000
+
+  years = masssave['cal_year'].unique()
+
+  municipalities = municipalities[['vintage', 'muni_id']].drop_duplicates()
+  pu_columns = [fuel+'_con_pu' for fuel in fuel_types]
+
+  # Pool the consumption of every sector for each vintage and municipality
+  pu_totals = pd.concat([df[['vintage', 'muni_id'] + pu_columns] for df in sector_data.values()])
+  pu_totals = pu_totals.groupby(['vintage', 'muni_id'])[pu_columns].sum()
+  pu_totals.columns = [fuel+'_total' for fuel in fuel_types]
+
+  # One row per vintage, municipality and year, holding the calibrator of each fuel.
+  # Missing MassSave data leaves the estimates untouched.
+  calibrators = pd.concat([municipalities.assign(cal_year=year) for year in years], ignore_index=True)
+  calibrators = calibrators.sort_values(['vintage', 'muni_id'], kind='mergesort')
+  calibrators = pd.merge(calibrators, masssave.drop_duplicates(['muni_id', 'cal_year']), how='left', on=['muni_id', 'cal_year'])
+  calibrators = pd.merge(calibrators, pu_totals, how='left', left_on=['vintage', 'muni_id'], right_index=True)
+
+  calibrator_columns = [fuel+'_calibrator' for fuel in fuel_types]
+  for fuel in fuel_types:
+    calibrators[fuel+'_calibrator'] = (calibrators[fuel].astype(float) / calibrators[fuel+'_total']).fillna(1)
+
+  calibrators = calibrators[['vintage', 'muni_id', 'cal_year'] + calibrator_columns].rename(columns={'cal_year': 'year'})
+
+  results = {}
+  for sector, df in sector_data.items():
+    # Rows of municipalities that are not calibrated are dropped
+    calibrated = pd.merge(df, calibrators, on=['vintage', 'muni_id'])
+
+    for fuel in fuel_types:
+      calibrated[fuel+'_con_pu'] = calibrated[fuel+'_con_pu'] * calibrated[fuel+'_calibrator']
+      calibrated[fuel+'_exp_dollar'] = calibrated[fuel+'_exp_dollar'] * calibrated[fuel+'_calibrator']
+      calibrated[fuel+'_con_mmbtu'] = calibrated[fuel+'_con_pu'] * year_factors(fuel_conversion[fuel], calibrated['year'])
+      calibrated[fuel+'_emissions_co2'] = calibrated[fuel+'_con_pu'] * year_factors(emissions_factors[fuel], calibrated['year'])
+
+    results[sector] = calibrated.drop(calibrator_columns, axis=1)
+
+  return results
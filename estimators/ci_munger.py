@@ -9,22 +9,34 @@
 import pandas as pd
 import numpy as np
 from functools import reduce
-from .estimator import Estimator
-
-
-def ci_munger(data_sources, sector_data):
+from .estimator import Estimator, requires
+from .calibration import calibrate
+from .factors import fuel_conversion, emissions_factors
+from .query import Query
+from .vintage import default_vintage
+
+
+@requires(
+  eowld=Query(['muni_id', 'municipal']),
+  masssave_ci=Query(['muni_id', 'municipal', 'cal_year', 'mwh_use', 'therm_use']),
+)
+def ci_munger(data_sources, sector_data, vintages=None):
   """
     @param List<Dict<String>> data_sources
     @param <Dict<String>> sector_data
+    @param List<Vintage> vintages     Defaults to the default vintage
 
     @return <Dict<String>>
   """
+
+  vintages = vintages or [default_vintage]
   
   fuel_types = ['elec', 'ng']
 
   com_col_order = [
     'muni_id',
     'municipal',
+    'vintage',
     'year',
     'activity',
     'elec_con_pu',
@@ -45,6 +57,7 @@ def ci_munger(data_sources, sector_data):
   ind_col_order = [
     'muni_id',
     'municipal',
+    'vintage',
     'year',
     'naicstitle',
     'elec_con_pu',
@@ -65,24 +78,6 @@ def ci_munger(data_sources, sector_data):
     'total_con_mmbtu'
   ]
 
-  fuel_conversion = {
-    'elec': {
-      2013: 0.006841,
-      2014: 0.007692, 
-      2015: 0.006707,
-    },
-    'ng': 0.1,
-  }
-
-  emissions_factors = {
-    'elec': {
-      2013: .93,     
-      2014: .941,
-      2015: .857,
-    },
-    'ng': 11.710
-  }
-
 
   def methodology(datasets):
     """
@@ -91,59 +86,33 @@ def ci_munger(data_sources, sector_data):
       @return DataFrame 
     """
 
-    masssave_ci_all = pd.DataFrame(datasets['masssave_ci'])
-    masssave_ci_all = masssave_ci_all[['municipal', 'cal_year', 'mwh_use', 'therm_use']].rename(columns={'mwh_use': 'elec', 'therm_use': 'ng'})
-    masssave_ci_all['elec'] *= 1000
-
-    years = masssave_ci_all['cal_year'].unique()
-    latest_year = years[-1]
-
-    sectors = {
-      'commercial': pd.DataFrame(),
-      'industrial': pd.DataFrame(),
-    }
-
-    for municipality in datasets['eowld']['municipal'].unique():
-      masssave_ci = masssave_ci_all[masssave_ci_all['municipal'] == municipality]
-      muni_data = {
-        'commercial': sector_data['commercial'][sector_data['commercial']['municipal'] == municipality],
-        'industrial': sector_data['industrial'][sector_data['industrial']['municipal'] == municipality],
-      }
-
-      pu_totals = {}
-      for fuel in fuel_types:
-        pu_totals[fuel] = muni_data['commercial'][fuel+'_con_pu'].sum() + muni_data['industrial'][fuel+'_con_pu'].sum()
-
-      for year in years:
-        masssave = masssave_ci[masssave_ci['cal_year'] == year]
-
-        for sector in sectors.keys():
-          muni_sector_data = muni_data[sector].copy()
-
-          for fuel in fuel_types:
-            ratio = (masssave[fuel] / pu_totals[fuel]).values
-            calibrator = ratio[0] if len(ratio) > 0 and not np.isnan(ratio[0]) else 1
-
-            muni_sector_data[fuel+'_con_pu'] = muni_sector_data[fuel+'_con_pu'].apply(lambda x: x * calibrator)
-            muni_sector_data[fuel+'_exp_dollar'] = muni_sector_data[fuel+'_exp_dollar'].apply(lambda x: x * calibrator)
-            muni_sector_data[fuel+'_con_mmbtu'] = muni_sector_data[fuel+'_con_pu'] * (fuel_conversion['elec'][year] or fuel_conversion['elec'][latest_year]) if fuel == 'elec' else muni_sector_data[fuel+'_con_pu'] * fuel_conversion[fuel]
-            muni_sector_data[fuel+'_emissions_co2'] = muni_sector_data[fuel+'_con_pu'] * (emissions_factors['elec'][year] or emissions_factors['elec'][latest_year]) if fuel == 'elec' else muni_sector_data[fuel+'_con_pu'] * emissions_factors[fuel]
-
-          muni_sector_data['year'] = year
-
-          sectors[sector] = sectors[sector].append(muni_sector_data, ignore_index=True)
-
-    sectors['commercial'].sort_values(['municipal', 'year', 'activity'], inplace=True)
-    sectors['industrial'].sort_values(['municipal', 'year', 'naics_code'], inplace=True)
-
-    results = {
-      'commercial': sectors['commercial'][com_col_order],
-      'industrial': sectors['industrial'][ind_col_order],
-      'residential': sector_data['residential']
-    }
+    municipalities = pd.concat([
+      pd.DataFrame({'vintage': vintage.year, 'muni_id': datasets['eowld']['muni_id'].unique()})
+      for vintage in vintages
+    ])
+
+    sectors = calibrate(
+      {
+        'commercial': sector_data['commercial'],
+        'industrial': sector_data['industrial'],
+      },
+      datasets['masssave_ci'],
+      municipalities,
+      fuel_types,
+      fuel_conversion,
+      emissions_factors
+    )
+
+    sectors['commercial'].sort_values(['vintage', 'municipal', 'year', 'activity'], inplace=True)
+    sectors['industrial'].sort_values(['vintage', 'municipal', 'year', 'naics_code'], inplace=True)
+
+    # Any other sector is passed through untouched
+    results = dict(sector_data)
+    results['commercial'] = sectors['commercial'][com_col_order]
+    results['industrial'] = sectors['industrial'][ind_col_order]
 
     return results
 
 
   # Construct the Estimator from the methodology and then process the data sources
-  return Estimator(methodology)(data_sources)
+  return Estimator(methodology, ci_munger.dataset_tags, ci_munger.dataset_queries)(data_sources)
@@ -4,17 +4,33 @@
 
 import pandas as pd
 import numpy as np
-from functools import reduce
-from .estimator import Estimator
-
-
-def commercial(data_sources):
+from .estimator import Estimator, requires, resolve_queries
+from .query import Query
+from .profiler import profiler
+from .vintage import default_vintage
+
+
+cbecs_query = Query(['years', 'activity', 'c_blg', 'e_blg', 'c_perwrkr', 'e_kwh'])
+
+@requires(
+  eowld=lambda vintages: Query(
+    ['muni_id', 'municipal', 'cal_year', 'naicscode', 'avgemp', 'estab'],
+    [('naicscode', '>=', 400), ('naicscode', '<=', 1000), ('cal_year', 'in', [vintage.year for vintage in vintages])]
+  ),
+  cbecs_elec=cbecs_query,
+  cbecs_ng=cbecs_query,
+  cbecs_foil=cbecs_query,
+)
+def commercial(data_sources, vintages=None):
   """
     @param List<Dict<String>> data_sources
+    @param List<Vintage> vintages     Defaults to the default vintage
 
     @return DataFrame
   """
 
+  vintages = vintages or [default_vintage]
+
   pba_naics_groups = {
     'education': [611],
     'food sales': [445],
@@ -53,6 +69,7 @@ def commercial(data_sources):
   col_order = [
     'muni_id',
     'municipal',
+    'vintage',
     'activity',
     'elec_con_per_b',
     'elec_exp_per_b',
@@ -90,177 +107,156 @@ def commercial(data_sources):
   }
 
 
-  def methodology(datasets):
-    """
-      @param Dict<DataFrame> datasets
+  # NAICS code to Principal Building Activity lookup table
+  pba_naics_lookup = pd.DataFrame(
+    [(naics_code, pba) for pba, naics_codes in pba_naics_groups.items() for naics_code in naics_codes],
+    columns=['naicscode', 'activity']
+  )
 
-      @return DataFrame 
-    """
 
+  def cbecs_intensities(datasets, year):
     """
-      Step 1 in Methodology
-    """
-    eowld = datasets['eowld']
-    eowld = eowld[(eowld['naicscode'].astype(int) >= 400) & (eowld['naicscode'].astype(int) <= 1000) & (eowld['cal_year'].astype(int) == 2015)]
-    eowld_snapshot = eowld[['muni_id', 'municipal', 'naicscode', 'avgemp', 'estab']]
-
-    results = pd.DataFrame()
-
-    for municipality in eowld['municipal'].unique():
-      eowld = pd.DataFrame(eowld_snapshot[eowld_snapshot['municipal'] == municipality])
-      muni_id = eowld['muni_id'].unique()[0]
-
-      pba_stats = {}
-      for pba, naics_codes in pba_naics_groups.items():
-        pba_stats[pba] = eowld[eowld['naicscode'].astype(int).isin(naics_codes)].sum()[['avgemp', 'estab']].fillna(0)
+      Prepare the CBECS consumption and expenditure intensities of each
+      Principal Building Activity. These do not depend on the municipality.
 
+      @param Dict<DataFrame> datasets
+      @param Number year      CBECS survey year
 
-      """
-        Step 2 in Methodology
-      """
+      @return DataFrame
+    """
 
-      # Pull in the CBECS datasets
-      cbecs = {}
-      for fuel in fuel_types:
-        column_map = {
-          'c_blg': fuel+'_con_per_b',
-          'e_blg': fuel+'_exp_per_b',
-          'c_perwrkr': fuel+'_con_per_w',
-          'e_kwh': fuel+'_exp_per_unit',
-        }
+    # Pull in the CBECS datasets
+    cbecs = {}
+    for fuel in fuel_types:
+      column_map = {
+        'c_blg': fuel+'_con_per_b',
+        'e_blg': fuel+'_exp_per_b',
+        'c_perwrkr': fuel+'_con_per_w',
+        'e_kwh': fuel+'_exp_per_unit',
+      }
 
-        cbecs[fuel] = pd.DataFrame(datasets['cbecs_'+fuel][['activity'] + list(column_map)])
-        cbecs[fuel]['activity'] = cbecs[fuel]['activity'].str.strip().str.lower()
-        cbecs[fuel].rename(columns=column_map, inplace=True)
-        cbecs[fuel][fuel+'_con_per_b'] = cbecs[fuel][fuel+'_con_per_b'].apply(pd.to_numeric)
+      cbecs[fuel] = datasets['cbecs_'+fuel]
+      cbecs[fuel] = pd.DataFrame(cbecs[fuel][cbecs[fuel]['years'] == year][['activity'] + list(column_map)])
+      cbecs[fuel] = cbecs[fuel].rename(columns=column_map)
 
-        if fuel == 'elec':
-          cbecs[fuel][fuel+'_con_per_w'] = cbecs[fuel][fuel+'_con_per_w'] * 1000
+      if fuel == 'elec':
+        cbecs[fuel][fuel+'_con_per_w'] = cbecs[fuel][fuel+'_con_per_w'] * 1000
 
-        # Use Option 2 in methodology for replacing missing values in each column (except for fuel oil)
+      # Use Option 2 in methodology for replacing missing values in each column (except for fuel oil)
+      if fuel != 'foil':
         for column_name in column_map.values():
-          column_avg = cbecs[fuel][column_name].mean()
-
-          if fuel != 'foil':
-            cbecs[fuel][column_name].fillna(column_avg, inplace=True)
-
-      # For fuel oil, use Option 1 in methodology for replacing missing values using natural gas for the ratios
-      office_ng = cbecs['ng'].loc[cbecs['ng']['activity'] == 'office', 'ng_con_per_b'].values[0]
-      office_con_foil = cbecs['foil'].loc[cbecs['foil']['activity'] == 'office', 'foil_con_per_b'].values[0]
-      office_exp_foil = cbecs['foil'].loc[cbecs['foil']['activity'] == 'office', 'foil_exp_per_b'].values[0]
-      cbecs['foil']['ng_delta'] = (cbecs['ng']['ng_con_per_b'] - office_ng) / cbecs['ng']['ng_con_per_b']
-
-      cbecs['foil']['foil_con_per_b'] = cbecs['foil'].apply(
-        lambda row: office_con_foil + (office_con_foil * row['ng_delta']) if np.isnan(row['foil_con_per_b']) else row['foil_con_per_b'],
-        axis=1
-      )
+          cbecs[fuel][column_name] = cbecs[fuel][column_name].fillna(cbecs[fuel][column_name].mean())
 
-      cbecs['foil']['foil_exp_per_b'] = cbecs['foil'].apply(
-        lambda row: office_exp_foil + (office_exp_foil * row['ng_delta']) if np.isnan(row['foil_exp_per_b']) else row['foil_exp_per_b'],
-        axis=1
-      )
+    # For fuel oil, use Option 1 in methodology for replacing missing values using natural gas for the ratios
+    office_ng = cbecs['ng'].loc[cbecs['ng']['activity'] == 'office', 'ng_con_per_b'].values[0]
+    office_con_foil = cbecs['foil'].loc[cbecs['foil']['activity'] == 'office', 'foil_con_per_b'].values[0]
+    office_exp_foil = cbecs['foil'].loc[cbecs['foil']['activity'] == 'office', 'foil_exp_per_b'].values[0]
+    cbecs['foil']['ng_delta'] = (cbecs['ng']['ng_con_per_b'] - office_ng) / cbecs['ng']['ng_con_per_b']
 
-      # Compose the datasets into a single DataFrame 
-      current_result = None
-      for i, fuel in enumerate(fuel_types):
-        if i == 0:
-          current_result = pd.DataFrame(cbecs[fuel][cbecs[fuel]['activity'].isin(pba_naics_groups.keys())])
-        else:
-          current_result = pd.merge(current_result, cbecs[fuel], on='activity')
-        
-      current_result['emps'] = current_result['activity'].apply(lambda x: pba_stats[x.strip()]['avgemp'])
-      current_result['estabs'] = current_result['activity'].apply(lambda x: pba_stats[x.strip()]['estab'])
-
-      current_result['foil_con_per_w'] = current_result.apply(
-        lambda row: row['foil_con_per_b'] / (row['emps'] / row['estabs']) if np.isnan(row['foil_con_per_w']) and row['estabs'] != 0 else row['foil_con_per_w'],
-        axis=1
-      )
+    cbecs['foil']['foil_con_per_b'] = cbecs['foil']['foil_con_per_b'].fillna(office_con_foil + (office_con_foil * cbecs['foil']['ng_delta']))
+    cbecs['foil']['foil_exp_per_b'] = cbecs['foil']['foil_exp_per_b'].fillna(office_exp_foil + (office_exp_foil * cbecs['foil']['ng_delta']))
 
-      for fuel in fuel_types:
-        current_result[fuel+'_exp_per_w'] = (current_result[fuel+'_exp_per_b'] / (current_result['emps'] / current_result['estabs'])) * 1000
-        current_result[fuel+'_exp_per_w'].replace(np.inf, 0, inplace=True)
+    # Compose the datasets into a single DataFrame
+    intensities = pd.DataFrame(cbecs['elec'][cbecs['elec']['activity'].isin(pba_naics_groups.keys())])
+    for fuel in fuel_types[1:]:
+      intensities = pd.merge(intensities, cbecs[fuel], on='activity')
 
+    return intensities
 
-      # Find percentage of consumption for each fuel type.
-      energy_sources_column_map = {
-        'bld_indic': 'activity',
-        'all_bldg': 'all'
-      }
 
-      source_column_map = {
-        'nat_gas': 'ng',
-        'fuel_oil': 'foil'
-      }
+  def methodology(datasets):
+    """
+      @param Dict<DataFrame> datasets
 
-      renamed_sources = {
-        'outpatient': 'health care outpatient',
-        'retail (other than mall)': 'mercantile retail (other than mall)',
-        'enclosed and strip malls': 'mercantile enclosed and strip malls',
-      }
+      @return DataFrame 
+    """
 
-      energy_sources_column_map.update(source_column_map)
+    """
+      Step 1 in Methodology
+    """
+    profiler.step('Step 1 in Methodology', rows_in=len(datasets['eowld']))
+    eowld = datasets['eowld']
+    eowld = eowld.assign(vintage=eowld['cal_year'])
 
-      energy_sources = pd.DataFrame(datasets['cbecs_sources'][['years', 'bld_group', 'bld_indic', 'all_bldg', 'nat_gas', 'fuel_oil']])
-      energy_sources = energy_sources[(energy_sources['bld_group'].str.lower() == 'principal building activity') & (energy_sources['years'].astype(int) == 2012)]
-      energy_sources.rename(columns=energy_sources_column_map, inplace=True)
-      energy_sources['activity'] = energy_sources['activity'].str.lower().str.strip()
+    municipalities = eowld.drop_duplicates(['vintage', 'muni_id'])[['vintage', 'muni_id', 'municipal']]
 
-      for original_source, renamed_source in renamed_sources.items():
-        energy_sources['activity'].replace(original_source, renamed_source, inplace=True) 
+    # Employees and establishments of every municipality for each Principal Building Activity
+    pba_stats = pd.merge(eowld, pba_naics_lookup, on='naicscode')
+    pba_stats = pba_stats.groupby(['vintage', 'muni_id', 'activity'])[['avgemp', 'estab']].sum()
+    pba_stats.columns = ['emps', 'estabs']
+    pba_stats = pba_stats.reset_index()
 
-      activities = current_result['activity'].tolist()
-      energy_sources = energy_sources[energy_sources['activity'].isin(activities)].reset_index()
-      energy_sources['foil'].fillna(0, inplace=True)
 
-      for fuel in source_column_map.values():
-        energy_sources[fuel] = energy_sources[fuel].astype(float) / energy_sources['all'].astype(float)
+    """
+      Step 2 in Methodology
+    """
+    profiler.step('Step 2 in Methodology', rows_in=len(pba_stats))
+    # Each vintage uses the latest CBECS survey up to its year
+    cbecs_years = datasets['cbecs_elec']['years'].unique()
+    survey_years = pd.DataFrame(
+      [(vintage.year, vintage.survey_year('cbecs', cbecs_years)) for vintage in vintages],
+      columns=['vintage', 'cbecs_year']
+    )
+
+    intensities = []
+    for year in survey_years['cbecs_year'].unique():
+      # Only rebuilt when the CBECS tables change
+      survey_intensities = Estimator.artifact_store.fetch(
+        'cbecs_intensities',
+        1,
+        {tag: datasets[tag] for tag in ['cbecs_elec', 'cbecs_ng', 'cbecs_foil']},
+        lambda: cbecs_intensities(datasets, year),
+        {'cbecs_year': int(year)}
+      )
 
-      energy_sources['elec'] = 1.0
+      intensities.append(survey_intensities.assign(cbecs_year=year))
 
+    intensities = pd.concat(intensities, ignore_index=True)
 
-      # Calculate avergage consumption and expenditure 
+    # Every municipality receives every activity, even those without establishments
+    results = pd.merge(municipalities, survey_years, on='vintage')
+    results = pd.merge(results, intensities, on='cbecs_year')
+    results = pd.merge(results, pba_stats, how='left', on=['vintage', 'muni_id', 'activity'])
+    results[['emps', 'estabs']] = results[['emps', 'estabs']].fillna(0)
 
-      result_sets = {
-        'mercantile': pd.DataFrame(current_result[current_result['activity'] == 'Mercantile Enclosed and strip malls']),
-        'non_mercantile': pd.DataFrame(current_result[current_result['activity'] != 'Mercantile Enclosed and strip malls'])
-      }
+    employees_per_estab = results['emps'] / results['estabs']
 
-      for fuel in fuel_types:
-        for set_name, result_set in result_sets.items():
-          if not result_set.empty:
-            if set_name == 'mercantile':
-              result_set[fuel+'_con_pu'] = result_set[fuel+'_con_per_b'] * result_set['estabs'] * acs_ratios[fuel] * fuel_factor[fuel]
-              result_set[fuel+'_exp_dollar'] = result_set[fuel+'_exp_per_b'] * result_set['estabs'] * acs_ratios[fuel]
-            else:
-              result_set[fuel+'_con_pu'] = result_set[fuel+'_con_per_w'] * result_set['emps'] * acs_ratios[fuel] * fuel_factor[fuel]
-              result_set[fuel+'_exp_dollar'] = result_set[fuel+'_exp_per_w'] * result_set['emps'] * acs_ratios[fuel]
+    results['foil_con_per_w'] = results['foil_con_per_w'].mask(
+      results['foil_con_per_w'].isnull() & (results['estabs'] != 0),
+      results['foil_con_per_b'] / employees_per_estab
+    )
 
-            result_set[fuel+'_con_mmbtu'] = result_set[fuel+'_con_pu'] * fuel_conversion[fuel]
-            result_set[fuel+'_emissions_co2'] = result_set[fuel+'_con_pu'] * co2_conversion_map[fuel]
+    for fuel in fuel_types:
+      results[fuel+'_exp_per_w'] = ((results[fuel+'_exp_per_b'] / employees_per_estab) * 1000).replace(np.inf, 0)
 
 
-      current_result = pd.concat(result_sets, sort=False).reset_index()
-      del current_result['level_0']
-      del current_result['level_1']
+    # Calculate avergage consumption and expenditure 
+    mercantile = results['activity'] == 'Mercantile Enclosed and strip malls'
 
-      current_result['total_con_mmbtu'] = current_result['elec_con_mmbtu'] + current_result['ng_con_mmbtu'] + current_result['foil_con_mmbtu']
+    for fuel in fuel_types:
+      results[fuel+'_con_pu'] = np.where(
+        mercantile,
+        results[fuel+'_con_per_b'] * results['estabs'],
+        results[fuel+'_con_per_w'] * results['emps']
+      ) * acs_ratios[fuel] * fuel_factor[fuel]
 
-      current_result['muni_id'] = muni_id
-      current_result['municipal'] = municipality
+      results[fuel+'_exp_dollar'] = np.where(
+        mercantile,
+        results[fuel+'_exp_per_b'] * results['estabs'],
+        results[fuel+'_exp_per_w'] * results['emps']
+      ) * acs_ratios[fuel]
 
-      results = results.append(current_result, ignore_index=True)
+      results[fuel+'_con_mmbtu'] = results[fuel+'_con_pu'] * fuel_conversion[fuel]
+      results[fuel+'_emissions_co2'] = results[fuel+'_con_pu'] * co2_conversion_map[fuel]
 
+    results['total_con_mmbtu'] = results['elec_con_mmbtu'] + results['ng_con_mmbtu'] + results['foil_con_mmbtu']
 
     results = results[col_order]
     results['activity'] = results['activity'].str.title()
 
-    # Rename certain municipal identifiers to conform to the the data
-    # used in the other sectors.
-    results.replace('MAPC Region', 'MAPC', inplace=True)
-
 
     return results
 
 
   # Construct the Estimator from the methodology and then process the data sources
-  return Estimator(methodology)(data_sources)
+  return Estimator(methodology, commercial.dataset_tags, resolve_queries(commercial.dataset_queries, vintages))(data_sources)
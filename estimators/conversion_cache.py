@@ -0,0 +1,114 @@
+"""
+  Class: ConversionCache
+
+  Keeps every spreadsheet read as a dataset file as a Feather file, so that
+  a workbook is only parsed once. Conversions are keyed by the hash of the
+  workbook, so a workbook that is edited, or replaced by another one of the
+  same name, is converted again, and by the way it was converted, such as
+  the tag and schema it was read with. The hash of each workbook is kept in an
+  index together with its modification time and size, and is only computed
+  again once either of them changes.
+"""
+
+import json
+import pandas as pd
+from hashlib import sha1
+from threading import Lock
+from os import makedirs, path, remove, replace, stat
+
+
+class ConversionCache(object):
+
+  def __init__(self, directory):
+    """
+      @param String directory
+    """
+
+    self.directory = directory
+    self.index_path = path.join(directory, 'index.json')
+    self.lock = Lock()
+
+    makedirs(directory, exist_ok=True)
+
+    if path.exists(self.index_path):
+      with open(self.index_path) as index:
+        self.index = json.load(index)
+    else:
+      self.index = {}
+
+
+  def digest(self, file_path):
+    """
+      @param String file_path
+
+      @return String      Hash of the contents of the file
+    """
+
+    file_path = path.abspath(file_path)
+    status = stat(file_path)
+    entry = self.index.get(file_path)
+
+    if entry and entry['mtime'] == status.st_mtime and entry['size'] == status.st_size:
+      return entry['digest']
+
+    digest = sha1()
+    with open(file_path, 'rb') as source_file:
+      for block in iter(lambda: source_file.read(1 << 20), b''):
+        digest.update(block)
+
+    with self.lock:
+      self.index[file_path] = {'mtime': status.st_mtime, 'size': status.st_size, 'digest': digest.hexdigest()}
+      self.save()
+
+    return digest.hexdigest()
+
+
+  def path(self, digest, variant=None):
+    """
+      @param String digest
+      @param String variant     Names one of several conversions of the same file
+
+      @return String
+    """
+
+    name = '{}-{}'.format(digest, variant) if variant else digest
+
+    return path.join(self.directory, name + '.feather')
+
+
+  def read(self, file_path, convert, columns=None, variant=None):
+    """
+      @param String file_path
+      @param Function<[String],DataFrame> convert     Reads the whole file
+      @param List<String> columns                     Defaults to every column
+      @param String variant                           Key of the conversion, for files converted in several ways
+
+      @return DataFrame
+    """
+
+    cached = self.path(self.digest(file_path), variant)
+
+    if path.exists(cached):
+      return pd.read_feather(cached, columns=columns)
+
+    df = convert(file_path)
+
+    try:
+      df.reset_index(drop=True).to_feather(cached + '.tmp')
+      replace(cached + '.tmp', cached)
+    except Exception as error:
+      # Columns mixing types cannot be stored. The file is simply
+      # converted again on the next run.
+      print("Could not cache the conversion of {}: {}".format(file_path, error))
+
+      if path.exists(cached + '.tmp'):
+        remove(cached + '.tmp')
+
+    return df[columns] if columns else df
+
+
+  def save(self):
+    with open(self.index_path + '.tmp', 'w') as index:
+      json.dump(self.index, index, indent=2, sort_keys=True)
+
+    replace(self.index_path + '.tmp', self.index_path)
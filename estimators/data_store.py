@@ -0,0 +1,159 @@
+"""
+  Class: DataStore
+
+  Holds the loaded datasets, keyed by dataset key, for as long as a stage of
+  the run still needs them. Stages declare the datasets they consume up front
+  with expect, and release them once they are done. A dataset is dropped as
+  soon as the last stage expecting it is released, so the memory of a run is
+  bounded by the datasets of the stages still ahead of it rather than by
+  every dataset ever loaded. Datasets no stage declared are kept.
+
+  Datasets are handed out as read-only views. Every consumer receives its own
+  shallow frame over the same arrays, so adding, dropping or renaming columns
+  never reaches the stored dataset, and writing into its values raises where
+  the installed pandas lets the arrays be flagged read-only.
+"""
+
+import numpy as np
+from collections.abc import MutableMapping
+from threading import Lock
+
+
+def freeze(df):
+  """
+    Make the arrays of a frame read-only.
+
+    @param DataFrame df
+
+    @return DataFrame
+  """
+
+  # pandas has no public way to flag its arrays, the arrays it hands out are
+  # views whose flags do not reach the blocks. The blocks are internal, so
+  # frames of versions without them are stored as they are. See
+  # tests/test_data_store.py for what views allow.
+  manager = getattr(df, '_mgr', None)
+
+  if manager is None:
+    return df
+
+  # Only the NumPy blocks can be flagged, extension arrays are left as they are
+  for block in manager.blocks:
+    if isinstance(block.values, np.ndarray):
+      block.values.flags.writeable = False
+
+  return df
+
+
+class DataStore(MutableMapping):
+
+  def __init__(self):
+    self.frames = {}
+    self.sizes = {}
+    self.consumers = {}
+    self.released = {}
+    self.peak_size = 0
+    self.lock = Lock()
+
+
+  def __getitem__(self, key):
+    return self.frames[key].copy(deep=False)
+
+
+  def __setitem__(self, key, df):
+    size = int(df.memory_usage(index=True, deep=True).sum())
+
+    with self.lock:
+      self.frames[key] = freeze(df)
+      self.sizes[key] = size
+      self.peak_size = max(self.peak_size, self.resident_size())
+
+
+  def __delitem__(self, key):
+    with self.lock:
+      del self.frames[key]
+      del self.sizes[key]
+
+
+  def __iter__(self):
+    return iter(list(self.frames))
+
+
+  def __len__(self):
+    return len(self.frames)
+
+
+  def clear(self):
+    with self.lock:
+      self.frames.clear()
+      self.sizes.clear()
+      self.consumers.clear()
+      self.released.clear()
+      self.peak_size = 0
+
+
+  def expect(self, consumer, keys):
+    """
+      Declare the datasets a stage will consume.
+
+      @param String consumer
+      @param List<String> keys
+    """
+
+    with self.lock:
+      for key in keys:
+        self.consumers.setdefault(key, set()).add(consumer)
+
+
+  def release(self, consumer):
+    """
+      Declare a stage done, dropping the datasets no other stage expects.
+
+      @param String consumer
+
+      @return List<String>    Keys of the dropped datasets
+    """
+
+    dropped = []
+
+    with self.lock:
+      for key, consumers in list(self.consumers.items()):
+        if not consumer in consumers:
+          continue
+
+        consumers.discard(consumer)
+
+        if not consumers:
+          del self.consumers[key]
+          self.released[key] = consumer
+
+          if key in self.frames:
+            del self.frames[key]
+            del self.sizes[key]
+            dropped.append(key)
+
+    if dropped:
+      print("Released {} datasets after {} ({:.1f} MB still resident)".format(len(dropped), consumer, self.resident_size() / 2**20))
+
+    return dropped
+
+
+  def resident_size(self):
+    """
+      @return Number      Bytes held by the stored datasets
+    """
+
+    return sum(self.sizes.values())
+
+
+  def report(self):
+    """
+      @return Dict
+    """
+
+    return {
+      'resident_mb': self.resident_size() / 2**20,
+      'peak_resident_mb': self.peak_size / 2**20,
+      'sizes_mb': {key: size / 2**20 for key, size in self.sizes.items()},
+      'released_after': dict(self.released),
+    }
@@ -0,0 +1,122 @@
+"""
+  Dtype Policy
+
+  Applied to every dataset as it is loaded and to the results of every
+  estimator, after the municipalities are normalized. Identifiers, codes and
+  years become int16 or int32, and labels that repeat on every row become
+  categoricals, so that frames stay compact and are joined on compact keys.
+  Metrics can optionally be stored as float32, see settings.compute.
+
+  Only the labels that are not remapped by the methodologies are made
+  categorical as they are loaded. Mapping or grouping a categorical keeps
+  its unused categories around, which would change the results.
+"""
+
+import numpy as np
+import pandas as pd
+from .settings import settings
+
+
+integer_columns = [
+  'seq_id',
+  'geo_id',
+  'logrecno',
+  'muni_id',
+  'naicscode',
+  'naics_code',
+  'cal_year',
+  'years',
+  'year',
+  'vintage',
+]
+
+# Labels made categorical as they are loaded
+source_label_columns = [
+  'naicstitle',
+  'geography',
+  'sector',
+]
+
+# Labels made categorical in the results of the estimators
+result_label_columns = source_label_columns + [
+  'activity',
+  'hu_type',
+]
+
+
+def compact_integers(series):
+  """
+    Store a column of whole numbers in the smallest of int16 and int32 that
+    holds it. Columns with missing or fractional values are left as they are.
+
+    @param Series series
+
+    @return Series
+  """
+
+  if series.dtype == object:
+    try:
+      series = pd.to_numeric(series)
+    except (ValueError, TypeError):
+      return series
+
+  if not np.issubdtype(series.dtype, np.number) or series.isnull().any():
+    return series
+
+  if np.issubdtype(series.dtype, np.floating) and not (series == series.round()).all():
+    return series
+
+  if len(series) == 0:
+    return series.astype(np.int32)
+
+  for dtype in [np.int16, np.int32]:
+    limits = np.iinfo(dtype)
+    if series.min() >= limits.min and series.max() <= limits.max:
+      return series.astype(dtype)
+
+  return series
+
+
+def compact(df, label_columns=source_label_columns, float32=None):
+  """
+    @param DataFrame df
+    @param List<String> label_columns     Columns to make categorical
+    @param Boolean float32                Store metrics as float32, defaults to settings.compute.FLOAT32
+
+    @return DataFrame
+  """
+
+  float32 = settings.compute.FLOAT32 if float32 is None else float32
+  columns = {}
+
+  for column in df.columns:
+    original = df[column]
+    series = original
+
+    if column in integer_columns:
+      series = compact_integers(series)
+    elif column in label_columns and series.dtype == object:
+      series = series.astype('category')
+    elif float32 and series.dtype == np.float64:
+      series = series.astype(np.float32)
+
+    if not series is original:
+      columns[column] = series
+
+  if not columns:
+    return df
+
+  return df.assign(**columns)
+
+
+def compact_results(results):
+  """
+    @param DataFrame|Dict<DataFrame> results
+
+    @return DataFrame|Dict<DataFrame>
+  """
+
+  if isinstance(results, dict):
+    return {name: compact_results(df) for name, df in results.items()}
+
+  return compact(results, result_label_columns, float32=False)
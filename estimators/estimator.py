@@ -3,24 +3,112 @@
 
   Curried class who's first call consumes a methodology function which is used 
   by the second call that loads in and injects datasets into the methodology.
+
+  Methodologies declare the dataset tags they depend on, optionally with a
+  Query narrowing the columns and rows they need. Only those datasets are
+  loaded, and only once the methodology first accesses them. Every dataset
+  is conformed to the schema of its tag, has its municipalities normalized
+  and its dtypes compacted once, as it is loaded.
 """
 
 from .settings import settings
-from .blacklist import blacklist
-import sqlalchemy
-import pandas as pd
-from os import path
+from .municipalities import normalize
+from .dtypes import compact, compact_results
+from .schemas import conform
+from .query import Query
+from .profiler import profiler
+from .sources import create_source, read_file
+from .artifacts import ArtifactStore
+from .data_store import DataStore
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+
+def requires(*tags, **queries):
+  """
+    Declare the dataset tags a sector estimator depends on. Tags given as
+    keywords are loaded with the Query they are assigned, or with the Query
+    returned by a function of the vintages being estimated. The tags are kept
+    on the estimator as `dataset_tags` and the queries as `dataset_queries`.
+
+    @param List<String> tags
+    @param Dict<Query> queries
+
+    @return Function
+  """
+
+  def declare(fn):
+    fn.dataset_tags = list(tags) + list(queries)
+    fn.dataset_queries = queries
+    return fn
+
+  return declare
+
+
+def resolve_queries(queries, vintages):
+  """
+    Build the queries that depend on the vintages being estimated.
+
+    @param Dict<Query|Function<[List<Vintage>],Query>> queries
+    @param List<Vintage> vintages
+
+    @return Dict<Query>
+  """
+
+  return {tag: query(vintages) if callable(query) else query for tag, query in queries.items()}
+
+
+class Datasets(Mapping):
+  """
+    Read-only mapping of dataset tags to DataFrames. Each dataset is loaded
+    the first time it is accessed. When Estimator.selected_municipalities is
+    set, datasets with a muni_id column only hold those municipalities.
+  """
+
+  def __init__(self, tags, data_sources, queries={}):
+    """
+      @param List<String> tags
+      @param List<Dict<String>> data_sources
+      @param Dict<Query> queries
+    """
+
+    self.tags = list(tags)
+    self.data_sources = data_sources
+    self.queries = queries
+    self.cache = {}
+
+
+  def __getitem__(self, tag):
+    if not tag in self.tags:
+      raise KeyError("Dataset '{}' is not declared by this methodology".format(tag))
+
+    if not tag in self.cache:
+      table = Estimator.load(tag, self.data_sources, self.queries.get(tag))
+
+      if Estimator.selected_municipalities is not None and 'muni_id' in table.columns:
+        table = table[table['muni_id'].isin(Estimator.selected_municipalities)]
+
+      self.cache[tag] = table
+
+    return self.cache[tag]
+
 
+  def __iter__(self):
+    return iter(self.tags)
 
-# Turn the blacklist items into their lowercase counterparts.
-# This is better for normalized comparison since you may not
-# know the casing of each item.
-lowercase_blacklist = [x.lower() for x in blacklist]
+
+  def __len__(self):
+    return len(self.tags)
 
 
 class Estimator(object):
 
-  loaded_data = {}
+  # Loaded datasets, kept until the last stage expecting them is done
+  loaded_data = DataStore()
+
+  # Rows, seconds and source of every loaded dataset, keyed by dataset key
+  load_report = {}
 
   database_tag_map = {
     'eowld': 'econ_es202_naics_3d_m',
@@ -40,16 +128,199 @@ class Estimator(object):
     'masssave_res': 'energy_masssave_elec_gas_res_li_consumption_m',
   }
 
-  db_engine = sqlalchemy.create_engine('postgresql://{}:{}@{}:{}/{}'.format(settings.db.USER, settings.db.PASSWORD, settings.db.HOST, settings.db.PORT, settings.db.NAME))
+  # Backend the datasets not given as files are read from, see data_source
+  source = None
+
+  # Set to a SnapshotCache to keep local copies of the database tables
+  snapshot_cache = None
+
+  # Set to a ConversionCache to parse spreadsheets given as files only once
+  conversion_cache = None
+
+  # Intermediate tables built from the survey datasets, kept in memory unless
+  # set to an ArtifactStore with a directory
+  artifact_store = ArtifactStore()
+
+  # Set to a list of muni_id to estimate only those municipalities
+  selected_municipalities = None
+
+  # Set to a list of muni_id to only load the rows of those municipalities
+  # from the datasets queried with a muni_id column
+  loaded_municipalities = None
+
+
+  @staticmethod
+  def data_source():
+    """
+      The source backend configured in settings.source. It is only created
+      when a dataset is first read from it.
+
+      @return DatabaseSource|SnapshotSource
+    """
+
+    if Estimator.source is None:
+      Estimator.source = create_source(settings.source, settings.db, Estimator.database_tag_map)
+
+    return Estimator.source
+
+
+  @staticmethod
+  def scope(query):
+    """
+      Narrow a query to Estimator.loaded_municipalities.
+
+      @param Query query
+
+      @return Query
+    """
+
+    if Estimator.loaded_municipalities is None or query is None or not 'muni_id' in (query.columns or []):
+      return query
+
+    return Query(query.columns, query.filters + [('muni_id', 'in', list(Estimator.loaded_municipalities))])
+
+
+  @staticmethod
+  def dataset_key(tag, query=None):
+    """
+      Name under which a dataset loaded with a query is kept.
 
+      @param String tag
+      @param Query query
 
-  def __new__(self, fn):
+      @return String
+    """
+
+    query = Estimator.scope(query)
+
+    return query.key(tag) if query else tag
+
+
+  @staticmethod
+  def checksum(tag, query=None):
+    """
+      @param String tag
+      @param Query query
+
+      @return String
+    """
+
+    return Estimator.data_source().checksum(tag, query)
+
+
+  @staticmethod
+  def load(tag, data_sources, query=None):
+    """
+      Load a dataset from the first file tagged with it, or from the source
+      backend when no such file was given. Loaded datasets are conformed to
+      the schema of their tag, normalized, compacted and kept for later calls.
+
+      @param String tag
+      @param List<Dict<String>> data_sources
+      @param Query query      Columns and rows to load, defaults to the whole dataset
+
+      @return DataFrame
+    """
+
+    key = Estimator.dataset_key(tag, query)
+    snapshot_key = query.key(tag) if query else tag
+    scoped_query = Estimator.scope(query)
+    scoped = scoped_query is not query
+
+    if not key in Estimator.loaded_data:
+      file_sources = [data_source for data_source in data_sources if data_source['tag'] == tag]
+      start = perf_counter()
+
+      if file_sources:
+        source = file_sources[0]['file_path']
+        df = read_file(source, scoped_query, tag, Estimator.conversion_cache)
+      else:
+        data_source = Estimator.data_source()
+        snapshot_cache = Estimator.snapshot_cache if data_source.cacheable else None
+
+        source = data_source.describe(tag)
+        df = snapshot_cache.read(snapshot_key) if snapshot_cache else None
+
+        if df is None:
+          df = data_source.read(tag, scoped_query)
+
+          # The rows of a few municipalities cannot stand in for the whole query
+          if snapshot_cache and not scoped:
+            snapshot_cache.write(snapshot_key, tag, source, df, query, data_source.checksum(tag, query, df))
+        else:
+          source = snapshot_cache.path(snapshot_key)
+
+          if scoped:
+            df = scoped_query.apply(df)
+
+      seconds = perf_counter() - start
+      Estimator.load_report[key] = {'source': source, 'rows': len(df), 'seconds': seconds}
+      Estimator.loaded_data[key] = compact(normalize(conform(df, tag)))
+
+      print("Loaded {} from {} ({} rows in {:.2f}s)".format(key, source, len(df), seconds))
+
+    return Estimator.loaded_data[key]
+
+
+  @staticmethod
+  def expect(consumer, tags, queries={}):
+    """
+      Declare the datasets a stage of the run will consume, so that they are
+      released once it and every other stage consuming them are done.
+
+      @param String consumer      Name of the stage, e.g. the name of a sector estimator
+      @param List<String> tags
+      @param Dict<Query> queries
+    """
+
+    Estimator.loaded_data.expect(consumer, [Estimator.dataset_key(tag, queries.get(tag)) for tag in tags])
+
+
+  @staticmethod
+  def prefetch(tags, data_sources, queries={}):
+    """
+      Load every dataset that is not loaded yet concurrently. At most as many
+      datasets are loaded at once as the database pool has connections.
+
+      @param List<String|Tuple<String,Query>> tags    Tags, or tags paired with their query
+      @param List<Dict<String>> data_sources
+      @param Dict<Query> queries                      Queries of the tags given as strings
+    """
+
+    datasets = [tag if isinstance(tag, tuple) else (tag, queries.get(tag)) for tag in tags]
+    datasets = {Estimator.dataset_key(tag, query): (tag, query) for tag, query in datasets}
+    datasets = [dataset for key, dataset in datasets.items() if not key in Estimator.loaded_data]
+
+    if not datasets:
+      return
+
+    # Create the source backend before the loader threads share it
+    file_tags = [data_source['tag'] for data_source in data_sources]
+    if any(not tag in file_tags for tag, query in datasets):
+      Estimator.data_source()
+
+    workers = settings.db.POOL_SIZE + settings.db.MAX_OVERFLOW
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+      # Consume the results so that a failed load is raised here
+      list(executor.map(lambda dataset: Estimator.load(dataset[0], data_sources, dataset[1]), datasets))
+
+
+  def __new__(self, fn, tags=None, queries={}):
     """
       @param Function<[Dict<DataFrame>],DataFrame> fn
+      @param List<String> tags      Dataset tags used by the methodology, defaults to every tag
+      @param Dict<Query> queries    Columns and rows the methodology needs from each tag
 
       @return Estimator
     """
 
+    if tags is None:
+      tags = list(Estimator.database_tag_map)
+
+    # Methodologies are closures of their estimator, e.g. commercial.<locals>.methodology
+    name = fn.__qualname__.split('.')[0]
+
     def estimator(data_sources):
       """
         @param List<Dict<String>> data_sources
@@ -57,36 +328,17 @@ class Estimator(object):
         @return DataFrame
       """
 
-      data = {}
-
-      file_readers = {
-        'csv': pd.read_csv,
-        'xls': pd.read_excel,
-        'xlsx': pd.read_excel
-      }
-
-      for data_source in data_sources:
-        if not data_source['tag'] in Estimator.loaded_data:
-          print("Loading " + data_source['tag'] + " from file")
-          file_type = path.splitext(data_source['file_path'])[1][1:]
-          df = file_readers[file_type](data_source['file_path'])
-          Estimator.loaded_data[data_source['tag']] = df
-
-        data[data_source['tag']] = Estimator.loaded_data[data_source['tag']]
-
-      for tag, table in Estimator.database_tag_map.items():
-        if not tag in Estimator.loaded_data:
-          print("Loading " + tag)
-          df = pd.read_sql_query("SELECT * FROM tabular." + table, Estimator.db_engine)
-          Estimator.loaded_data[tag] = df
+      # Datasets are only loaded once the methodology reads them, unless a
+      # planning step such as Estimator.prefetch loaded them already
+      datasets = Datasets(tags, data_sources, queries)
 
-        data[tag] = Estimator.loaded_data[tag]
-     
-      for tag, table in data.items():
-        if 'municipal' in table.columns:
-          data[tag] = table[~table['municipal'].str.lower().isin(lowercase_blacklist)]
+      with profiler.stage(name, profile=True) as stage:
+        results = compact_results(fn(datasets))
+        stage.rows_in = sum(len(df) for df in datasets.cache.values())
+        stage.rows_out = sum(len(df) for df in results.values()) if isinstance(results, dict) else len(results)
 
+      Estimator.loaded_data.release(name)
 
-      return fn(data)
+      return results
 
     return estimator
@@ -0,0 +1,51 @@
+"""
+  Conversion and Emissions Factors
+
+  Applied to the calibrated consumption of every sector, in physical units.
+  A factor is either a constant or keyed by year, in which case years
+  missing from it use the factor of its latest year. These are the baseline of the factor
+  scenarios, see scenarios.py.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+# MMBtu per kWh, therm and gallon
+fuel_conversion = {
+  'elec': {
+    2013: 0.006841,
+    2014: 0.007692,
+    2015: 0.006707,
+  },
+  'ng': 0.1,
+  'foil': 0.139,
+}
+
+# Pounds of CO2 per kWh, therm and gallon
+emissions_factors = {
+  'elec': {
+    2013: .93,
+    2014: .941,
+    2015: .857,
+  },
+  'ng': 11.710,
+  'foil': 22.579,
+}
+
+
+def year_factors(factor, years):
+  """
+    Resolve a factor for every year. Years missing from a factor keyed by
+    year use the factor of its latest year.
+
+    @param Number|Dict<Number> factor
+    @param ndarray years
+
+    @return ndarray     Factor of each year
+  """
+
+  if not isinstance(factor, dict):
+    return np.full(len(years), float(factor))
+
+  return pd.Series(np.asarray(years)).map(factor).fillna(factor[max(factor)]).to_numpy(dtype=float)
@@ -0,0 +1,147 @@
+"""
+  Incremental Recomputation
+
+  Fingerprints the inputs of a run so that a later run can recompute only
+  the municipalities whose inputs changed. Datasets with a muni_id column
+  are fingerprinted per municipality. Every other dataset is shared by all
+  municipalities, and a change to any of them calls for a full rebuild.
+
+  Changes to the methodologies themselves are not fingerprinted and need a
+  full run.
+"""
+
+import json
+import pandas as pd
+from hashlib import sha1
+from os import path
+from .schemas import column_types
+
+
+# Datasets with a row per municipality. Their cached snapshots are pulled
+# again for an incremental run, so that revised rows are fingerprinted.
+municipal_tags = [tag for tag, types in column_types.items() if 'muni_id' in types]
+
+
+def table_hashes(df):
+  """
+    Order independent hash of each row of a dataset.
+
+    @param DataFrame df
+
+    @return Series
+  """
+
+  df = df[sorted(df.columns)]
+  return pd.util.hash_pandas_object(df, index=False)
+
+
+def fingerprint(datasets):
+  """
+    @param List<Tuple<String,DataFrame>> datasets   Every dataset used in the run, with its tag
+
+    @return Dict
+  """
+
+  shared = {}
+  municipal = {}
+
+  for tag, df in datasets:
+    hashes = table_hashes(df)
+
+    if 'muni_id' in df.columns:
+      # Summing the row hashes makes the fingerprint independent of row order
+      sums = hashes.groupby(df['muni_id'].values).sum()
+
+      for muni_id, value in sums.items():
+        municipal.setdefault(str(int(muni_id)), []).append('{}:{}'.format(tag, value))
+    else:
+      shared[tag] = sha1(hashes.sort_values().values.tobytes()).hexdigest()
+
+  return {
+    'shared': shared,
+    'municipalities': {muni_id: sha1('|'.join(sorted(parts)).encode('utf-8')).hexdigest() for muni_id, parts in municipal.items()},
+  }
+
+
+def read_fingerprint(file_path):
+  """
+    @param String file_path
+
+    @return Dict|None
+  """
+
+  if not path.exists(file_path):
+    return None
+
+  with open(file_path) as fingerprint_file:
+    return json.load(fingerprint_file)
+
+
+def write_fingerprint(file_path, fingerprint):
+  """
+    @param String file_path
+    @param Dict fingerprint
+  """
+
+  with open(file_path, 'w') as fingerprint_file:
+    json.dump(fingerprint, fingerprint_file, indent=2, sort_keys=True)
+
+
+def partial_fingerprint(previous, current, muni_ids):
+  """
+    Fingerprint of the published files once a partial run has recomputed
+    every sector of some municipalities. The other municipalities and the
+    shared datasets keep their previous fingerprint, so a later incremental
+    run still rebuilds everything after a shared dataset changed.
+
+    @param Dict previous            Defaults to an empty fingerprint
+    @param Dict current             Fingerprint of the datasets of the partial run
+    @param List<Number> muni_ids    Municipalities recomputed in every sector
+
+    @return Dict
+  """
+
+  previous = previous or {'shared': {}, 'municipalities': {}}
+  municipalities = dict(previous['municipalities'])
+
+  for muni_id in muni_ids:
+    if str(muni_id) in current['municipalities']:
+      municipalities[str(muni_id)] = current['municipalities'][str(muni_id)]
+    else:
+      municipalities.pop(str(muni_id), None)
+
+  return {'shared': previous['shared'], 'municipalities': municipalities}
+
+
+def changed_municipalities(previous, current):
+  """
+    @param Dict previous
+    @param Dict current
+
+    @return List<Number>|None      muni_id of each municipality to recompute, None when everything must be
+  """
+
+  if previous is None or previous['shared'] != current['shared']:
+    return None
+
+  muni_ids = set(previous['municipalities']) | set(current['municipalities'])
+  changed = [muni_id for muni_id in muni_ids if previous['municipalities'].get(muni_id) != current['municipalities'].get(muni_id)]
+
+  return sorted(int(muni_id) for muni_id in changed)
+
+
+def splice(existing, updated, muni_ids):
+  """
+    Replace the rows of the given municipalities in a published sector.
+
+    @param DataFrame existing
+    @param DataFrame updated       Rows recomputed for the municipalities
+    @param List<Number> muni_ids
+
+    @return DataFrame
+  """
+
+  existing = existing[~existing['muni_id'].isin(muni_ids)]
+  results = pd.concat([existing, updated], ignore_index=True, sort=False)
+
+  return results.sort_values(['vintage', 'municipal', 'year'], kind='mergesort').reset_index(drop=True)
@@ -3,17 +3,40 @@
 """
 
 import pandas as pd
-import numpy as np
-from .estimator import Estimator
-
-
-def industrial(data_sources):
+from .estimator import Estimator, requires, resolve_queries
+from .query import Query
+from .profiler import profiler
+from .vintage import default_vintage
+
+
+@requires(
+  eowld=lambda vintages: Query(
+    ['muni_id', 'municipal', 'cal_year', 'naicscode', 'naicstitle', 'avgemp', 'estab'],
+    [('naicscode', '>=', 311), ('naicscode', '<=', 339), ('cal_year', 'in', [vintage.year for vintage in vintages])]
+  ),
+  mecs_fce=Query(
+    ['years', 'naicscode', 'c_employee'],
+    [('geography', 'ieq', 'northeast region')]
+  ),
+  mecs_euc=Query(
+    ['years', 'naics_3d', 'net_elec', 'natgas', 'd_fueloil', 'r_fueloil'],
+    [('geography', 'ieq', 'united states')]
+  ),
+  mecs_fuc=Query(
+    ['years', 'naics_3d', 'tot_consum'],
+    [('geography', 'ieq', 'united states')]
+  ),
+)
+def industrial(data_sources, vintages=None):
   """
     @param List<Dict<String>> data_sources
+    @param List<Vintage> vintages     Defaults to the default vintage
 
     @return DataFrame
   """
 
+  vintages = vintages or [default_vintage]
+
   fuel_types = ['elec', 'foil', 'ng']
 
   fuel_conversion = {
@@ -35,15 +58,6 @@ def industrial(data_sources):
   }
 
 
-  def replace_invalid_values(df):
-    """
-      @param DataFrame df
-    """
-
-    df.replace('*', np.nan, inplace=True)
-    df.replace('Q', np.nan, inplace=True)
-
-
   def methodology(datasets):
     """
       @param Dict<DataFrame> datasets
@@ -54,65 +68,65 @@ def industrial(data_sources):
     """
       Step 1 in Methodology
     """
-    eowld = pd.DataFrame(datasets['eowld'])
-    eowld['naicscode'] = eowld['naicscode'].astype(int)
-    eowld = eowld[(eowld['naicscode'] >= 311) & (eowld['naicscode'] <= 339) & (eowld['cal_year'].astype(int) == 2015)]
-    eowld = eowld[['muni_id', 'municipal', 'naicscode', 'naicstitle', 'avgemp', 'estab']]
+    profiler.step('Step 1 in Methodology', rows_in=len(datasets['eowld']))
+    eowld = datasets['eowld']
+    eowld = eowld.assign(vintage=eowld['cal_year'])
     eowld = eowld.sort_values(['naicscode']) 
-    eowld.rename(columns={'naicscode': 'naics_code'}, inplace=True)
+    eowld = eowld.rename(columns={'naicscode': 'naics_code'})
 
     # We need the NAICS codes to filter the remaining datasets
     naics_codes = list(eowld[['naics_code']].values.T.flatten())
 
-    results = eowld
+    # Each vintage uses the latest MECS survey up to its year
+    mecs_years = datasets['mecs_fce']['years'].unique()
+    survey_years = pd.DataFrame(
+      [(vintage.year, vintage.survey_year('mecs', mecs_years)) for vintage in vintages],
+      columns=['vintage', 'mecs_year']
+    )
+
+    results = pd.merge(eowld, survey_years, on='vintage')
 
 
     """
       Step 2 in Methodology
     """
+    profiler.step('Step 2 in Methodology', rows_in=len(results))
 
-    mecs_fce = pd.DataFrame(datasets['mecs_fce'])
-    mecs_fce.rename(columns={'naicscode': 'naics_code', 'c_employee': 'con_per_w'}, inplace=True)
-    mecs_fce['naics_code'] = mecs_fce['naics_code'].astype(int)
+    mecs_fce = datasets['mecs_fce'].rename(columns={'years': 'mecs_year', 'naicscode': 'naics_code', 'c_employee': 'con_per_w'})
 
-    mecs_fce = mecs_fce[(mecs_fce['naics_code'].isin(naics_codes)) & (mecs_fce['years'] == 2010) & (mecs_fce['geography'].str.lower() == 'northeast region')]
-    mecs_fce = mecs_fce[['naics_code', 'con_per_w']]
+    mecs_fce = mecs_fce[mecs_fce['naics_code'].isin(naics_codes)]
 
-    results = pd.merge(results, mecs_fce, on='naics_code')
-    replace_invalid_values(results)
+    results = pd.merge(results, mecs_fce, on=['mecs_year', 'naics_code'])
 
-    results['total_con_mmbtu'] = results['con_per_w'].astype(float) * results['avgemp'].astype(float)
+    results['total_con_mmbtu'] = results['con_per_w'] * results['avgemp']
 
 
     """
       Step 3 in Methodology
     """
+    profiler.step('Step 3 in Methodology', rows_in=len(results))
 
     mecs_data = {
-      'euc': pd.DataFrame(datasets['mecs_euc']),
-      'fuc': pd.DataFrame(datasets['mecs_fuc']),
+      'euc': datasets['mecs_euc'],
+      'fuc': datasets['mecs_fuc'],
     }
 
     for dataset in mecs_data.keys():
-      mecs_data[dataset].rename(columns={'naics_3d': 'naics_code'}, inplace=True)
-      mecs_data[dataset]['naics_code'] = mecs_data[dataset]['naics_code'].apply(pd.to_numeric, errors='coerce')
-      mecs_data[dataset] = mecs_data[dataset][(mecs_data[dataset]['naics_code'].isin(naics_codes)) & (mecs_data[dataset]['geography'].str.lower() == 'united states') & (mecs_data[dataset]['years'] == 2010)]
-      replace_invalid_values(mecs_data[dataset])
+      mecs_data[dataset] = mecs_data[dataset].rename(columns={'years': 'mecs_year', 'naics_3d': 'naics_code'})
+      mecs_data[dataset] = mecs_data[dataset][mecs_data[dataset]['naics_code'].isin(naics_codes)]
 
-    mecs_data['euc']['foil'] = mecs_data[dataset][['d_fueloil', 'r_fueloil']].apply(pd.to_numeric).sum(axis=1, skipna=True)
-    mecs_data['euc'] = mecs_data['euc'][['net_elec', 'natgas', 'foil', 'naics_code']].rename(columns={'net_elec': 'elec', 'natgas': 'ng'})
-    mecs_data['fuc'] = mecs_data['fuc'][['naics_code', 'tot_consum']].rename(columns={'tot_consum': 'tot'})
+    mecs_data['euc'] = mecs_data['euc'].assign(foil=mecs_data['euc'][['d_fueloil', 'r_fueloil']].sum(axis=1, skipna=True))
+    mecs_data['euc'] = mecs_data['euc'][['mecs_year', 'net_elec', 'natgas', 'foil', 'naics_code']].rename(columns={'net_elec': 'elec', 'natgas': 'ng'})
+    mecs_data['fuc'] = mecs_data['fuc'][['mecs_year', 'naics_code', 'tot_consum']].rename(columns={'tot_consum': 'tot'})
 
-    mecs = pd.merge(mecs_data['euc'], mecs_data['fuc'], on="naics_code")
+    mecs = pd.merge(mecs_data['euc'], mecs_data['fuc'], on=['mecs_year', 'naics_code'])
 
     for fuel in fuel_types:
-      mecs[fuel+'_con_perc'] = mecs[fuel].astype(float) / mecs['tot'].astype(float)
+      mecs[fuel+'_con_perc'] = mecs[fuel] / mecs['tot']
 
-    mecs['naics_code'] = mecs['naics_code'].astype(int)
     mecs.drop(fuel_types + ['tot'], axis=1, inplace=True)
-    replace_invalid_values(mecs)
 
-    results = pd.merge(results, mecs, on='naics_code')
+    results = pd.merge(results, mecs, on=['mecs_year', 'naics_code'])
 
     for fuel in fuel_types:
       results[fuel+'_con_mmbtu'] = results['total_con_mmbtu'] * results[fuel+'_con_perc']
@@ -120,12 +134,8 @@ def industrial(data_sources):
       results[fuel+'_exp_dollar'] = results[fuel+'_con_pu'] * exp_per_fuel_pu[fuel]
       results[fuel+'_emissions_co2'] = results[fuel+'_con_pu'] * co2_conversion_map[fuel]
 
-    # Rename certain municipal identifiers to conform to the the data
-    # used in the other sectors.
-    results.replace('MAPC Region', 'MAPC', inplace=True)
-
     return results
 
 
   # Construct the Estimator from the methodology and then process the data sources
-  return Estimator(methodology)(data_sources)
+  return Estimator(methodology, industrial.dataset_tags, resolve_queries(industrial.dataset_queries, vintages))(data_sources)
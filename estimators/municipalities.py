@@ -0,0 +1,73 @@
+"""
+  Municipality Normalization
+
+  Applied once to every dataset as it is loaded. Rows of blacklisted
+  municipalities are dropped and municipal names are made consistent across
+  datasets, then stored as a categorical column. The sectors join and filter
+  on the integer muni_id rather than on these names.
+"""
+
+from .blacklist import blacklist
+
+
+# Turn the blacklist items into their lowercase counterparts.
+# This is better for normalized comparison since you may not
+# know the casing of each item.
+lowercase_blacklist = [x.lower() for x in blacklist]
+
+# Rename certain municipal identifiers to conform to the the data
+# used in the other sectors.
+renamed_municipalities = {
+  'MAPC Region': 'MAPC',
+}
+
+
+def normalize(df):
+  """
+    @param DataFrame df
+
+    @return DataFrame
+  """
+
+  if not 'municipal' in df.columns:
+    return df
+
+  # Each distinct name is only compared once
+  municipal = df['municipal'].astype('category')
+  blacklisted = [name for name in municipal.cat.categories if str(name).lower() in lowercase_blacklist]
+
+  df = df[~municipal.isin(blacklisted)].copy()
+  municipal = municipal[df.index].cat.remove_unused_categories()
+  df['municipal'] = municipal.map(lambda name: renamed_municipalities.get(name, name)).astype('category')
+
+  return df
+
+
+def select_municipalities(selection, municipalities):
+  """
+    Find the municipalities given by muni_id or by name.
+
+    @param List<String> selection       muni_id or names, e.g. ['35', 'Newton']
+    @param DataFrame municipalities     muni_id and municipal of every municipality
+
+    @return List<Number>    muni_id of each selected municipality
+  """
+
+  names = {
+    str(name).lower(): int(muni_id)
+    for muni_id, name in municipalities[['muni_id', 'municipal']].drop_duplicates().itertuples(index=False)
+  }
+
+  muni_ids = []
+
+  for municipality in selection:
+    municipality = municipality.strip()
+
+    if municipality.isdigit():
+      muni_ids.append(int(municipality))
+    elif municipality.lower() in names:
+      muni_ids.append(names[municipality.lower()])
+    else:
+      raise ValueError("Unknown municipality '{}'".format(municipality))
+
+  return sorted(set(muni_ids))
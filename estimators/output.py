@@ -0,0 +1,159 @@
+"""
+  Output Writers
+
+  Writes the sector datasets to the output directory. CSV files are written
+  in chunks and streamed into the zip archive as they are written, so the
+  files are never read back. Sectors can also be written as compressed
+  Parquet or Arrow IPC files partitioned by year, listed in a manifest, so
+  that consumers only read the partitions they need.
+"""
+
+import json
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.feather as feather
+from io import TextIOWrapper
+from shutil import rmtree
+from os import makedirs, path, replace
+from .settings import settings
+
+
+file_extensions = {
+  'parquet': 'parquet',
+  'arrow': 'arrow',
+}
+
+
+def write_csv(df, file_path, archive=None):
+  """
+    @param DataFrame df
+    @param String file_path
+    @param ZipFile archive      Archive the file is also written to, under its file name
+  """
+
+  chunk_size = settings.db.CHUNK_SIZE
+
+  # Written beside the file and moved into place once complete, so that
+  # readers such as the API never see a partly written file
+  temp_path = file_path + '.tmp'
+
+  with open(temp_path, 'w', newline='') as csv_file:
+    archived = None
+
+    if archive is not None:
+      archived = TextIOWrapper(archive.open(path.basename(file_path), 'w', force_zip64=True), encoding='utf-8', newline='')
+
+    try:
+      for start in range(0, max(len(df), 1), chunk_size):
+        text = df.iloc[start:start+chunk_size].to_csv(index=False, header=(start == 0))
+        csv_file.write(text)
+
+        if archived is not None:
+          archived.write(text)
+    finally:
+      if archived is not None:
+        archived.close()
+
+  replace(temp_path, file_path)
+
+
+def write_partitioned(df, directory, file_format='parquet', partition_columns=['year'], compression='zstd', sort_columns=['muni_id']):
+  """
+    Write a dataset as one file per partition, in hive style directories
+    such as year=2015/part-0.parquet. Partition columns are only kept in the
+    directory names. Rows are sorted by muni_id within each file, so that
+    readers can skip to a municipality with the column statistics.
+
+    The partitions are written beside the directory and swapped in once
+    complete, so readers never see a partly written dataset.
+
+    @param DataFrame df
+    @param String directory
+    @param String file_format             'parquet' or 'arrow'
+    @param List<String> partition_columns Columns to partition by, when present in the dataset
+    @param String compression
+    @param List<String> sort_columns      Columns to sort the rows of a file by, when present
+
+    @return Dict      Manifest entry of the dataset
+  """
+
+  if not file_format in file_extensions:
+    raise ValueError("Unknown output format '{}'".format(file_format))
+
+  partition_columns = [column for column in partition_columns if column in df.columns]
+  sort_columns = [column for column in sort_columns if column in df.columns and not column in partition_columns]
+  extension = file_extensions[file_format]
+
+  temp_directory = directory + '.tmp'
+  old_directory = directory + '.old'
+
+  for leftover in [temp_directory, old_directory]:
+    if path.exists(leftover):
+      rmtree(leftover)
+  makedirs(temp_directory)
+
+  files = []
+  groups = df.groupby(partition_columns, sort=True) if partition_columns else [((), df)]
+
+  for values, partition in groups:
+    values = values if isinstance(values, tuple) else (values,)
+    partition_dir = path.join(*([temp_directory] + ['{}={}'.format(column, value) for column, value in zip(partition_columns, values)]))
+    file_path = path.join(partition_dir, 'part-0.' + extension)
+
+    if sort_columns:
+      partition = partition.sort_values(sort_columns, kind='mergesort')
+
+    makedirs(partition_dir, exist_ok=True)
+    table = pa.Table.from_pandas(partition.drop(partition_columns, axis=1), preserve_index=False)
+
+    if file_format == 'parquet':
+      pq.write_table(table, file_path, compression=compression)
+    else:
+      feather.write_feather(table, file_path, compression=compression)
+
+    entry = {'path': path.relpath(file_path, temp_directory), 'rows': len(partition)}
+    entry.update({column: value.item() if hasattr(value, 'item') else value for column, value in zip(partition_columns, values)})
+    files.append(entry)
+
+  # The earlier partitions are moved aside rather than removed first, so
+  # the directory is only missing between the two renames
+  if path.exists(directory):
+    replace(directory, old_directory)
+  replace(temp_directory, directory)
+
+  if path.exists(old_directory):
+    rmtree(old_directory)
+
+  return {
+    'format': file_format,
+    'compression': compression,
+    'rows': len(df),
+    'columns': {column: str(dtype) for column, dtype in df.dtypes.items()},
+    'partition_columns': partition_columns,
+    'sort_columns': sort_columns,
+    'files': files,
+  }
+
+
+def write_manifest(file_path, manifest):
+  """
+    @param String file_path
+    @param Dict manifest
+  """
+
+  with open(file_path, 'w') as manifest_file:
+    json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+
+
+def read_manifest(file_path):
+  """
+    @param String file_path
+
+    @return Dict|None
+  """
+
+  if not path.exists(file_path):
+    return None
+
+  with open(file_path) as manifest_file:
+    return json.load(manifest_file)
@@ -0,0 +1,80 @@
+"""
+  Parallel Sector Execution
+
+  Runs the sector estimators in forked worker processes. The datasets are
+  loaded before the workers are forked, so every worker shares the loaded
+  tables with the parent process copy-on-write instead of receiving its own
+  pickled copy. The Commercial & Industrial calibration starts as soon as
+  both of those sectors are done, while the remaining sectors still run.
+"""
+
+from multiprocessing import get_context
+from .estimator import Estimator, resolve_queries
+from .ci_munger import ci_munger
+from .profiler import profiler
+
+
+def start_worker():
+  # Database connections of the parent process must not be reused
+  if Estimator.source is not None:
+    Estimator.source.dispose()
+
+
+def run_sector(task):
+  """
+    @param Tuple<String,Function,List,List> task
+
+    @return Tuple<String,DataFrame,List<Stage>>   The sector, its data and the stages recorded in the worker
+  """
+
+  sector, processor, data_sources, vintages = task
+  print('Processing {} sector...'.format(sector))
+
+  # The worker inherits the stages recorded before it was forked
+  recorded = len(profiler.stages)
+  df = processor(data_sources, vintages)
+
+  return sector, df, profiler.stages[recorded:]
+
+
+def run_sectors(processors, data_sources, jobs, vintages=None):
+  """
+    @param Dict<Function> processors
+    @param List<Dict<String>> data_sources
+    @param Number jobs
+    @param List<Vintage> vintages     Defaults to the default vintage
+
+    @return Dict<DataFrame>
+  """
+
+  ci_sectors = ['commercial', 'industrial']
+  calibrate_ci = all(sector in processors for sector in ci_sectors)
+
+  # Everything the workers and the calibration need is loaded before forking
+  Estimator.prefetch(
+    [
+      (tag, resolve_queries(processor.dataset_queries, vintages).get(tag))
+      for processor in list(processors.values()) + ([ci_munger] if calibrate_ci else [])
+      for tag in processor.dataset_tags
+    ],
+    data_sources
+  )
+
+  sector_data = {}
+  tasks = [(sector, processor, data_sources, vintages) for sector, processor in processors.items()]
+
+  with get_context('fork').Pool(min(jobs, len(tasks)), initializer=start_worker) as pool:
+    for sector, df, stages in pool.imap_unordered(run_sector, tasks):
+      sector_data[sector] = df
+      profiler.stages += stages
+
+      # The worker only released its own copy of the datasets of the sector
+      Estimator.loaded_data.release(sector)
+      print('Finished {} sector!'.format(sector))
+
+      if calibrate_ci and all(sector in sector_data for sector in ci_sectors):
+        calibrate_ci = False
+        print('Calibrating Commercial and Industrial sectors using MassSave data...')
+        sector_data.update(ci_munger(data_sources, {sector: sector_data[sector] for sector in ci_sectors}, vintages))
+
+  return sector_data
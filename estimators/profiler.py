@@ -0,0 +1,272 @@
+"""
+  Class: Profiler
+
+  Records the wall time, CPU time, rows in and out and memory of every stage
+  of a run, such as loading the datasets, each step of a methodology, the
+  calibrations and publishing. Stages nest, so the steps of a methodology are
+  recorded within their sector. The recorded stages make up the run report.
+
+  Peak memory is only traced while tracemalloc is running, and cProfile is
+  only attached to the stages that ask for it, once profiling is enabled.
+  Both slow pandas down considerably, so they are left off by default.
+"""
+
+import json
+import cProfile
+import pstats
+import resource
+import tracemalloc
+from contextlib import contextmanager
+from time import perf_counter, process_time
+from os import makedirs, path
+
+
+class Stage(object):
+
+  def __init__(self, name, rows_in=None, step=False):
+    """
+      @param String name
+      @param Number rows_in
+      @param Boolean step     Whether the stage ends when the next step starts
+    """
+
+    self.name = name
+    self.rows_in = rows_in
+    self.rows_out = None
+    self.step = step
+    self.children = []
+    self.profile = None
+
+    self.seconds = None
+    self.cpu_seconds = None
+    self.peak_mb = None
+
+    self.wall_start = perf_counter()
+    self.cpu_start = process_time()
+
+    # Traced memory of the stage that predates the last reset of the traces
+    self.traced_offset = 0
+    self.traced_peak = 0
+
+
+  def to_dict(self):
+    """
+      @return Dict
+    """
+
+    stage = {
+      'name': self.name,
+      'seconds': self.seconds,
+      'cpu_seconds': self.cpu_seconds,
+      'rows_in': self.rows_in,
+      'rows_out': self.rows_out,
+      'peak_mb': self.peak_mb,
+    }
+
+    if self.profile is not None:
+      stage['profile'] = self.profile
+
+    if self.children:
+      stage['stages'] = [child.to_dict() for child in self.children]
+
+    return stage
+
+
+class Profiler(object):
+
+  def __init__(self):
+    self.stages = []
+    self.stack = []
+    self.profile_dir = None
+
+
+  def enable(self, profile_dir):
+    """
+      Trace memory and allow stages to be profiled with cProfile.
+
+      @param String profile_dir     Directory the cProfile statistics are written to
+    """
+
+    self.profile_dir = profile_dir
+    makedirs(profile_dir, exist_ok=True)
+
+    if not tracemalloc.is_tracing():
+      tracemalloc.start()
+
+
+  @contextmanager
+  def stage(self, name, rows_in=None, profile=False):
+    """
+      Record a stage for the duration of the block. Set rows_out on the
+      yielded Stage to record the rows the stage produced.
+
+      @param String name
+      @param Number rows_in
+      @param Boolean profile      Attach cProfile to the stage when profiling is enabled
+
+      @return Stage
+    """
+
+    stage = self.open(Stage(name, rows_in))
+    profiler = None
+
+    if profile and self.profile_dir:
+      profiler = cProfile.Profile()
+      profiler.enable()
+
+    try:
+      yield stage
+    finally:
+      if profiler is not None:
+        profiler.disable()
+        stage.profile = self.summarize(profiler, name)
+
+      self.close(stage)
+
+
+  def step(self, name, rows_in=None):
+    """
+      Start the next step of the current stage, ending the step before it.
+      The last step ends with its stage.
+
+      @param String name
+      @param Number rows_in
+    """
+
+    # The rows the next step starts from are those the step before it produced
+    if self.stack and self.stack[-1].step:
+      self.stack[-1].rows_out = rows_in
+      self.close(self.stack[-1])
+
+    self.open(Stage(name, rows_in, step=True))
+
+
+  def open(self, stage):
+    """
+      @param Stage stage
+
+      @return Stage
+    """
+
+    if self.stack:
+      self.stack[-1].children.append(stage)
+    else:
+      self.stages.append(stage)
+
+    if tracemalloc.is_tracing():
+      self.reset_traces()
+
+    self.stack.append(stage)
+
+    return stage
+
+
+  def close(self, stage):
+    """
+      End a stage together with every stage still open within it.
+
+      @param Stage stage
+    """
+
+    while self.stack and self.stack[-1] is not stage:
+      self.close(self.stack[-1])
+
+    if not self.stack:
+      return
+
+    self.stack.pop()
+
+    # The last step produces the rows of its stage
+    if stage.children and stage.children[-1].step and stage.children[-1].rows_out is None:
+      stage.children[-1].rows_out = stage.rows_out
+
+    stage.seconds = perf_counter() - stage.wall_start
+    stage.cpu_seconds = process_time() - stage.cpu_start
+
+    if tracemalloc.is_tracing():
+      current, peak = tracemalloc.get_traced_memory()
+      stage.traced_peak = max(stage.traced_peak, stage.traced_offset + peak)
+      stage.peak_mb = stage.traced_peak / 2**20
+
+      # The memory still held by the stage now belongs to the stage around it
+      if self.stack:
+        parent = self.stack[-1]
+        parent.traced_peak = max(parent.traced_peak, parent.traced_offset + stage.traced_peak)
+        parent.traced_offset += stage.traced_offset + current
+
+      tracemalloc.clear_traces()
+
+
+  def reset_traces(self):
+    """
+      Reset the traced memory so that a new stage starts from zero. The
+      memory traced so far is carried by the stage that is still open.
+    """
+
+    current, peak = tracemalloc.get_traced_memory()
+
+    if self.stack:
+      parent = self.stack[-1]
+      parent.traced_peak = max(parent.traced_peak, parent.traced_offset + peak)
+      parent.traced_offset += current
+
+    tracemalloc.clear_traces()
+
+
+  def summarize(self, profiler, name, limit=25):
+    """
+      Write the cProfile statistics of a stage and list its costliest functions.
+
+      @param Profile profiler
+      @param String name
+      @param Number limit
+
+      @return Dict
+    """
+
+    stats_path = path.join(self.profile_dir, name.replace(' ', '_').replace('/', '_') + '.prof')
+    profiler.dump_stats(stats_path)
+
+    stats = pstats.Stats(profiler)
+    functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+
+    return {
+      'stats': stats_path,
+      'functions': [
+        {
+          'function': '{}:{}({})'.format(path.basename(file_name), line, function),
+          'calls': calls,
+          'seconds': own_seconds,
+          'cumulative_seconds': cumulative_seconds,
+        }
+        for (file_name, line, function), (primitive_calls, calls, own_seconds, cumulative_seconds, callers) in functions
+      ],
+    }
+
+
+  def report(self):
+    """
+      @return List<Dict>
+    """
+
+    return [stage.to_dict() for stage in self.stages]
+
+
+  def write(self, file_path, details={}):
+    """
+      Write the run report.
+
+      @param String file_path
+      @param Dict details       Describes the run
+    """
+
+    report = dict(details)
+    report['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+    report['stages'] = self.report()
+
+    with open(file_path, 'w') as report_file:
+      json.dump(report, report_file, indent=2, sort_keys=True, default=str)
+
+
+# Records the stages of the current run
+profiler = Profiler()
@@ -0,0 +1,81 @@
+"""
+  Publisher
+
+  Publishes a sector dataset to the database without readers ever seeing a
+  partially loaded table. The dataset is loaded into a staging table, which
+  is indexed and then swapped in for the live table in a single transaction.
+  PostgreSQL loads the staging table with COPY FROM STDIN.
+"""
+
+import csv
+import sqlalchemy
+from io import StringIO
+from .settings import settings
+
+
+def copy_rows(table, connection, keys, data_iter):
+  """
+    Insertion method for DataFrame.to_sql which streams each chunk of rows
+    through PostgreSQL's COPY FROM STDIN.
+
+    @param SQLTable table
+    @param Connection connection
+    @param List<String> keys
+    @param Iterator<Tuple> data_iter
+  """
+
+  buffer = StringIO()
+  csv.writer(buffer).writerows(data_iter)
+  buffer.seek(0)
+
+  name = '{}.{}'.format(table.schema, table.name) if table.schema else table.name
+  columns = ', '.join('"{}"'.format(key) for key in keys)
+
+  with connection.connection.cursor() as cursor:
+    cursor.copy_expert('COPY {} ({}) FROM STDIN WITH CSV'.format(name, columns), buffer)
+
+
+def publish(df, table, engine, schema=None, index_columns=['muni_id', 'year']):
+  """
+    @param DataFrame df
+    @param String table
+    @param Engine engine
+    @param String schema
+    @param List<String> index_columns     Columns to index, when present in the dataset
+  """
+
+  postgres = engine.dialect.name == 'postgresql'
+  staging = table + '_staging'
+  index_columns = [column for column in index_columns if column in df.columns]
+
+  def qualified(name):
+    return '{}.{}'.format(schema, name) if schema else name
+
+  # Load the staging table while the live table is still being served.
+  # The frame index is kept as the "index" column, as DataFrame.to_sql
+  # would, but without the index pandas builds on it.
+  with engine.begin() as connection:
+    df.reset_index().to_sql(
+      staging,
+      connection,
+      schema,
+      if_exists='replace',
+      index=False,
+      chunksize=settings.db.CHUNK_SIZE,
+      method=copy_rows if postgres else None
+    )
+
+    if postgres:
+      for column in index_columns:
+        connection.execute(sqlalchemy.text('CREATE INDEX {}_{}_idx ON {} ("{}")'.format(staging, column, qualified(staging), column)))
+
+  # Swap the staging table in
+  with engine.begin() as connection:
+    connection.execute(sqlalchemy.text('DROP TABLE IF EXISTS {}'.format(qualified(table))))
+    connection.execute(sqlalchemy.text('ALTER TABLE {} RENAME TO {}'.format(qualified(staging), table)))
+
+    for column in index_columns:
+      if postgres:
+        connection.execute(sqlalchemy.text('ALTER INDEX {} RENAME TO {}_{}_idx'.format(qualified(staging+'_'+column+'_idx'), table, column)))
+      else:
+        connection.execute(sqlalchemy.text('CREATE INDEX {}_{}_idx ON {} ("{}")'.format(table, column, table, column)))
@@ -0,0 +1,200 @@
+"""
+  Class: Query
+
+  The columns and row filters a methodology needs from a dataset. A query is
+  turned into the column list and WHERE clause of the database query, and is
+  applied in memory to datasets loaded from files or snapshots.
+
+  Filters are (column, operator, value) tuples. Numeric values compare the
+  column as a number, strings compare it as text.
+
+    ==, >=, <=    Comparison with a single value
+    in            Membership in a list of values
+    ieq           Case-insensitive equality with a string
+"""
+
+import json
+import sqlalchemy
+import pandas as pd
+from hashlib import sha1
+from numbers import Number
+
+
+def as_text(value):
+  """
+    @param Number value
+
+    @return String      The value as it is written in a text column, e.g. 2015 rather than 2015.0
+  """
+
+  return str(int(value)) if float(value).is_integer() else str(value)
+
+
+class Query(object):
+
+  sql_operators = {
+    '==': '=',
+    '>=': '>=',
+    '<=': '<=',
+  }
+
+
+  def __init__(self, columns=None, filters=()):
+    """
+      @param List<String> columns       Defaults to every column
+      @param List<Tuple> filters
+    """
+
+    self.columns = list(columns) if columns else None
+    self.filters = [tuple(spec) for spec in filters]
+
+
+  @staticmethod
+  def from_description(description):
+    """
+      @param Dict description
+
+      @return Query
+    """
+
+    return Query(description['columns'], description['filters'])
+
+
+  def describe(self):
+    """
+      @return Dict
+    """
+
+    return {'columns': self.columns, 'filters': [list(spec) for spec in self.filters]}
+
+
+  def source_columns(self):
+    """
+      Columns to read from a file to apply the query, defaults to every column.
+
+      @return List<String>|None
+    """
+
+    if not self.columns:
+      return None
+
+    return self.columns + [column for column, operator, value in self.filters if not column in self.columns]
+
+
+  def key(self, tag):
+    """
+      Name a dataset loaded with this query.
+
+      @param String tag
+
+      @return String
+    """
+
+    digest = sha1(json.dumps(self.describe(), sort_keys=True).encode('utf-8')).hexdigest()
+    return '{}[{}]'.format(tag, digest[:8])
+
+
+  def sql(self, table, checksum=False, column_types={}):
+    """
+      Filters compare the column itself whenever its type in the database
+      allows it, so that an index on the column can be used. Numeric filters
+      on text columns are matched against the text of the values, except
+      for ranges, which cast the column to a number.
+
+      @param String table
+      @param Boolean checksum         Select an order independent PostgreSQL checksum of the matching rows instead
+      @param Dict<String> column_types  Type of the columns in the database, 'number' or 'text'.
+                                      Columns of an unknown type are cast.
+
+      @return TextClause
+    """
+
+    if self.columns:
+      columns = ', '.join('"{}"'.format(column) for column in self.columns)
+    else:
+      columns = '*'
+
+    conditions = []
+    params = {}
+    expanding = []
+
+    for i, (column, operator, value) in enumerate(self.filters):
+      param = 'p{}'.format(i)
+      column_type = column_types.get(column)
+      params[param] = value
+
+      if operator == 'ieq':
+        expression = 'lower("{}")' if column_type == 'text' else 'lower(CAST("{}" AS text))'
+        conditions.append('{} = :{}'.format(expression.format(column), param))
+        params[param] = value.lower()
+        continue
+
+      values = value if operator == 'in' else [value]
+      numeric = all(isinstance(x, Number) for x in values)
+
+      if numeric and column_type == 'text' and operator in ['==', 'in']:
+        expression = '"{}"'
+        params[param] = [as_text(x) for x in value] if operator == 'in' else as_text(value)
+      elif column_type == ('number' if numeric else 'text'):
+        expression = '"{}"'
+      else:
+        expression = 'CAST("{}" AS numeric)' if numeric else 'CAST("{}" AS text)'
+
+      expression = expression.format(column)
+
+      if operator == 'in':
+        conditions.append('{} IN :{}'.format(expression, param))
+        expanding.append(param)
+      else:
+        conditions.append('{} {} :{}'.format(expression, Query.sql_operators[operator], param))
+
+    query = 'SELECT {} FROM {}'.format(columns, table)
+    if conditions:
+      query += ' WHERE ' + ' AND '.join(conditions)
+
+    if checksum:
+      query = "SELECT md5(string_agg(md5(CAST(selected AS text)), '' ORDER BY md5(CAST(selected AS text)))) FROM ({}) AS selected".format(query)
+
+    return sqlalchemy.text(query).bindparams(
+      *[sqlalchemy.bindparam(param, value=params[param], expanding=True) for param in expanding],
+      **{param: value for param, value in params.items() if not param in expanding}
+    )
+
+
+  def apply(self, df):
+    """
+      Apply the query to a dataset that was loaded in full.
+
+      @param DataFrame df
+
+      @return DataFrame
+    """
+
+    mask = pd.Series(True, index=df.index)
+
+    for column, operator, value in self.filters:
+      if operator == 'ieq':
+        mask &= df[column].astype(str).str.lower() == value.lower()
+        continue
+
+      values = value if operator == 'in' else [value]
+      if all(isinstance(x, Number) for x in values):
+        series = pd.to_numeric(df[column], errors='coerce')
+      else:
+        series = df[column].astype(str)
+
+      if operator == 'in':
+        mask &= series.isin(values)
+      elif operator == '==':
+        mask &= series == value
+      elif operator == '>=':
+        mask &= series >= value
+      elif operator == '<=':
+        mask &= series <= value
+
+    df = df[mask]
+
+    if self.columns:
+      df = df[self.columns]
+
+    return df.reset_index(drop=True)
@@ -0,0 +1,112 @@
+"""
+  Regions rolled up from their municipalities, each defined as the set of
+  muni_id it is made of. Regions are added to or replaced by those defined
+  in the JSON file given by ROLLUP_REGIONS, see settings.rollups.
+"""
+
+regions = {
+  # Municipalities of the Metropolitan Area Planning Council
+  'MAPC': [
+    2,    # Acton
+    10,   # Arlington
+    14,   # Ashland
+    23,   # Bedford
+    25,   # Bellingham
+    26,   # Belmont
+    30,   # Beverly
+    34,   # Bolton
+    35,   # Boston
+    37,   # Boxborough
+    40,   # Braintree
+    46,   # Brookline
+    48,   # Burlington
+    49,   # Cambridge
+    50,   # Canton
+    51,   # Carlisle
+    57,   # Chelsea
+    65,   # Cohasset
+    67,   # Concord
+    71,   # Danvers
+    73,   # Dedham
+    78,   # Dover
+    82,   # Duxbury
+    92,   # Essex
+    93,   # Everett
+    99,   # Foxborough
+    100,  # Framingham
+    101,  # Franklin
+    107,  # Gloucester
+    119,  # Hamilton
+    122,  # Hanover
+    131,  # Hingham
+    133,  # Holbrook
+    136,  # Holliston
+    139,  # Hopkinton
+    141,  # Hudson
+    142,  # Hull
+    144,  # Ipswich
+    155,  # Lexington
+    157,  # Lincoln
+    158,  # Littleton
+    163,  # Lynn
+    164,  # Lynnfield
+    165,  # Malden
+    166,  # Manchester
+    168,  # Marblehead
+    170,  # Marlborough
+    171,  # Marshfield
+    174,  # Maynard
+    175,  # Medfield
+    176,  # Medford
+    177,  # Medway
+    178,  # Melrose
+    184,  # Middleton
+    185,  # Milford
+    187,  # Millis
+    189,  # Milton
+    196,  # Nahant
+    198,  # Natick
+    199,  # Needham
+    207,  # Newton
+    208,  # Norfolk
+    213,  # North Reading
+    219,  # Norwell
+    220,  # Norwood
+    229,  # Peabody
+    231,  # Pembroke
+    243,  # Quincy
+    244,  # Randolph
+    246,  # Reading
+    248,  # Revere
+    251,  # Rockland
+    252,  # Rockport
+    258,  # Salem
+    262,  # Saugus
+    264,  # Scituate
+    266,  # Sharon
+    269,  # Sherborn
+    274,  # Somerville
+    277,  # Southborough
+    284,  # Stoneham
+    285,  # Stoughton
+    286,  # Stow
+    288,  # Sudbury
+    291,  # Swampscott
+    298,  # Topsfield
+    305,  # Wakefield
+    307,  # Walpole
+    308,  # Waltham
+    314,  # Watertown
+    315,  # Wayland
+    317,  # Wellesley
+    320,  # Wenham
+    333,  # Weston
+    335,  # Westwood
+    336,  # Weymouth
+    342,  # Wilmington
+    344,  # Winchester
+    346,  # Winthrop
+    347,  # Woburn
+    350,  # Wrentham
+  ],
+}
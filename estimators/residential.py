@@ -3,17 +3,61 @@
 """
 
 import pandas as pd
-import numpy as np
-from .estimator import Estimator
- 
-
-def residential(data_sources):
+from .estimator import Estimator, requires, resolve_queries
+from .calibration import calibrate
+from .factors import fuel_conversion, emissions_factors
+from .query import Query
+from .profiler import profiler
+from .vintage import default_vintage
+
+
+recs_query = Query(['geography', 'hu_type', 'avg_elec', 'avg_ng', 'avg_foil'])
+
+# Housing unit types of the RECS structural characteristics and consumption
+# tables, also used to draw the RECS intensities in uncertainty.py
+hu_type_map = {
+  'Single Family Attached': 'u1a',
+  'Single Family Detached': 'u1d',
+  'Apartments in 2-4 Unit Buildings': 'u2_4',
+  'Apartments in 5 or more Unit Buildings': 'u5ov',
+  'Mobile Homes': 'u_oth',
+}
+
+hfc_hu_map = {
+  'Total Households': 'total',
+  'Single-Family Attached': 'u1a',
+  'Single-Family Detached': 'u1d',
+  'Apartments in 2-4 Unit Buildings': 'u2_4',
+  'Apartments in 5 or More Unit Buildings': 'u5ov',
+  'Mobile Homes': 'u_oth',
+}
+
+
+@requires(
+  eowld=Query(['muni_id', 'municipal']),
+  acs_uis=lambda vintages: Query(
+    ['muni_id', 'municipal', 'acs_year', 'hu', 'u1a', 'u1d', 'u2_4', 'u5_9', 'u10_19', 'u20ov', 'u_oth'],
+    [('acs_year', 'in', [vintage.acs_year for vintage in vintages])]
+  ),
+  acs_hf=lambda vintages: Query(
+    ['muni_id', 'municipal', 'acs_year', 'gas', 'elec', 'oil'],
+    [('acs_year', 'in', [vintage.acs_year for vintage in vintages])]
+  ),
+  recs_sc=Query(['hu_type', 'ma']),
+  recs_hfc=recs_query,
+  recs_hfe=recs_query,
+  masssave_res=Query(['muni_id', 'municipal', 'cal_year', 'mwh_use', 'therm_use']),
+)
+def residential(data_sources, vintages=None):
   """
     @param List<Dict<String>> data_sources
+    @param List<Vintage> vintages     Defaults to the default vintage
 
     @return DataFrame
   """
 
+  vintages = vintages or [default_vintage]
+
   fuel_type_map = {
     'gas': 'ng',
     'oil': 'foil',
@@ -34,23 +78,6 @@ def residential(data_sources):
     hfe_fuel_map[fuel] = fuel+'_hfe'
 
 
-  hu_type_map = {
-      'Single Family Attached': 'u1a',
-      'Single Family Detached': 'u1d',
-      'Apartments in 2-4 Unit Buildings': 'u2_4',
-      'Apartments in 5 or more Unit Buildings': 'u5ov',
-      'Mobile Homes': 'u_oth',
-  }
-
-  hfc_hu_map = {
-    'Total Households': 'total',
-    'Single-Family Attached': 'u1a',
-    'Single-Family Detached': 'u1d',
-    'Apartments in 2-4 Unit Buildings': 'u2_4',
-    'Apartments in 5 or More Unit Buildings': 'u5ov',
-    'Mobile Homes': 'u_oth',
-  }
-
   hfe_hu_map = {
     'Total Households': 'total',
     'Single-Family Attached': 'u1a',
@@ -76,27 +103,10 @@ def residential(data_sources):
   # For calibration
   calibrated_fuels = ['elec', 'ng']
 
-  fuel_conversion = {
-    'elec': {
-      2013: 0.006841,
-      2014: 0.007692, 
-      2015: 0.006707,
-    },
-    'ng': 0.1,
-  }
-
-  emissions_factors = {
-    'elec': {
-      2013: .93,     
-      2014: .941,
-      2015: .857,
-    },
-    'ng': 11.710
-  }
-
   col_order = [
     'muni_id',
     'municipal',
+    'vintage',
     'year',
     'hu_type',
     'hu',
@@ -117,67 +127,36 @@ def residential(data_sources):
 
 
 
-  def methodology(datasets):
+  def recs_intensities(datasets):
     """
+      Scale the national RECS consumption and expenditure of each housing
+      unit type to Massachusetts. These do not depend on the municipality
+      or the vintage.
+
       @param Dict<DataFrame> datasets
 
       @return DataFrame
     """
 
-    """
-      Step 1 in Methodology
-    """
-    acs_uis = datasets['acs_uis']
-    acs_uis = acs_uis[(acs_uis['acs_year'] == '2011-15')]
-    acs_uis = acs_uis[['muni_id', 'municipal', 'hu', 'u1a', 'u1d', 'u2_4', 'u5_9', 'u10_19', 'u20ov', 'u_oth']]
-    acs_uis.rename(columns={'hu': 'total'}, inplace=True)
-
-    # Add 5 and over columns together
-    u5ov = ['u5_9', 'u10_19', 'u20ov']
-    acs_uis['u5ov'] = acs_uis[u5ov].sum(axis=1, skipna=True)
-    acs_uis.drop(u5ov, axis=1, inplace=True)
-
-
-    """
-      Step 2 in Methodology
-    """
-    acs_hf = datasets['acs_hf']
-    acs_hf = acs_hf[(acs_hf['acs_year'] == '2011-15')]
-    acs_hf = acs_hf[['muni_id', 'gas', 'elec', 'oil']]
-    
-    results = pd.merge(acs_uis, acs_hf, on='muni_id')
-    
-    for fuel_og, fuel in fuel_type_map.items():
-      if not fuel == 'elec':
-        results[fuel+'_%'] = results[fuel_og] / results['total']
-
-    results['elec_%'] = 1.0
-
-
-    """
-      Step 3 in Methodology
-    """
     # Prepare percentages to scale the energy consumption for MA 
     # based on the national 
-    recs_sc = pd.DataFrame(datasets['recs_sc'][['hu_type', 'ma']])
-    recs_sc.replace('Q', np.nan, inplace=True)
+    recs_sc = datasets['recs_sc'][['hu_type', 'ma']]
     recs_sc['hu_type'] = recs_sc['hu_type'].map(hu_type_map)
-    recs_sc['ma'] = recs_sc['ma'].astype(float)
     ma_sum = recs_sc[['ma']].sum()
-    recs_sc = recs_sc.append(pd.DataFrame({'hu_type': 'total', 'ma': ma_sum}))
+    recs_sc = pd.concat([recs_sc, pd.DataFrame({'hu_type': 'total', 'ma': ma_sum})])
     recs_sc = recs_sc.groupby('hu_type').sum()
     recs_sc = recs_sc.reset_index()
 
     recs_sc['ma'] = recs_sc['ma'] / float(ma_sum)
 
     # Apply MA percentages to national energy consumption
-    recs_hfc = pd.DataFrame(datasets['recs_hfc'])
-    recs_hfe = pd.DataFrame(datasets['recs_hfe'])
+    recs_hfc = datasets['recs_hfc']
+    recs_hfe = datasets['recs_hfe']
 
-    recs_hfc_ma = recs_hfc[recs_hfc['geography'].str.lower() == 'massachusetts']
-    recs_hfe_ma = recs_hfe[recs_hfe['geography'].str.lower() == 'massachusetts']
-    recs_hfc = recs_hfc[recs_hfc['geography'].str.lower() == 'united states']
-    recs_hfe = recs_hfe[recs_hfe['geography'].str.lower() == 'united states']
+    recs_hfc_ma = recs_hfc[recs_hfc['geography'] == 'massachusetts']
+    recs_hfe_ma = recs_hfe[recs_hfe['geography'] == 'massachusetts']
+    recs_hfc = recs_hfc[recs_hfc['geography'] == 'united states']
+    recs_hfe = recs_hfe[recs_hfe['geography'] == 'united states']
 
     recs_hfc = recs_hfc[['hu_type', 'avg_elec', 'avg_ng', 'avg_foil']]
     recs_hfe = recs_hfe[['hu_type', 'avg_elec', 'avg_ng', 'avg_foil']]
@@ -192,9 +171,6 @@ def residential(data_sources):
     recs_hfc = recs_hfc.reset_index()
     recs_hfc = pd.merge(recs_hfc, recs_sc, on='hu_type')
 
-    for fuel in fuel_type_map.values():
-      recs_hfe[fuel] = recs_hfe[fuel].astype(str).str.replace(',', '').apply(pd.to_numeric)
-
     recs_hfe = recs_hfe.groupby('hu_type').sum()
     recs_hfe = recs_hfe.reset_index()
     recs_hfe = pd.merge(recs_hfe, recs_sc, on='hu_type')
@@ -216,24 +192,79 @@ def residential(data_sources):
       recs_hfe['adj'] = recs_hfe[fuel] * recs_hfe['ma']
       hfc_adjustment_ratio = (hfc_ma_consumptions[fuel] / recs_hfc[recs_hfc['hu_type'] != 'total']['adj'].sum()).values[0]
       hfe_adjustment_ratio = (hfe_ma_consumptions[fuel] / recs_hfe[recs_hfe['hu_type'] != 'total']['adj'].sum()).values[0]
-      recs_hfc[fuel] = recs_hfc[fuel].astype(float) * hfc_adjustment_ratio
-      recs_hfe[fuel] = recs_hfe[fuel].astype(float) * hfe_adjustment_ratio
+      recs_hfc[fuel] = recs_hfc[fuel] * hfc_adjustment_ratio
+      recs_hfe[fuel] = recs_hfe[fuel] * hfe_adjustment_ratio
 
     recs_hfc.drop(['adj', 'ma'], axis=1, inplace=True)
     recs_hfe.drop(['adj', 'ma'], axis=1, inplace=True)
     recs_hfc.rename(columns=hfc_fuel_map, inplace=True)
     recs_hfe.rename(columns=hfe_fuel_map, inplace=True)
 
-    results = pd.melt(results, id_vars=['muni_id', 'municipal', 'gas', 'elec', 'oil', 'ng_%', 'foil_%', 'elec_%'], var_name='hu_type', value_name='hu')
+    return pd.merge(recs_hfc, recs_hfe, on='hu_type')
+
+
+  def methodology(datasets):
+    """
+      @param Dict<DataFrame> datasets
+
+      @return DataFrame
+    """
+
+    # ACS five-year span of each vintage
+    acs_years = pd.DataFrame([(vintage.year, vintage.acs_year) for vintage in vintages], columns=['vintage', 'acs_year'])
+
+
+    """
+      Step 1 in Methodology
+    """
+    profiler.step('Step 1 in Methodology', rows_in=len(datasets['acs_uis']))
+    acs_uis = pd.merge(datasets['acs_uis'], acs_years, on='acs_year').drop('acs_year', axis=1)
+    acs_uis.rename(columns={'hu': 'total'}, inplace=True)
+
+    # Add 5 and over columns together
+    u5ov = ['u5_9', 'u10_19', 'u20ov']
+    acs_uis['u5ov'] = acs_uis[u5ov].sum(axis=1, skipna=True)
+    acs_uis.drop(u5ov, axis=1, inplace=True)
+
+
+    """
+      Step 2 in Methodology
+    """
+    profiler.step('Step 2 in Methodology', rows_in=len(acs_uis))
+    acs_hf = pd.merge(datasets['acs_hf'], acs_years, on='acs_year')
+    acs_hf = acs_hf[['vintage', 'muni_id', 'gas', 'elec', 'oil']]
+    
+    results = pd.merge(acs_uis, acs_hf, on=['vintage', 'muni_id'])
+    
+    for fuel_og, fuel in fuel_type_map.items():
+      if not fuel == 'elec':
+        results[fuel+'_%'] = results[fuel_og] / results['total']
+
+    results['elec_%'] = 1.0
+
+
+    """
+      Step 3 in Methodology
+    """
+    profiler.step('Step 3 in Methodology', rows_in=len(results))
+    # Only rebuilt when the RECS tables change
+    intensities = Estimator.artifact_store.fetch(
+      'recs_intensities',
+      1,
+      {tag: datasets[tag] for tag in ['recs_sc', 'recs_hfc', 'recs_hfe']},
+      lambda: recs_intensities(datasets)
+    )
+
+    results = pd.melt(results, id_vars=['muni_id', 'municipal', 'vintage', 'gas', 'elec', 'oil', 'ng_%', 'foil_%', 'elec_%'], var_name='hu_type', value_name='hu')
 
     results.rename(columns=fuel_type_map, inplace=True)
-    results = pd.merge(results, recs_hfc, on='hu_type')
-    results = pd.merge(results, recs_hfe, on='hu_type')
+    results = pd.merge(results, intensities, on='hu_type')
 
 
     """
       Step 4 in Methodology
     """
+    profiler.step('Step 4 in Methodology', rows_in=len(results))
     for fuel in fuel_type_map.values():
       results[fuel+'_con_mmbtu'] = results['hu'] * results[fuel+'_hfc'] * results[fuel+'_%']
       results[fuel+'_con_pu'] = results[fuel+'_con_mmbtu'] / fuel_conversion_map[fuel]
@@ -241,11 +272,10 @@ def residential(data_sources):
       results[fuel+'_exp_dollar'] = results['hu'] * results[fuel+'_hfe'] * results[fuel+'_%']
 
 
-    results = results[['muni_id', 'municipal', 'hu_type', 'hu'] + fuel_cons_columns + fuel_cons_pu_columns + fuel_exp_columns]
+    results = results[['muni_id', 'municipal', 'vintage', 'hu_type', 'hu'] + fuel_cons_columns + fuel_cons_pu_columns + fuel_exp_columns]
     results['total_con_mmbtu'] = results[fuel_cons_columns].sum(axis=1)
     results['total_exp_dollar'] = results[fuel_exp_columns].sum(axis=1)
 
-    emissions = pd.DataFrame()
     for fuel, conversion_ratio in co2_conversion_map.items():
       results[fuel+'_emissions_co2'] = results[fuel+'_con_pu'] * conversion_ratio
 
@@ -253,50 +283,32 @@ def residential(data_sources):
     """
       Calibrate using MassSave data
     """
+    profiler.step('Calibrate using MassSave data', rows_in=len(results))
     print("Calibrating Residential sector using MassSave data...")
 
-    masssave_res_all = pd.DataFrame(datasets['masssave_res'])
-    masssave_res_all = masssave_res_all[['municipal', 'cal_year', 'mwh_use', 'therm_use']].rename(columns={'mwh_use': 'elec', 'therm_use': 'ng'})
-    masssave_res_all['elec'] *= 1000
-
-    years = masssave_res_all['cal_year'].unique()
-    latest_year = years[-1]
-
-    calibrated_results = pd.DataFrame()
-
-    for municipality in datasets['eowld']['municipal'].unique():
-      masssave_res = masssave_res_all[masssave_res_all['municipal'] == municipality]
-      muni_data = results[results['municipal'] == municipality].copy();
-
-      pu_totals = {}
-      for fuel in calibrated_fuels:
-        pu_totals[fuel] = muni_data[fuel+'_con_pu'].sum()
-
-      for year in years:
-        masssave = masssave_res[masssave_res['cal_year'] == year]
-        muni_data_by_year = muni_data.copy()
-
-        for fuel in calibrated_fuels:
-          ratio = (masssave[fuel] / pu_totals[fuel]).values
-          calibrator = ratio[0] if len(ratio) > 0 and not np.isnan(ratio[0]) else 1
-
-          muni_data_by_year[fuel+'_con_pu'] = muni_data_by_year[fuel+'_con_pu'].apply(lambda x: x * calibrator)
-          muni_data_by_year[fuel+'_exp_dollar'] = muni_data_by_year[fuel+'_exp_dollar'].apply(lambda x: x * calibrator)
-          muni_data_by_year[fuel+'_con_mmbtu'] = muni_data_by_year[fuel+'_con_pu'] * (fuel_conversion['elec'][year] or fuel_conversion['elec'][latest_year]) if fuel == 'elec' else muni_data_by_year[fuel+'_con_pu'] * fuel_conversion[fuel]
-          muni_data_by_year[fuel+'_emissions_co2'] = muni_data_by_year[fuel+'_con_pu'] * (emissions_factors['elec'][year] or emissions_factors['elec'][latest_year]) if fuel == 'elec' else muni_data_by_year[fuel+'_con_pu'] * emissions_factors[fuel]
-
-        muni_data_by_year['year'] = year
+    municipalities = pd.concat([
+      pd.DataFrame({'vintage': vintage.year, 'muni_id': datasets['eowld']['muni_id'].unique()})
+      for vintage in vintages
+    ])
 
-        calibrated_results = calibrated_results.append(muni_data_by_year, ignore_index=True)
+    calibrated_results = calibrate(
+      {'residential': results},
+      datasets['masssave_res'],
+      municipalities,
+      calibrated_fuels,
+      fuel_conversion,
+      emissions_factors
+    )['residential']
 
 
     """
       Cleanup
     """
-    calibrated_results.sort_values(['municipal', 'year', 'hu_type'], inplace=True)
+    profiler.step('Cleanup', rows_in=len(calibrated_results))
+    calibrated_results.sort_values(['vintage', 'municipal', 'year', 'hu_type'], inplace=True)
 
     return calibrated_results[col_order]
 
 
   # Construct the Estimator from the methodology and then process the data sources
-  return Estimator(methodology)(data_sources)
+  return Estimator(methodology, residential.dataset_tags, resolve_queries(residential.dataset_queries, vintages))(data_sources)
@@ -0,0 +1,114 @@
+"""
+  Rollups
+
+  Totals of every municipality by year, sector and fuel, and of every region
+  made of those municipalities, so that consumers never have to sum the
+  detailed rows of each activity, housing unit type or industry. The detail
+  of all sectors is summed in a single groupby. Regions are then summed from
+  the municipal totals.
+"""
+
+import json
+import pandas as pd
+from .regions import regions as default_regions
+from .settings import settings
+
+
+fuels = ['elec', 'ng', 'foil']
+
+measures = ['con_pu', 'con_mmbtu', 'exp_dollar', 'emissions_co2']
+
+rollup_keys = ['muni_id', 'municipal', 'vintage', 'year', 'sector']
+
+# Detail rows that already total the other rows of their municipality
+subtotals = {
+  'hu_type': 'total',
+}
+
+
+def load_regions(file_path=None):
+  """
+    @param String file_path     JSON file of regions, defaults to settings.rollups.REGIONS_PATH
+
+    @return Dict<List<Number>>  muni_id of each region
+  """
+
+  file_path = file_path or settings.rollups.REGIONS_PATH
+  regions = dict(default_regions)
+
+  if file_path:
+    with open(file_path) as regions_file:
+      regions.update(json.load(regions_file))
+
+  return regions
+
+
+def municipal_rollup(sector_data):
+  """
+    @param Dict<DataFrame> sector_data
+
+    @return DataFrame     Totals of every municipality by vintage, year, sector and fuel
+  """
+
+  columns = [fuel+'_'+measure for fuel in fuels for measure in measures]
+
+  def details(df):
+    for column, value in subtotals.items():
+      if column in df.columns:
+        df = df[df[column] != value]
+
+    return df[[column for column in rollup_keys + columns if column in df.columns]]
+
+  detail = pd.concat([
+    details(df).assign(sector=sector)
+    for sector, df in sector_data.items()
+  ], ignore_index=True, sort=False)
+
+  # Names are categorical, with different categories in each sector
+  detail['municipal'] = detail['municipal'].astype(str)
+
+  totals = detail.groupby(rollup_keys, sort=True)[columns].sum(min_count=1)
+
+  # One row for each fuel
+  totals.columns = pd.MultiIndex.from_tuples([(fuel, measure) for fuel in fuels for measure in measures])
+  totals = totals.stack(level=0, dropna=False).rename_axis(rollup_keys + ['fuel']).reset_index()
+
+  return totals[rollup_keys + ['fuel'] + measures]
+
+
+def region_rollup(municipal_totals, regions):
+  """
+    @param DataFrame municipal_totals     As returned by municipal_rollup
+    @param Dict<List<Number>> regions
+
+    @return DataFrame     Totals of every region by vintage, year, sector and fuel
+  """
+
+  membership = pd.DataFrame(
+    [(region, muni_id) for region, muni_ids in regions.items() for muni_id in muni_ids],
+    columns=['region', 'muni_id']
+  )
+
+  totals = pd.merge(municipal_totals, membership, on='muni_id')
+  keys = ['region', 'vintage', 'year', 'sector', 'fuel']
+
+  municipalities = totals.groupby(keys, sort=True)['muni_id'].nunique().rename('municipalities')
+  totals = totals.groupby(keys, sort=True)[measures].sum(min_count=1)
+
+  return pd.concat([totals, municipalities], axis=1).reset_index()
+
+
+def rollup(sector_data, regions=None):
+  """
+    @param Dict<DataFrame> sector_data
+    @param Dict<List<Number>> regions     Defaults to load_regions()
+
+    @return Dict<DataFrame>     'municipality' and 'region' rollups
+  """
+
+  municipal_totals = municipal_rollup(sector_data)
+
+  return {
+    'municipality': municipal_totals,
+    'region': region_rollup(municipal_totals, load_regions() if regions is None else regions),
+  }
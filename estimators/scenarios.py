@@ -0,0 +1,137 @@
+"""
+  Factor Scenarios
+
+  Recomputes the factor dependent columns of the published estimates for
+  many sets of conversion and emissions factors at once, without estimating
+  anything again. The calibrated consumption of every row, in physical units,
+  is the base quantity. All scenarios are evaluated in a single broadcast
+  over an array of scenarios by fuels by rows.
+
+  A scenario file is a JSON list of scenarios. Each scenario replaces some
+  of the baseline factors in factors.py, by fuel, with a constant or with
+  factors keyed by year:
+
+    [
+      {"name": "baseline"},
+      {"name": "cleaner grid", "emissions_factors": {"elec": {"2013": 0.8, "2015": 0.6}}},
+      {"name": "higher heat content", "fuel_conversion": {"ng": 0.1037}}
+    ]
+
+  Years without a factor of their own use the factor of the latest year,
+  as the published estimates do, see factors.year_factors.
+
+  The totals of a scenario are the sums over elec, ng and foil of the
+  calibrated values. The published total_con_mmbtu is the estimate from
+  before MassSave calibration and takes in the fuels the sectors do not
+  break out, so a baseline scenario reproduces the published per fuel
+  columns but not that total.
+"""
+
+import json
+import numpy as np
+import pandas as pd
+from . import factors
+from .factors import year_factors
+
+
+fuels = ['elec', 'ng', 'foil']
+
+baseline_factors = {
+  'fuel_conversion': factors.fuel_conversion,
+  'emissions_factors': factors.emissions_factors,
+}
+
+key_columns = ['muni_id', 'municipal', 'vintage', 'year']
+
+# Detail of each sector, kept as they are
+label_columns = ['activity', 'naicstitle', 'hu_type']
+
+
+def read_scenarios(file_path):
+  """
+    @param String file_path
+
+    @return List<Dict>
+  """
+
+  with open(file_path) as scenario_file:
+    scenarios = json.load(scenario_file)
+
+  if not isinstance(scenarios, list) or not scenarios:
+    raise ValueError('{} must hold a list of scenarios'.format(file_path))
+
+  names = [scenario.get('name') for scenario in scenarios]
+  if None in names or len(set(names)) != len(names):
+    raise ValueError('Every scenario in {} needs a name of its own'.format(file_path))
+
+  for scenario in scenarios:
+    for name, fuel_factors in scenario.items():
+      if name == 'name':
+        continue
+
+      if not name in baseline_factors:
+        raise ValueError("Unknown factors '{}' in scenario '{}'".format(name, scenario['name']))
+
+      for fuel, factor in fuel_factors.items():
+        if not fuel in fuels:
+          raise ValueError("Unknown fuel '{}' in scenario '{}'".format(fuel, scenario['name']))
+
+        # JSON keys are always strings
+        if isinstance(factor, dict):
+          fuel_factors[fuel] = {int(year): value for year, value in factor.items()}
+
+  return scenarios
+
+
+def factor_table(scenarios, name, years):
+  """
+    @param List<Dict> scenarios
+    @param String name      Name of the factors, e.g. emissions_factors
+    @param ndarray years
+
+    @return ndarray     Factors of every scenario, fuel and year
+  """
+
+  return np.array([
+    [year_factors(scenario.get(name, {}).get(fuel, baseline_factors[name][fuel]), years) for fuel in fuels]
+    for scenario in scenarios
+  ])
+
+
+def evaluate(sector_data, scenarios):
+  """
+    @param Dict<DataFrame> sector_data    Published estimates of each sector
+    @param List<Dict> scenarios
+
+    @return DataFrame     One row for every scenario and estimate
+  """
+
+  pu_columns = [fuel+'_con_pu' for fuel in fuels]
+
+  detail = pd.concat([
+    df[[column for column in key_columns + label_columns + pu_columns if column in df.columns]].assign(sector=sector)
+    for sector, df in sector_data.items()
+  ], ignore_index=True, sort=False)
+
+  years, year_positions = np.unique(detail['year'].values, return_inverse=True)
+
+  # Fuels by rows, against scenarios by fuels by rows
+  consumption = detail[pu_columns].to_numpy(dtype=float).T
+  con_mmbtu = consumption * factor_table(scenarios, 'fuel_conversion', years)[:, :, year_positions]
+  emissions_co2 = consumption * factor_table(scenarios, 'emissions_factors', years)[:, :, year_positions]
+
+  rows = len(detail)
+  results = {'scenario': np.repeat([scenario['name'] for scenario in scenarios], rows)}
+
+  for column in ['sector'] + key_columns + label_columns:
+    if column in detail.columns:
+      results[column] = np.tile(detail[column].values, len(scenarios))
+
+  for position, fuel in enumerate(fuels):
+    results[fuel+'_con_mmbtu'] = con_mmbtu[:, position, :].ravel()
+    results[fuel+'_emissions_co2'] = emissions_co2[:, position, :].ravel()
+
+  results['total_con_mmbtu'] = np.nansum(con_mmbtu, axis=1).ravel()
+  results['total_emissions_co2'] = np.nansum(emissions_co2, axis=1).ravel()
+
+  return pd.DataFrame(results)
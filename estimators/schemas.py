@@ -0,0 +1,243 @@
+"""
+  Dataset Schemas
+
+  Types of the columns of each tag in Estimator.database_tag_map. Every
+  dataset is conformed to its schema once, as it is loaded, so that the
+  methodologies receive clean frames whichever source it was read from:
+
+    number    Numbers, where the suppression markers of EIA and BLS and blank
+              fields are missing values, and thousands separators are ignored.
+              Any other text is an error.
+    code      Numeric codes such as NAICS codes. Codes that are not numbers,
+              such as 31-33, are missing values.
+    key       Labels matched on by the methodologies, stripped and lowercased.
+    string    Labels kept as they are.
+
+  Files are parsed with the text columns as text, since a file where every
+  code happens to be a number would otherwise be read with numbers. Columns
+  that are not listed are left as they are read.
+"""
+
+import pandas as pd
+
+
+# Values that stand for a suppressed or withheld estimate
+suppression_markers = ['*', 'Q', '']
+
+# Types parsed as text from files
+text_types = ['code', 'key', 'string']
+
+column_types = {
+  'eowld': {
+    'muni_id': 'number',
+    'municipal': 'string',
+    'naicscode': 'code',
+    'naicstitle': 'string',
+    'avgemp': 'number',
+    'estab': 'number',
+    'cal_year': 'number',
+  },
+  'cbecs_elec': {
+    'geography': 'key',
+    'years': 'number',
+    'activity': 'key',
+    'c_blg': 'number',
+    'e_blg': 'number',
+    'c_perwrkr': 'number',
+    'e_kwh': 'number',
+  },
+  'cbecs_foil': {
+    'geography': 'key',
+    'years': 'number',
+    'activity': 'key',
+    'c_blg': 'number',
+    'e_blg': 'number',
+    'c_perwrkr': 'number',
+    'e_kwh': 'number',
+  },
+  'cbecs_ng': {
+    'geography': 'key',
+    'years': 'number',
+    'activity': 'key',
+    'c_blg': 'number',
+    'e_blg': 'number',
+    'c_perwrkr': 'number',
+    'e_kwh': 'number',
+  },
+  'cbecs_sources': {
+    'geography': 'key',
+    'years': 'number',
+    'bld_group': 'key',
+    'bld_indic': 'key',
+    'all_bldg': 'number',
+    'nat_gas': 'number',
+    'fuel_oil': 'number',
+  },
+  'mecs_euc': {
+    'geography': 'key',
+    'years': 'number',
+    'naicstitle': 'string',
+    'naics_3d': 'code',
+    'net_elec': 'number',
+    'natgas': 'number',
+    'd_fueloil': 'number',
+    'r_fueloil': 'number',
+  },
+  'mecs_fuc': {
+    'geography': 'key',
+    'years': 'number',
+    'naicstitle': 'string',
+    'naics_3d': 'code',
+    'tot_consum': 'number',
+    'd_fueloil': 'number',
+    'r_fueloil': 'number',
+  },
+  'mecs_fce': {
+    'geography': 'key',
+    'years': 'number',
+    'naicscode': 'code',
+    'naicstitle': 'string',
+    'c_employee': 'number',
+  },
+  'recs_hfc': {
+    'geography': 'key',
+    'hu_type': 'string',
+    'avg_elec': 'number',
+    'avg_ng': 'number',
+    'avg_foil': 'number',
+  },
+  'recs_hfe': {
+    'geography': 'key',
+    'hu_type': 'string',
+    'avg_elec': 'number',
+    'avg_ng': 'number',
+    'avg_foil': 'number',
+  },
+  'recs_sc': {
+    'hu_type': 'string',
+    'ma': 'number',
+  },
+  'acs_uis': {
+    'muni_id': 'number',
+    'municipal': 'string',
+    'geoid': 'string',
+    'acs_year': 'string',
+    'hu': 'number',
+    'u1a': 'number',
+    'u1d': 'number',
+    'u2_4': 'number',
+    'u5_9': 'number',
+    'u10_19': 'number',
+    'u20ov': 'number',
+    'u_oth': 'number',
+  },
+  'acs_hf': {
+    'muni_id': 'number',
+    'municipal': 'string',
+    'geoid': 'string',
+    'acs_year': 'string',
+    'gas': 'number',
+    'elec': 'number',
+    'oil': 'number',
+  },
+  'masssave_ci': {
+    'muni_id': 'number',
+    'municipal': 'string',
+    'cal_year': 'number',
+    'sector': 'string',
+    'mwh_use': 'number',
+    'therm_use': 'number',
+    'h_e_incnt': 'string',
+    'h_mwh_use': 'string',
+    'h_mwh_save': 'string',
+    'h_g_incnt': 'string',
+    'h_thrmuse': 'string',
+    'h_thrmsave': 'string',
+  },
+  'masssave_res': {
+    'muni_id': 'number',
+    'municipal': 'string',
+    'cal_year': 'number',
+    'sector': 'string',
+    'mwh_use': 'number',
+    'therm_use': 'number',
+    'h_e_incnt': 'string',
+    'h_mwh_use': 'string',
+    'h_mwh_save': 'string',
+    'h_g_incnt': 'string',
+    'h_thrmuse': 'string',
+    'h_thrmsave': 'string',
+  },
+}
+
+
+def to_numbers(series, name):
+  """
+    @param Series series
+    @param String name      Dataset and column, for errors
+
+    @return Series
+  """
+
+  if pd.api.types.is_numeric_dtype(series):
+    return series
+
+  text = series.dropna().astype(str).str.strip().str.replace(',', '', regex=False)
+  text = text[~text.isin(suppression_markers)]
+  numbers = pd.to_numeric(text, errors='coerce')
+
+  invalid = text[numbers.isnull()]
+  if len(invalid):
+    raise ValueError("Unexpected value '{}' in {}".format(invalid.iloc[0], name))
+
+  return numbers.reindex(series.index)
+
+
+def to_codes(series):
+  """
+    @param Series series
+
+    @return Series
+  """
+
+  if pd.api.types.is_numeric_dtype(series):
+    return series
+
+  return pd.to_numeric(series.astype(str).str.strip(), errors='coerce')
+
+
+def to_keys(series):
+  """
+    @param Series series
+
+    @return Series
+  """
+
+  return series.where(series.isnull(), series.astype(str).str.strip().str.lower())
+
+
+def conform(df, tag):
+  """
+    @param DataFrame df
+    @param String tag
+
+    @return DataFrame     Columns of the schema of the tag in their types
+  """
+
+  columns = {}
+
+  for column, column_type in column_types.get(tag, {}).items():
+    if not column in df.columns:
+      continue
+
+    if column_type == 'number':
+      columns[column] = to_numbers(df[column], '{}.{}'.format(tag, column))
+    elif column_type == 'code':
+      columns[column] = to_codes(df[column])
+    elif column_type == 'key':
+      columns[column] = to_keys(df[column])
+
+  if not columns:
+    return df
+
+  return df.assign(**columns)
@@ -9,8 +9,45 @@ db = Munch({
   'NAME': environ.get('DB_NAME'),
   'USER': environ.get('DB_USER'),
   'PASSWORD': environ.get('DB_PASSWORD'),
+  'SCHEMA': environ.get('DB_SCHEMA', 'tabular'),
+
+  # Overrides the connection built from the values above,
+  # e.g. sqlite:////usr/src/app/results/data/lead.db
+  'URL': environ.get('DB_URL'),
+
+  # Number of tables loaded concurrently is POOL_SIZE + MAX_OVERFLOW
+  'POOL_SIZE': int(environ.get('DB_POOL_SIZE') or 4),
+  'MAX_OVERFLOW': int(environ.get('DB_MAX_OVERFLOW') or 0),
+
+  # Rows fetched per round trip when streaming a table
+  'CHUNK_SIZE': int(environ.get('DB_CHUNK_SIZE') or 50000),
+})
+
+source = Munch({
+  # Where datasets not given as files are read from: 'postgres', using the
+  # connection above, 'sqlite' or 'snapshot'
+  'BACKEND': environ.get('SOURCE_BACKEND') or 'postgres',
+
+  # SQLite database file, or directory of snapshot files named after their
+  # tags such as results/data
+  'PATH': environ.get('SOURCE_PATH'),
+})
+
+compute = Munch({
+  # Store the metrics of the source datasets as float32, halving their
+  # memory at the cost of precision in the estimates
+  'FLOAT32': (environ.get('COMPUTE_FLOAT32') or '').lower() in ['1', 'true', 'yes'],
+})
+
+rollups = Munch({
+  # JSON file of the regions to roll up, e.g. {"Inner Core": [35, 46, 49]},
+  # added to those in regions.py
+  'REGIONS_PATH': environ.get('ROLLUP_REGIONS'),
 })
 
 settings = Munch({
- 'db': db
+ 'db': db,
+ 'source': source,
+ 'compute': compute,
+ 'rollups': rollups,
 })
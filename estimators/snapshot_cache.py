@@ -0,0 +1,168 @@
+"""
+  Class: SnapshotCache
+
+  Keeps a local Feather snapshot of every table pulled from the database so
+  later runs can skip the database. Each snapshot is listed in a manifest
+  together with the checksum of the rows it was taken from, so that revised
+  rows are found even when the table keeps its size. Snapshots are only
+  replaced when they are invalidated explicitly.
+
+  Snapshots are keyed by tag and query, without the municipalities a run is
+  narrowed to, so a tag loaded with different queries has one snapshot per
+  query. Runs narrowed to a few municipalities read them from the snapshot
+  of every municipality. The snapshots of a tag that a run no longer uses
+  are pruned once the run has loaded its datasets.
+"""
+
+import json
+import pandas as pd
+from datetime import datetime
+from threading import Lock
+from os import makedirs, path, remove
+from .query import Query
+
+
+class SnapshotCache(object):
+
+  def __init__(self, directory):
+    """
+      @param String directory
+    """
+
+    self.directory = directory
+    self.manifest_path = path.join(directory, 'manifest.json')
+    self.lock = Lock()
+
+    # Keys of the snapshots read or written by this run
+    self.used = set()
+
+    makedirs(directory, exist_ok=True)
+
+    if path.exists(self.manifest_path):
+      with open(self.manifest_path) as manifest:
+        self.manifest = json.load(manifest)
+    else:
+      self.manifest = {}
+
+
+  def path(self, key):
+    """
+      @param String key
+
+      @return String
+    """
+
+    return path.join(self.directory, key + '.feather')
+
+
+  def read(self, key):
+    """
+      @param String key
+
+      @return DataFrame|None
+    """
+
+    if not key in self.manifest or not path.exists(self.path(key)):
+      return None
+
+    with self.lock:
+      self.used.add(key)
+
+    return pd.read_feather(self.path(key))
+
+
+  def write(self, key, tag, table, df, query=None, checksum=None):
+    """
+      @param String key
+      @param String tag
+      @param String table       Table the snapshot was taken from
+      @param DataFrame df
+      @param Query query        Query the snapshot was taken with
+      @param String checksum    Checksum of the rows in the source, see DatabaseSource.checksum
+    """
+
+    try:
+      df.to_feather(self.path(key))
+    except Exception as error:
+      # Columns mixing types cannot be stored. The table is simply
+      # loaded from the database again on the next run.
+      print("Could not cache {}: {}".format(key, error))
+      return
+
+    with self.lock:
+      self.manifest[key] = {
+        'tag': tag,
+        'table': table,
+        'query': query.describe() if query else None,
+        'rows': len(df),
+        'checksum': checksum,
+        'cached_at': datetime.now().isoformat(),
+      }
+      self.used.add(key)
+      self.save()
+
+
+  def invalidate(self, tags=None):
+    """
+      @param List<String> tags      Defaults to every cached tag
+    """
+
+    with self.lock:
+      for key, entry in list(self.manifest.items()):
+        if tags is None or entry['tag'] in tags:
+          del self.manifest[key]
+
+          if path.exists(self.path(key)):
+            remove(self.path(key))
+
+      self.save()
+
+
+  def stale(self, checksum):
+    """
+      Find the tags of the snapshots whose rows changed in the source since
+      they were taken. Snapshots without a checksum are stale.
+
+      @param Function<[String,Query],String> checksum
+
+      @return List<String>
+    """
+
+    tags = []
+
+    for entry in self.manifest.values():
+      query = Query.from_description(entry['query']) if entry['query'] else None
+
+      if not entry.get('checksum') or checksum(entry['tag'], query) != entry['checksum']:
+        tags.append(entry['tag'])
+
+    return tags
+
+
+  def prune(self):
+    """
+      Remove the snapshots of the tags used by this run that were taken with
+      queries the run did not use, e.g. those of other vintages.
+
+      @return List<String>    Keys of the removed snapshots
+    """
+
+    with self.lock:
+      tags = set(self.manifest[key]['tag'] for key in self.used if key in self.manifest)
+      removed = [key for key, entry in self.manifest.items() if entry['tag'] in tags and not key in self.used]
+
+      for key in removed:
+        del self.manifest[key]
+
+        if path.exists(self.path(key)):
+          remove(self.path(key))
+
+      if removed:
+        self.save()
+
+    return removed
+
+
+  def save(self):
+    with open(self.manifest_path, 'w') as manifest:
+      json.dump(self.manifest, manifest, indent=2, sort_keys=True)
@@ -0,0 +1,427 @@
+"""
+  Source Backends
+
+  Where the datasets are read from when they are not given as files. Either
+  a database, PostgreSQL or SQLite, or a directory of snapshot files named
+  after their tags, such as results/data/acs_uis.csv. The backend is chosen
+  with SOURCE_BACKEND, see settings.source.
+
+  Database connections are only opened once a dataset is read, so a run from
+  a snapshot directory never touches the network. A snapshot directory can
+  be exported from a database with export_snapshot.
+"""
+
+import json
+import sqlalchemy
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from munch import Munch
+from hashlib import sha1
+from decimal import Decimal
+from threading import Lock
+from os import makedirs, path, remove
+from .query import Query
+from .artifacts import source_hash
+from .schemas import column_types, text_types
+
+
+def read_csv(file_path, columns=None, types={}):
+  """
+    Parse a CSV file with the multithreaded Arrow reader. Empty fields are
+    missing values in every column, as they are when read by pandas.
+
+    @param String file_path
+    @param List<String> columns     Defaults to every column
+    @param Dict<String> types       Type of some of the columns, see schemas.py
+
+    @return DataFrame
+  """
+
+  # Other columns are conformed to their type once loaded
+  text_columns = [column for column, column_type in types.items() if column_type in text_types]
+
+  table = pa_csv.read_csv(
+    file_path,
+    read_options=pa_csv.ReadOptions(use_threads=True),
+    convert_options=pa_csv.ConvertOptions(
+      include_columns=columns,
+      column_types={column: pa.string() for column in text_columns},
+      strings_can_be_null=True
+    )
+  )
+
+  return table.to_pandas()
+
+
+def read_excel(file_path, types={}):
+  """
+    @param String file_path
+    @param Dict<String> types       Type of some of the columns, see schemas.py
+
+    @return DataFrame     First sheet of the workbook
+  """
+
+  df = pd.read_excel(file_path)
+
+  for column, column_type in types.items():
+    if column in df.columns and column_type in text_types:
+      df[column] = df[column].where(df[column].isnull(), df[column].astype(str))
+
+  return df
+
+
+# Readers of the file types a dataset can be given as. Spreadsheets are only
+# parsed once when there is a conversion cache.
+file_readers = {
+  'parquet': lambda file_path, columns, tag, cache: pd.read_parquet(file_path, columns=columns),
+  'feather': lambda file_path, columns, tag, cache: pd.read_feather(file_path, columns=columns),
+  'csv': lambda file_path, columns, tag, cache: read_csv(file_path, columns, schema_types(tag, columns)),
+  'xls': lambda file_path, columns, tag, cache: read_spreadsheet(file_path, columns, tag, cache),
+  'xlsx': lambda file_path, columns, tag, cache: read_spreadsheet(file_path, columns, tag, cache),
+}
+
+
+def schema_types(tag, columns=None):
+  """
+    @param String tag
+    @param List<String> columns     Defaults to every column of the schema
+
+    @return Dict<String>            Type of the columns in the schema of the tag
+  """
+
+  types = column_types.get(tag, {})
+
+  if columns:
+    types = {column: column_type for column, column_type in types.items() if column in columns}
+
+  return types
+
+
+def read_spreadsheet(file_path, columns=None, tag=None, conversion_cache=None):
+  """
+    A workbook is converted with the whole schema of its tag, whichever
+    columns are read, and its conversion is kept per tag and schema, so that
+    the text columns of a conversion do not depend on the query that made it.
+
+    @param String file_path
+    @param List<String> columns                 Defaults to every column
+    @param String tag
+    @param ConversionCache conversion_cache
+
+    @return DataFrame
+  """
+
+  types = schema_types(tag)
+
+  if conversion_cache is None:
+    df = read_excel(file_path, types)
+    return df[columns] if columns else df
+
+  variant = sha1(json.dumps([tag, types], sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+  return conversion_cache.read(file_path, lambda file_path: read_excel(file_path, types), columns, variant)
+
+
+def read_file(file_path, query=None, tag=None, conversion_cache=None):
+  """
+    @param String file_path
+    @param Query query                          Columns and rows to read, defaults to the whole file
+    @param String tag                           Tag of the dataset, whose schema the file is read with
+    @param ConversionCache conversion_cache     Where spreadsheets are kept once converted
+
+    @return DataFrame
+  """
+
+  file_type = path.splitext(file_path)[1][1:].lower()
+  columns = query.source_columns() if query else None
+
+  df = file_readers[file_type](file_path, columns, tag, conversion_cache)
+
+  return query.apply(df) if query else df
+
+
+def create_db_engine(db):
+  """
+    Create an engine whose connection pool bounds how many tables are
+    loaded at the same time.
+
+    @param Munch db
+
+    @return Engine
+  """
+
+  url = db.URL or 'postgresql://{}:{}@{}:{}/{}'.format(db.USER, db.PASSWORD, db.HOST, db.PORT, db.NAME)
+  connect_args = {}
+
+  # SQLite connections are shared between the loader threads
+  if url.startswith('sqlite'):
+    connect_args['check_same_thread'] = False
+
+  return sqlalchemy.create_engine(
+    url,
+    poolclass=sqlalchemy.pool.QueuePool,
+    pool_size=db.POOL_SIZE,
+    max_overflow=db.MAX_OVERFLOW,
+    connect_args=connect_args
+  )
+
+
+class DatabaseSource(object):
+
+  # Tables pulled from a database are worth keeping in the snapshot cache
+  cacheable = True
+
+  def __init__(self, db, tables):
+    """
+      @param Munch db               Connection settings, as settings.db
+      @param Dict<String> tables    Table of each tag
+    """
+
+    self.db = db
+    self.tables = tables
+    self.engine = None
+    self.types = {}
+    self.lock = Lock()
+
+
+  def connect(self):
+    """
+      @return Engine
+    """
+
+    with self.lock:
+      if self.engine is None:
+        self.engine = create_db_engine(self.db)
+
+    return self.engine
+
+
+  def dispose(self):
+    """
+      Forget the connections of the pool, e.g. in a forked process.
+    """
+
+    if self.engine is not None:
+      self.engine.dispose(close=False)
+
+
+  def qualified_table(self, tag):
+    """
+      @param String tag
+
+      @return String
+    """
+
+    return self.db.SCHEMA + '.' + self.tables[tag] if self.db.SCHEMA else self.tables[tag]
+
+
+  def describe(self, tag):
+    """
+      @param String tag
+
+      @return String
+    """
+
+    return self.tables[tag]
+
+
+  def column_types(self, tag):
+    """
+      Types of the columns of the table of a tag in the database, so that
+      queries can compare columns without casting them.
+
+      @param String tag
+
+      @return Dict<String>    'number' or 'text' by column, other types are left out
+    """
+
+    if not tag in self.types:
+      columns = sqlalchemy.inspect(self.connect()).get_columns(self.tables[tag], schema=self.db.SCHEMA or None)
+      types = {}
+
+      for column in columns:
+        try:
+          python_type = column['type'].python_type
+        except NotImplementedError:
+          continue
+
+        if python_type in [int, float, Decimal]:
+          types[column['name']] = 'number'
+        elif python_type is str:
+          types[column['name']] = 'text'
+
+      with self.lock:
+        self.types[tag] = types
+
+    return self.types[tag]
+
+
+  def read(self, tag, query=None):
+    """
+      Stream a table in chunks rather than fetching it in one piece.
+
+      @param String tag
+      @param Query query      Columns and rows to select, defaults to the whole table
+
+      @return DataFrame
+    """
+
+    query = (query or Query()).sql(self.qualified_table(tag), column_types=self.column_types(tag))
+
+    with self.connect().connect() as connection:
+      connection = connection.execution_options(stream_results=True)
+      chunks = list(pd.read_sql_query(query, connection, chunksize=self.db.CHUNK_SIZE))
+
+    if not chunks:
+      return pd.DataFrame()
+
+    return pd.concat(chunks, ignore_index=True)
+
+
+  def checksum(self, tag, query=None, df=None):
+    """
+      Fingerprint of the rows a query selects, which changes whenever a row
+      is added, removed or revised. PostgreSQL computes it in the database.
+      Other databases, such as the local SQLite stand-in, hash the rows.
+
+      @param String tag
+      @param Query query
+      @param DataFrame df     Rows of the query when they were just read
+
+      @return String
+    """
+
+    engine = self.connect()
+
+    if engine.dialect.name != 'postgresql':
+      return source_hash(df if df is not None else self.read(tag, query))
+
+    query = (query or Query()).sql(self.qualified_table(tag), checksum=True, column_types=self.column_types(tag))
+
+    with engine.connect() as connection:
+      return connection.execute(query).scalar() or ''
+
+
+class SnapshotSource(object):
+
+  # The snapshot files are local already
+  cacheable = False
+
+  # Preferred file types when a tag has several snapshot files
+  file_types = ['parquet', 'feather', 'csv', 'xlsx', 'xls']
+
+  def __init__(self, directory):
+    """
+      @param String directory
+    """
+
+    self.directory = directory
+
+
+  def connect(self):
+    raise RuntimeError('The snapshot directory {} is not a database'.format(self.directory))
+
+
+  def dispose(self):
+    pass
+
+
+  def describe(self, tag):
+    """
+      @param String tag
+
+      @return String      Snapshot file of the tag
+    """
+
+    for file_type in self.file_types:
+      file_path = path.join(self.directory, '{}.{}'.format(tag, file_type))
+      if path.exists(file_path):
+        return file_path
+
+    raise FileNotFoundError("No snapshot of '{}' in {}".format(tag, self.directory))
+
+
+  def read(self, tag, query=None):
+    """
+      @param String tag
+      @param Query query
+
+      @return DataFrame
+    """
+
+    return read_file(self.describe(tag), query, tag)
+
+
+  def checksum(self, tag, query=None, df=None):
+    """
+      @param String tag
+      @param Query query
+      @param DataFrame df
+
+      @return String
+    """
+
+    return source_hash(df if df is not None else self.read(tag, query))
+
+
+def create_source(source, db, tables):
+  """
+    @param Munch source           Backend settings, as settings.source
+    @param Munch db               Connection settings, as settings.db
+    @param Dict<String> tables    Table of each tag
+
+    @return DatabaseSource|SnapshotSource
+  """
+
+  if source.BACKEND == 'postgres':
+    return DatabaseSource(db, tables)
+
+  if source.BACKEND in ['sqlite', 'snapshot'] and not source.PATH:
+    raise ValueError("SOURCE_PATH must be set for the '{}' source backend".format(source.BACKEND))
+
+  if source.BACKEND == 'sqlite':
+    db = Munch(db, URL='sqlite:///' + path.abspath(source.PATH), SCHEMA=None)
+    return DatabaseSource(db, tables)
+
+  if source.BACKEND == 'snapshot':
+    return SnapshotSource(source.PATH)
+
+  raise ValueError("Unknown source backend '{}'".format(source.BACKEND))
+
+
+def export_snapshot(source, tags, directory):
+  """
+    Write every table of a source to a snapshot directory, in full, so that
+    the snapshot can answer any query. Tables are written as Parquet, or as
+    CSV when their columns mix types.
+
+    @param DatabaseSource|SnapshotSource source
+    @param List<String> tags
+    @param String directory
+
+    @return Dict<String>      Snapshot file of each tag
+  """
+
+  makedirs(directory, exist_ok=True)
+  files = {}
+
+  for tag in tags:
+    df = source.read(tag)
+    file_path = path.join(directory, tag + '.parquet')
+
+    try:
+      df.to_parquet(file_path, index=False)
+    except Exception as error:
+      print("Could not write {} as Parquet, writing CSV instead: {}".format(tag, error))
+
+      if path.exists(file_path):
+        remove(file_path)
+
+      file_path = path.join(directory, tag + '.csv')
+      df.to_csv(file_path, index=False)
+
+    print("Exported {} to {} ({} rows)".format(tag, file_path, len(df)))
+    files[tag] = file_path
+
+  return files
@@ -0,0 +1,443 @@
+"""
+  Uncertainty Propagation
+
+  Propagates the sampling error of the survey cells the estimates rest on,
+  the CBECS intensities, the RECS household averages and the MECS
+  consumption ratios, to percentile bands of every municipality, sector,
+  year and fuel.
+
+  Each published survey cell is drawn from a lognormal distribution with a
+  mean of its value and the relative standard error of its survey. The
+  consumption of a row is proportional to the coefficients it is scaled by,
+  so a draw of a row is its published consumption scaled by the ratio of
+  each drawn coefficient to its published value. Coefficients the
+  methodologies build from several cells are built again from every draw:
+
+    RECS    The household averages of all housing unit types are scaled to
+            Massachusetts together, by one ratio to the sum over the types,
+            so they move jointly.
+    CBECS   Suppressed cells are not drawn. They are filled in from the
+            drawn cells of every draw, with the mean of their column for elec
+            and ng, and from the office and natural gas intensities for fuel
+            oil, as the commercial methodology fills them.
+
+  Expenditure cells only enter the expenditures, which have no bands, and
+  are not drawn. The MassSave calibration is applied again to every draw.
+  Draws are an extra array axis, evaluated in batches, with no pipeline run
+  per draw.
+
+  Calibrated fuels of municipalities with MassSave data keep their MassSave
+  totals, so only their split between the commercial and the industrial
+  sectors varies.
+"""
+
+import numpy as np
+import pandas as pd
+from .factors import fuel_conversion, emissions_factors, year_factors
+from .residential import hu_type_map, hfc_hu_map
+from .rollups import subtotals
+
+
+fuels = ['elec', 'ng', 'foil']
+
+# Fuels scaled to MassSave by the calibration
+calibrated_fuels = ['elec', 'ng']
+
+# Relative standard error of the cells of each survey. EIA marks estimates
+# with an RSE above 50% as suppressed.
+relative_standard_errors = {
+  'cbecs': 0.1,
+  'recs': 0.1,
+  'mecs_fce': 0.1,
+  'mecs_euc': 0.1,
+}
+
+# Datasets needed to rebuild the coefficients and calibration of every row
+dataset_tags = ['cbecs_elec', 'cbecs_ng', 'cbecs_foil', 'recs_sc', 'recs_hfc', 'mecs_fce', 'masssave_res', 'masssave_ci']
+
+# Consumption columns of CBECS, per building and per worker
+cbecs_columns = ['c_blg', 'c_perwrkr']
+
+group_keys = ['vintage', 'muni_id', 'municipal', 'year', 'sector']
+
+
+def cbecs_model(datasets, years, error):
+  """
+    Drawn cells of the CBECS consumption intensities, and the intensity each
+    commercial row is scaled by. Rows use the intensity per worker, or per
+    building for fuel oil when there is none per worker.
+
+    @param Dict<DataFrame> datasets
+    @param List<Number> years     CBECS survey years in use
+    @param Number error           Relative standard error of a cell
+
+    @return Tuple<List<Number>,List<Number>,Function>   Value and error of every drawn cell, and the
+                                                        coefficient of each cbecs|year|activity|fuel
+                                                        for draws of the cells
+  """
+
+  values = []
+  tables = {}
+
+  for year in years:
+    for fuel in fuels:
+      cbecs = datasets['cbecs_'+fuel]
+      cbecs = cbecs[cbecs['years'] == year]
+      positions = {}
+
+      # Position of each observed cell among the drawn cells, -1 when suppressed
+      for column in cbecs_columns:
+        observed = cbecs[column].notnull().values
+        positions[column] = np.full(len(cbecs), -1)
+        positions[column][observed] = np.arange(observed.sum()) + len(values)
+        values.extend(cbecs[column].values[observed])
+
+      tables[(year, fuel)] = {
+        'activities': list(cbecs['activity']),
+        'labels': list(cbecs.index),
+        'positions': positions,
+      }
+
+  # Fuel oil rows line up with natural gas rows by index, as in the methodology
+  ng_rows = {
+    year: [tables[(year, 'ng')]['labels'].index(label) if label in tables[(year, 'ng')]['labels'] else None for label in tables[(year, 'foil')]['labels']]
+    for year in years
+  }
+
+  def coefficients(draws):
+    """
+      @param ndarray draws      Drawn cells by draws
+
+      @return Dict<ndarray>
+    """
+
+    filled = {}
+
+    for (year, fuel), table in tables.items():
+      for column, positions in table['positions'].items():
+        observed = positions >= 0
+        cells = np.full((len(positions), draws.shape[1]), np.nan)
+        cells[observed] = draws[positions[observed]]
+
+        # Option 2 in methodology, except for fuel oil
+        if fuel != 'foil' and observed.any():
+          cells[~observed] = cells[observed].mean(axis=0)
+
+        filled[(year, fuel, column)] = cells
+
+    # Option 1 in methodology for fuel oil, from the natural gas ratios
+    for year in years:
+      ng = filled[(year, 'ng', 'c_blg')]
+      foil = filled[(year, 'foil', 'c_blg')]
+      office_ng = ng[tables[(year, 'ng')]['activities'].index('office')]
+      office_foil = foil[tables[(year, 'foil')]['activities'].index('office')]
+
+      for row, ng_row in enumerate(ng_rows[year]):
+        if tables[(year, 'foil')]['positions']['c_blg'][row] < 0 and ng_row is not None:
+          foil[row] = office_foil + office_foil * (ng[ng_row] - office_ng) / ng[ng_row]
+
+    result = {}
+
+    for (year, fuel), table in tables.items():
+      for row, activity in enumerate(table['activities']):
+        column = 'c_blg' if fuel == 'foil' and table['positions']['c_perwrkr'][row] < 0 else 'c_perwrkr'
+        result['cbecs|{}|{}|{}'.format(year, activity, fuel)] = filled[(year, fuel, column)][row]
+
+    return result
+
+  return values, [error] * len(values), coefficients
+
+
+def recs_model(datasets, error):
+  """
+    Drawn cells of the RECS household averages, and the Massachusetts
+    averages of every housing unit type. The national averages are scaled by
+    one ratio, of the Massachusetts average to their sum weighted by the
+    share of each housing unit type in Massachusetts, as in recs_intensities.
+
+    @param Dict<DataFrame> datasets
+    @param Number error           Relative standard error of a cell
+
+    @return Tuple<List<Number>,List<Number>,Function>   Value and error of every drawn cell, and the
+                                                        coefficient of each recs|hu_type|fuel for draws
+                                                        of the cells
+  """
+
+  recs_sc = datasets['recs_sc']
+  shares = recs_sc.assign(hu_type=recs_sc['hu_type'].map(hu_type_map)).groupby('hu_type')['ma'].sum() / recs_sc['ma'].sum()
+  shares['total'] = 1.0
+
+  recs_hfc = datasets['recs_hfc']
+  national = recs_hfc[recs_hfc['geography'] == 'united states']
+  national = national.assign(hu_type=national['hu_type'].map(hfc_hu_map))
+  national = national[national['hu_type'].isin(shares.index)]
+  massachusetts = recs_hfc[recs_hfc['geography'] == 'massachusetts']
+
+  hu_types = sorted(national['hu_type'].unique())
+  hu_rows = np.array([hu_types.index(hu_type) for hu_type in national['hu_type']])
+  weights = np.array([0.0 if hu_type == 'total' else shares[hu_type] for hu_type in hu_types])[:, np.newaxis]
+
+  values = []
+  positions = {}
+
+  for fuel in fuels:
+    averages = national['avg_'+fuel].values
+    observed = ~np.isnan(averages)
+
+    positions[fuel] = (len(values), observed)
+    values.extend(averages[observed])
+    values.append(massachusetts['avg_'+fuel].values[0])
+
+  def coefficients(draws):
+    """
+      @param ndarray draws      Drawn cells by draws
+
+      @return Dict<ndarray>
+    """
+
+    result = {}
+
+    for fuel, (start, observed) in positions.items():
+      end = start + observed.sum()
+
+      # Averages of the RECS rows grouped into each housing unit type
+      averages = np.zeros((len(hu_types), draws.shape[1]))
+      np.add.at(averages, hu_rows[observed], draws[start:end])
+
+      ratio = draws[end] / (averages * weights).sum(axis=0)
+
+      for position, hu_type in enumerate(hu_types):
+        result['recs|{}|{}'.format(hu_type, fuel)] = averages[position] * ratio
+
+    return result
+
+  return values, [error] * len(values), coefficients
+
+
+def mecs_model(names, errors):
+  """
+    MECS cells are drawn on their own, as multipliers of their published
+    value.
+
+    @param List<String> names     mecs_fce|year|naicstitle and mecs_euc|year|naicstitle|fuel cells
+    @param Dict<Number> errors    Relative standard errors
+
+    @return Tuple<List<Number>,List<Number>,Function>
+  """
+
+  names = sorted(names)
+
+  def coefficients(draws):
+    return dict(zip(names, draws))
+
+  return [1.0] * len(names), [errors[name.split('|')[0]] for name in names], coefficients
+
+
+def coefficient_cells(detail, fuel, datasets, vintages):
+  """
+    Name the two coefficients each row of a fuel is scaled by. Rows scaled
+    by a single coefficient get 'none' as their second.
+
+    @param DataFrame detail     Rows of every sector
+    @param String fuel
+    @param Dict<DataFrame> datasets
+    @param List<Vintage> vintages
+
+    @return Tuple<Series,Series>
+  """
+
+  vintages = {vintage.year: vintage for vintage in vintages}
+  cbecs_years = datasets['cbecs_elec']['years'].unique()
+  mecs_years = datasets['mecs_fce']['years'].unique()
+
+  cbecs_year = detail['vintage'].map(lambda year: vintages[year].survey_year('cbecs', cbecs_years))
+  mecs_year = detail['vintage'].map(lambda year: vintages[year].survey_year('mecs', mecs_years))
+
+  sector = detail['sector']
+  first = pd.Series('none', index=detail.index)
+  second = pd.Series('none', index=detail.index)
+
+  # CBECS intensity of each activity
+  commercial = sector == 'commercial'
+  first[commercial] = 'cbecs|' + cbecs_year[commercial].astype(str) + '|' + detail.loc[commercial, 'activity'].str.lower() + '|' + fuel
+
+  # RECS household average of each housing unit type
+  residential = sector == 'residential'
+  first[residential] = 'recs|' + detail.loc[residential, 'hu_type'].astype(str) + '|' + fuel
+
+  # MECS consumption per employee, and the share of each fuel
+  industrial = sector == 'industrial'
+  first[industrial] = 'mecs_fce|' + mecs_year[industrial].astype(str) + '|' + detail.loc[industrial, 'naicstitle'].astype(str)
+  second[industrial] = 'mecs_euc|' + mecs_year[industrial].astype(str) + '|' + detail.loc[industrial, 'naicstitle'].astype(str) + '|' + fuel
+
+  return first, second
+
+
+def masssave_calibrated(datasets, fuel):
+  """
+    @param Dict<DataFrame> datasets
+    @param String fuel
+
+    @return DataFrame     pool, muni_id and year of every calibrated municipality
+  """
+
+  column = {'elec': 'mwh_use', 'ng': 'therm_use'}[fuel]
+  calibrated = []
+
+  for pool, tag in [('residential', 'masssave_res'), ('ci', 'masssave_ci')]:
+    masssave = datasets[tag].drop_duplicates(['muni_id', 'cal_year'])
+    masssave = masssave[masssave[column].notnull()]
+    calibrated.append(pd.DataFrame({'pool': pool, 'muni_id': masssave['muni_id'].values, 'year': masssave['cal_year'].values}))
+
+  return pd.concat(calibrated, ignore_index=True)
+
+
+def group_sums(values, groups, count):
+  """
+    Sum the rows of a 2d array within each group.
+
+    @param ndarray values     Rows by draws
+    @param ndarray groups     Group of each row, from 0 to count
+    @param Number count
+
+    @return ndarray           Groups by draws
+  """
+
+  order = np.argsort(groups, kind='mergesort')
+  sorted_groups = groups[order]
+
+  sums = np.zeros((count, values.shape[1]))
+  present = np.unique(sorted_groups)
+  sums[present] = np.add.reduceat(values[order], np.searchsorted(sorted_groups, present), axis=0)
+
+  return sums
+
+
+def propagate(sector_data, datasets, vintages, draws=1000, percentiles=[5, 50, 95], batch_size=100, seed=0, errors=relative_standard_errors):
+  """
+    @param Dict<DataFrame> sector_data    Published estimates of each sector
+    @param Dict<DataFrame> datasets       The datasets in dataset_tags
+    @param List<Vintage> vintages
+    @param Number draws
+    @param List<Number> percentiles
+    @param Number batch_size              Draws evaluated at once
+    @param Number seed
+    @param Dict<Number> errors            Relative standard errors, see relative_standard_errors
+
+    @return DataFrame     Published totals and percentile bands of every municipality, year, sector and fuel
+  """
+
+  rng = np.random.RandomState(seed)
+  label_columns = ['activity', 'naicstitle', 'hu_type']
+  pu_columns = [fuel+'_con_pu' for fuel in fuels]
+
+  detail = pd.concat([
+    df[[column for column in group_keys + label_columns + pu_columns if column in df.columns]].assign(sector=sector)
+    for sector, df in sector_data.items()
+  ], ignore_index=True, sort=False)
+  detail['municipal'] = detail['municipal'].astype(str)
+
+  # Subtotal rows are calibrated with the others but not summed into the totals
+  counted = pd.Series(True, index=detail.index)
+  for column, value in subtotals.items():
+    if column in detail.columns:
+      counted &= detail[column] != value
+
+  groups = detail[group_keys].drop_duplicates().sort_values(group_keys).reset_index(drop=True)
+  group_index = pd.merge(detail[group_keys], groups.reset_index(), on=group_keys, how='left')['index'].values
+  group_index = np.where(counted, group_index, len(groups))
+
+  detail['pool'] = np.where(detail['sector'] == 'residential', 'residential', 'ci')
+  pools = detail[['pool', 'vintage', 'muni_id', 'year']].drop_duplicates().reset_index(drop=True)
+  pool_index = pd.merge(detail[['pool', 'vintage', 'muni_id', 'year']], pools.reset_index(), how='left')['index'].values
+
+  groups['pool'] = np.where(groups['sector'] == 'residential', 'residential', 'ci')
+  group_pools = pd.merge(groups, pools.reset_index(), how='left', on=['pool', 'vintage', 'muni_id', 'year'])['index'].values
+
+  # Coefficients of every row, and the models of the cells they are built from
+  cells = {fuel: coefficient_cells(detail, fuel, datasets, vintages) for fuel in fuels}
+  mecs_names = set(name for first, second in cells.values() for name in pd.concat([first, second]).unique() if name.startswith('mecs'))
+
+  vintage_map = {vintage.year: vintage for vintage in vintages}
+  cbecs_years = sorted(set(vintage_map[year].survey_year('cbecs', datasets['cbecs_elec']['years'].unique()) for year in detail.loc[detail['sector'] == 'commercial', 'vintage'].unique()))
+
+  models = [
+    cbecs_model(datasets, cbecs_years, errors['cbecs']),
+    recs_model(datasets, errors['recs']),
+    mecs_model(mecs_names, errors),
+  ]
+
+  values = np.array([value for model in models for value in model[0]], dtype=float)
+  cell_errors = np.array([error for model in models for error in model[1]], dtype=float)
+  bounds = np.cumsum([0] + [len(model[0]) for model in models])
+
+  def coefficients(draws):
+    result = {'none': np.ones(draws.shape[1])}
+
+    for model, start, end in zip(models, bounds[:-1], bounds[1:]):
+      result.update(model[2](draws[start:end]))
+
+    return result
+
+  published_coefficients = coefficients(values[:, np.newaxis])
+
+  # Lognormal with a mean of the published value and the relative standard error of each cell
+  sigma = np.sqrt(np.log1p(cell_errors ** 2))[:, np.newaxis]
+
+  published = {fuel: np.nan_to_num(detail[fuel+'_con_pu'].to_numpy(dtype=float)) for fuel in fuels}
+  group_draws = {fuel: np.zeros((len(groups) + 1, draws)) for fuel in fuels}
+  pool_draws = {fuel: np.zeros((len(pools), draws)) for fuel in fuels}
+
+  for start in range(0, draws, batch_size):
+    size = min(batch_size, draws - start)
+    samples = values[:, np.newaxis] * np.exp(sigma * rng.standard_normal((len(values), size)) - sigma ** 2 / 2)
+    drawn_coefficients = coefficients(samples)
+
+    for fuel in fuels:
+      first, second = cells[fuel]
+      names = sorted(set(first) | set(second))
+      position = {name: index for index, name in enumerate(names)}
+
+      # Ratio of each drawn coefficient to its published value. Rows whose
+      # coefficient is missing or zero have no consumption to scale.
+      with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = np.vstack([drawn_coefficients[name] / published_coefficients[name] for name in names])
+
+      ratios = np.where(np.isfinite(ratios), ratios, 1.0)
+
+      estimates = published[fuel][:, np.newaxis] * ratios[first.map(position).values] * ratios[second.map(position).values]
+      group_draws[fuel][:, start:start+size] = group_sums(estimates, group_index, len(groups) + 1)
+      pool_draws[fuel][:, start:start+size] = group_sums(estimates, pool_index, len(pools))
+
+  bands = []
+
+  for fuel in fuels:
+    fuel_draws = group_draws[fuel][:len(groups)]
+
+    # Calibrating a draw scales its pool back to the MassSave total
+    if fuel in calibrated_fuels:
+      pool_published = group_sums(published[fuel][:, np.newaxis], pool_index, len(pools))[:, 0]
+      calibrated = pd.merge(pools, masssave_calibrated(datasets, fuel).assign(calibrated=True), how='left', on=['pool', 'muni_id', 'year'])['calibrated'].fillna(False).values
+
+      with np.errstate(divide='ignore', invalid='ignore'):
+        scale = pool_published[:, np.newaxis] / pool_draws[fuel]
+
+      scale = np.where(calibrated[:, np.newaxis] & (pool_draws[fuel] > 0), scale, 1.0)
+      fuel_draws = fuel_draws * scale[group_pools]
+
+    conversion = year_factors(fuel_conversion[fuel], groups['year'].values)
+    emissions = year_factors(emissions_factors[fuel], groups['year'].values)
+    band = groups[group_keys].assign(fuel=fuel)
+
+    published_totals = group_sums(published[fuel][:, np.newaxis], group_index, len(groups) + 1)[:len(groups), 0]
+    band['con_mmbtu'] = published_totals * conversion
+    band['emissions_co2'] = published_totals * emissions
+
+    quantiles = np.percentile(fuel_draws, percentiles, axis=1)
+    for percentile, values in zip(percentiles, quantiles):
+      band['con_mmbtu_p{}'.format(percentile)] = values * conversion
+      band['emissions_co2_p{}'.format(percentile)] = values * emissions
+
+    bands.append(band)
+
+  return pd.concat(bands, ignore_index=True).sort_values(group_keys + ['fuel']).reset_index(drop=True)
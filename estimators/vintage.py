@@ -0,0 +1,50 @@
+"""
+  Class: Vintage
+
+  The year of every source dataset that goes into one set of estimates.
+  ES-202 is taken for the vintage year and ACS for the five-year span ending
+  in it. CBECS and MECS are surveyed every few years, so unless they are
+  pinned, the latest survey up to the vintage year is used.
+"""
+
+
+class Vintage(object):
+
+  def __init__(self, year, acs_year=None, cbecs_year=None, mecs_year=None):
+    """
+      @param Number year
+      @param String acs_year      e.g. '2011-15', defaults to the five years ending in year
+      @param Number cbecs_year
+      @param Number mecs_year
+    """
+
+    self.year = int(year)
+    self.acs_year = acs_year or '{}-{}'.format(self.year - 4, str(self.year)[2:])
+    self.cbecs_year = cbecs_year
+    self.mecs_year = mecs_year
+
+
+  def survey_year(self, survey, years):
+    """
+      @param String survey        'cbecs' or 'mecs'
+      @param List<Number> years   Years the survey is available for
+
+      @return Number
+    """
+
+    pinned = getattr(self, survey + '_year')
+    if pinned:
+      return pinned
+
+    years = [int(year) for year in years]
+    earlier = [year for year in years if year <= self.year]
+
+    return max(earlier) if earlier else min(years)
+
+
+  def __repr__(self):
+    return 'Vintage({})'.format(self.year)
+
+
+# The vintage estimated when none is requested
+default_vintage = Vintage(2015, acs_year='2011-15', cbecs_year=2012, mecs_year=2010)
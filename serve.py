@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+"""
+  serve.py
+
+  Serves the sector datasets published by estimate.py over a read-only HTTP
+  API, from memory. The datasets are reloaded as soon as a new run is
+  published. See estimators/api.py for the endpoints.
+
+  Arguments:
+
+    --host:         Address to listen on. Defaults to 0.0.0.0.
+
+    --port:         Port to listen on. Defaults to 8000.
+
+    --cache-size:   Number of rendered responses kept in memory. Defaults to 256.
+
+    --reload-interval:
+                    Seconds between checks for a newly published run. Defaults to 5.
+"""
+
+import sys
+import estimators
+from getopt import getopt
+from os import environ, path
+
+FILES_PATH = environ['FILES_PATH']
+OUTPUT_DIR = path.join(FILES_PATH, 'output')
+SECTOR_DIR = path.join(OUTPUT_DIR, 'sectors')
+FINGERPRINT_PATH = path.join(OUTPUT_DIR, 'fingerprint.json')
+
+SECTORS = ['commercial', 'industrial', 'residential']
+
+
+# Get command line arguments
+long_options = ['host=', 'port=', 'cache-size=', 'reload-interval=']
+
+options = getopt(sys.argv[1:], '', long_options)[0]
+
+host = '0.0.0.0'
+port = 8000
+cache_size = 256
+reload_interval = 5
+
+for opt, arg in options:
+  if opt == '--host':
+    host = arg.strip()
+  elif opt == '--port':
+    port = int(arg)
+  elif opt == '--cache-size':
+    cache_size = int(arg)
+  elif opt == '--reload-interval':
+    reload_interval = float(arg)
+
+
+# The fingerprint is written last, once every sector file is published
+estimates = estimators.PublishedEstimates(SECTOR_DIR, SECTORS, FINGERPRINT_PATH, reload_interval)
+server = estimators.create_server(estimators.QueryApi(estimates, cache_size), host, port)
+
+print('Serving the published estimates on {}:{}...'.format(host, port))
+
+try:
+  server.serve_forever()
+except KeyboardInterrupt:
+  server.server_close()
@@ -0,0 +1,58 @@
+"""
+  Fixtures shared by the tests. The database is a SQLite file standing in
+  for PostgreSQL, as with SOURCE_BACKEND=sqlite.
+"""
+
+import sys
+import sqlite3
+import pytest
+import pandas as pd
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from estimators import Estimator
+from estimators.settings import settings
+
+
+def write_tables(db_path, tables):
+  """
+    @param String db_path
+    @param Dict<DataFrame> tables     Rows of each table
+  """
+
+  with sqlite3.connect(db_path) as connection:
+    for table, df in tables.items():
+      df.to_sql(table, connection, index=False, if_exists='replace')
+
+
+@pytest.fixture
+def sqlite_db(tmp_path, monkeypatch):
+  """
+    Point the source backend at an empty SQLite file, with a pool of two
+    connections and chunks of two rows, and start from an empty data store.
+
+    @return String      Path of the database file
+  """
+
+  db_path = str(tmp_path / 'lead.db')
+  sqlite3.connect(db_path).close()
+
+  monkeypatch.setitem(settings.source, 'BACKEND', 'sqlite')
+  monkeypatch.setitem(settings.source, 'PATH', db_path)
+  monkeypatch.setitem(settings.db, 'POOL_SIZE', 2)
+  monkeypatch.setitem(settings.db, 'MAX_OVERFLOW', 0)
+  monkeypatch.setitem(settings.db, 'CHUNK_SIZE', 2)
+
+  monkeypatch.setattr(Estimator, 'source', None)
+  monkeypatch.setattr(Estimator, 'snapshot_cache', None)
+  monkeypatch.setattr(Estimator, 'loaded_municipalities', None)
+  monkeypatch.setattr(Estimator, 'load_report', {})
+  Estimator.loaded_data.clear()
+
+  yield db_path
+
+  if Estimator.source is not None and Estimator.source.engine is not None:
+    Estimator.source.engine.dispose()
+
+  Estimator.loaded_data.clear()
@@ -0,0 +1,103 @@
+import json
+import pytest
+import pandas as pd
+from os import utime
+from threading import Thread
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError
+from estimators import PublishedEstimates, QueryApi, create_server
+
+
+def write_sector(directory, elec):
+  """
+    @param Path directory
+    @param List<Number> elec      elec_con_mmbtu of Boston and Braintree
+  """
+
+  pd.DataFrame({
+    'muni_id': [35, 36],
+    'municipal': ['Boston', 'Braintree'],
+    'year': [2015, 2015],
+    'hu_type': ['u1d', 'u1d'],
+    'elec_con_mmbtu': elec,
+  }).to_csv(str(directory / 'residential-data.csv'), index=False)
+
+
+def mark_published(directory, mtime):
+  """
+    Write the fingerprint, which marks a run published.
+
+    @param Path directory
+    @param Number mtime           Modification time of the fingerprint
+  """
+
+  fingerprint = directory / 'fingerprint.json'
+  fingerprint.write_text(json.dumps({'published': mtime}))
+  utime(str(fingerprint), (mtime, mtime))
+
+
+@pytest.fixture
+def api(tmp_path):
+  write_sector(tmp_path, [1.5, 2.5])
+  mark_published(tmp_path, 1000000000)
+  estimates = PublishedEstimates(str(tmp_path), ['commercial', 'residential'], str(tmp_path / 'fingerprint.json'), reload_interval=0)
+
+  return QueryApi(estimates)
+
+
+def test_unchanged_responses_are_not_modified(api):
+  status, headers, body = api.handle('/sectors/residential?municipal=boston&columns=elec_con_mmbtu')
+
+  assert status == 200
+  assert json.loads(body.decode('utf-8')) == {'sector': 'residential', 'rows': 1, 'data': [{'elec_con_mmbtu': 1.5}]}
+
+  status, not_modified, body = api.handle('/sectors/residential?columns=elec_con_mmbtu&municipal=boston', headers['ETag'])
+
+  assert status == 304
+  assert not_modified['ETag'] == headers['ETag']
+  assert body == b''
+
+
+def test_unknown_sectors_and_routes_are_not_found(api):
+  assert api.handle('/sectors/commercial')[0] == 404
+  assert api.handle('/sectors/transportation')[0] == 404
+  assert api.handle('/municipalities')[0] == 404
+  assert api.handle('/sectors/residential?columns=gas')[0] == 400
+
+
+def test_new_runs_are_loaded_once_their_fingerprint_changes(api, tmp_path):
+  status, headers, body = api.handle('/sectors/residential?group_by=year')
+  assert json.loads(body.decode('utf-8'))['data'] == [{'year': 2015, 'elec_con_mmbtu': 4.0}]
+
+  # A sector file is not published until the fingerprint is written
+  write_sector(tmp_path, [3.5, 4.5])
+  assert api.handle('/sectors/residential?group_by=year', headers['ETag'])[0] == 304
+
+  mark_published(tmp_path, 1000000100)
+  status, reloaded, body = api.handle('/sectors/residential?group_by=year', headers['ETag'])
+
+  assert status == 200
+  assert reloaded['ETag'] != headers['ETag']
+  assert json.loads(body.decode('utf-8'))['data'] == [{'year': 2015, 'elec_con_mmbtu': 8.0}]
+
+
+def test_server_answers_over_http(api):
+  server = create_server(api, '127.0.0.1', 0)
+  Thread(target=server.serve_forever, daemon=True).start()
+  url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+  try:
+    with urlopen(url + '/health') as response:
+      etag = response.headers['ETag']
+      assert json.loads(response.read().decode('utf-8'))['status'] == 'ok'
+
+    with pytest.raises(HTTPError) as error:
+      urlopen(Request(url + '/health', headers={'If-None-Match': etag}))
+    assert error.value.code == 304
+
+    with pytest.raises(HTTPError) as error:
+      urlopen(url + '/sectors/transportation')
+    assert error.value.code == 404
+  finally:
+    server.shutdown()
+    server.server_close()
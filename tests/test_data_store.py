@@ -0,0 +1,73 @@
+import pytest
+import pandas as pd
+from estimators.data_store import DataStore
+
+
+# Arrays are only flagged where pandas keeps its blocks in _mgr
+frozen = pytest.mark.skipif(not hasattr(pd.DataFrame(), '_mgr'), reason='pandas without block managers')
+
+
+def store_with(df):
+  """
+    @param DataFrame df
+
+    @return DataStore
+  """
+
+  store = DataStore()
+  store['eowld'] = df
+
+  return store
+
+
+def dataset():
+  return pd.DataFrame({
+    'muni_id': [35, 36],
+    'avgemp': [10.0, 20.0],
+    'municipal': ['Boston', 'Braintree'],
+  })
+
+
+@frozen
+def test_views_cannot_write_into_the_stored_dataset():
+  store = store_with(dataset())
+  view = store['eowld']
+
+  with pytest.raises(ValueError):
+    view.iloc[0, 1] = 0.0
+
+  with pytest.raises(ValueError):
+    view.loc[0, 'muni_id'] = 0
+
+  with pytest.raises(ValueError):
+    view['avgemp'].values[0] = 0.0
+
+  assert store['eowld'].equals(dataset())
+
+
+def test_views_can_be_reshaped_without_reaching_the_stored_dataset():
+  store = store_with(dataset())
+  view = store['eowld']
+
+  view['avgemp'] = view['avgemp'] * 2
+  view['estab'] = 1
+  renamed = view.rename(columns={'muni_id': 'id'}).assign(share=lambda df: df['avgemp'] / df['avgemp'].sum())
+  view.drop('municipal', axis=1, inplace=True)
+
+  assert renamed['share'].tolist() == [1 / 3, 2 / 3]
+  assert view.columns.tolist() == ['muni_id', 'avgemp', 'estab']
+  assert store['eowld'].equals(dataset())
+
+
+def test_datasets_are_dropped_after_their_last_consumer():
+  store = store_with(dataset())
+  store['recs_sc'] = pd.DataFrame({'ma': [1.0]})
+  store.expect('commercial', ['eowld', 'recs_sc'])
+  store.expect('residential', ['recs_sc'])
+
+  assert store.release('commercial') == ['eowld']
+  assert list(store) == ['recs_sc']
+
+  assert store.release('residential') == ['recs_sc']
+  assert store.resident_size() == 0
+  assert store.report()['released_after'] == {'eowld': 'commercial', 'recs_sc': 'residential'}
@@ -0,0 +1,99 @@
+import sqlite3
+import sqlalchemy
+import pandas as pd
+from threading import Lock
+from time import sleep
+from estimators import Estimator, Query, SnapshotCache
+from conftest import write_tables
+
+
+eowld = pd.DataFrame({
+  'muni_id': [35, 35, 35, 36, 36],
+  'municipal': ['Boston', 'Boston', 'Boston', 'Braintree', 'Braintree'],
+  'naicscode': ['445', '611', '31-33', '445', '722'],
+  'naicstitle': ['Food stores', 'Education', 'Manufacturing', 'Food stores', 'Food service'],
+  'avgemp': [10, 20, 30, 40, 50],
+  'estab': [1, 2, 3, 4, 5],
+  'cal_year': [2015, 2015, 2015, 2014, 2015],
+})
+
+recs_sc = pd.DataFrame({
+  'hu_type': ['Single-family detached', 'Apartments in 5+ unit buildings'],
+  'ma': [1.4, 0.6],
+})
+
+eowld_query = Query(
+  ['muni_id', 'municipal', 'naicscode', 'avgemp', 'cal_year'],
+  [('naicscode', '>=', 400), ('naicscode', '<=', 1000), ('cal_year', 'in', [2015])]
+)
+
+
+def test_prefetch_streams_every_table_through_a_bounded_pool(sqlite_db):
+  write_tables(sqlite_db, {
+    Estimator.database_tag_map['eowld']: eowld,
+    Estimator.database_tag_map['recs_sc']: recs_sc,
+    Estimator.database_tag_map['acs_uis']: pd.DataFrame({'muni_id': [35], 'municipal': ['Boston']}),
+  })
+
+  engine = Estimator.data_source().connect()
+  assert isinstance(engine.pool, sqlalchemy.pool.QueuePool)
+  assert engine.pool.size() == 2
+
+  # Hold every connection a moment, so that the loads overlap
+  checked_out = {'now': 0, 'most': 0}
+  lock = Lock()
+
+  @sqlalchemy.event.listens_for(engine, 'checkout')
+  def checkout(*args):
+    with lock:
+      checked_out['now'] += 1
+      checked_out['most'] = max(checked_out['most'], checked_out['now'])
+    sleep(0.05)
+
+  @sqlalchemy.event.listens_for(engine, 'checkin')
+  def checkin(*args):
+    with lock:
+      checked_out['now'] -= 1
+
+  Estimator.prefetch([('eowld', eowld_query), 'recs_sc', 'acs_uis'], [])
+
+  assert checked_out['most'] == 2
+  assert checked_out['now'] == 0
+
+  loaded = Estimator.loaded_data[eowld_query.key('eowld')]
+  assert loaded[['muni_id', 'naicscode', 'avgemp']].values.tolist() == [[35, 445, 10], [35, 611, 20], [36, 722, 50]]
+  assert Estimator.loaded_data['recs_sc']['ma'].sum() == 2.0
+  assert set(Estimator.load_report) == {eowld_query.key('eowld'), 'recs_sc', 'acs_uis'}
+
+
+def test_filters_compare_text_columns_with_the_text_of_numbers(sqlite_db):
+  write_tables(sqlite_db, {Estimator.database_tag_map['eowld']: eowld})
+
+  source = Estimator.data_source()
+  assert source.column_types('eowld')['naicscode'] == 'text'
+  assert source.column_types('eowld')['cal_year'] == 'number'
+
+  query = Query(['muni_id', 'naicscode'], [('naicscode', 'in', [445]), ('municipal', 'ieq', 'BOSTON')])
+  sql = str(query.sql('econ_es202_naics_3d_m', column_types=source.column_types('eowld')))
+
+  assert 'CAST' not in sql
+  assert source.read('eowld', query).values.tolist() == [[35, '445']]
+
+
+def test_snapshots_are_reused_until_their_rows_change(sqlite_db, tmp_path):
+  write_tables(sqlite_db, {Estimator.database_tag_map['recs_sc']: recs_sc})
+  Estimator.snapshot_cache = SnapshotCache(str(tmp_path / 'cache'))
+
+  Estimator.load('recs_sc', [])
+  assert Estimator.load_report['recs_sc']['source'] == Estimator.database_tag_map['recs_sc']
+  assert Estimator.snapshot_cache.stale(Estimator.checksum) == []
+
+  Estimator.loaded_data.clear()
+  Estimator.load('recs_sc', [])
+  assert Estimator.load_report['recs_sc']['source'] == Estimator.snapshot_cache.path('recs_sc')
+
+  # A revision that keeps the size of the table is still found
+  with sqlite3.connect(sqlite_db) as connection:
+    connection.execute('UPDATE {} SET ma = ma + 1'.format(Estimator.database_tag_map['recs_sc']))
+
+  assert Estimator.snapshot_cache.stale(Estimator.checksum) == ['recs_sc']
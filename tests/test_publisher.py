@@ -0,0 +1,72 @@
+import pytest
+import sqlalchemy
+import pandas as pd
+from munch import Munch
+from estimators import DatabaseSource, Query, publish
+from estimators.settings import settings
+
+
+def published_source(db_path):
+  """
+    @param String db_path
+
+    @return DatabaseSource    Reading the published commercial table back
+  """
+
+  db = Munch(settings.db, URL='sqlite:///' + db_path, SCHEMA=None)
+  return DatabaseSource(db, {'commercial': 'mapc_lead_commercial'})
+
+
+def estimates(rows):
+  """
+    @param Number rows
+
+    @return DataFrame
+  """
+
+  return pd.DataFrame({
+    'muni_id': [35 + row % 2 for row in range(rows)],
+    'year': [2015] * rows,
+    'activity': ['office'] * rows,
+    'elec_con_mmbtu': [float(row) for row in range(rows)],
+  })
+
+
+def test_publish_swaps_in_the_staging_table(sqlite_db):
+  source = published_source(sqlite_db)
+  engine = source.connect()
+
+  publish(estimates(5), 'mapc_lead_commercial', engine)
+  publish(estimates(3), 'mapc_lead_commercial', engine)
+
+  inspector = sqlalchemy.inspect(engine)
+  assert inspector.get_table_names() == ['mapc_lead_commercial']
+  assert sorted(index['name'] for index in inspector.get_indexes('mapc_lead_commercial')) == [
+    'mapc_lead_commercial_muni_id_idx',
+    'mapc_lead_commercial_year_idx',
+  ]
+
+  # The published rows load back like any other table
+  df = source.read('commercial')
+  assert df.drop('index', axis=1).equals(estimates(3))
+
+  boston = source.read('commercial', Query(['muni_id', 'elec_con_mmbtu'], [('muni_id', '==', 35)]))
+  assert boston['elec_con_mmbtu'].tolist() == [0.0, 2.0]
+
+  engine.dispose()
+
+
+def test_failed_publish_keeps_the_live_table(sqlite_db):
+  source = published_source(sqlite_db)
+  engine = source.connect()
+
+  publish(estimates(3), 'mapc_lead_commercial', engine)
+
+  # Values SQLite cannot store fail the staging load, before the swap
+  broken = estimates(3).assign(activity=[{'office': 1}] * 3)
+  with pytest.raises(sqlalchemy.exc.SQLAlchemyError):
+    publish(broken, 'mapc_lead_commercial', engine)
+
+  assert source.read('commercial').drop('index', axis=1).equals(estimates(3))
+
+  engine.dispose()